@@ -0,0 +1,89 @@
+"""Concurrent /ticket claim on one ticket: exactly one staff member may win.
+
+    python -m bench.claim_race --backend sqlite --staff 50 --rounds 20
+
+Each round opens a ticket and has ``--staff`` support members run the claim
+command on it at the same moment. The round passes when exactly one of them
+gets "Ticket claimed!", everyone else is told who holds it, the channel gets
+a single claim announcement, and the stored claimer is the winner. The
+winner then claims again and must get "already claimed" without a second
+announcement. Exits non-zero on the first failed round.
+"""
+import argparse
+import asyncio
+import sys
+
+from bench.run import configure_env, fake_guild, start_backend
+
+CLAIMED = "Ticket claimed!"
+ALREADY_YOURS = "You have already claimed this ticket."
+
+
+async def run_round(cog, guild, staff, creator):
+    from bench.fakes import FakeInteraction
+    from db.db_interface import db_get_ticket
+    from utils.botutils import create_ticket
+
+    ticket_id = await create_ticket(guild, creator, guild.support_role.id)
+    channel = guild.ticket_channels[creator.id]
+    announced = len(channel.messages)
+    interactions = [FakeInteraction(guild, member, channel) for member in staff]
+    await asyncio.gather(*(cog.claim_ticket_command.callback(cog, i) for i in interactions))
+
+    winners = [i.user for i in interactions if i.replies == [CLAIMED]]
+    if len(winners) != 1:
+        return f"ticket {ticket_id}: {len(winners)} staff members were told they claimed it"
+    winner = winners[0]
+    losers = [i for i in interactions if i.user != winner]
+    expected = f"Ticket already claimed by <@{winner.id}>."
+    wrong = [i.replies for i in losers if i.replies != [expected]]
+    if wrong:
+        return f"ticket {ticket_id}: {len(wrong)} losing claims got {wrong[0]!r}"
+    if len(channel.messages) - announced != 1:
+        return f"ticket {ticket_id}: {len(channel.messages) - announced} claim announcements"
+    ticket = await db_get_ticket(ticket_id)
+    if int(ticket["claimed_by"]) != winner.id:
+        return f"ticket {ticket_id}: stored claimer {ticket['claimed_by']} is not the winner {winner.id}"
+
+    again = FakeInteraction(guild, winner, channel)
+    await cog.claim_ticket_command.callback(cog, again)
+    if again.replies != [ALREADY_YOURS] or len(channel.messages) - announced != 1:
+        return f"ticket {ticket_id}: re-claim by the winner got {again.replies!r}"
+    return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--staff", type=int, default=50, help="Staff members claiming each ticket at once")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    configure_env(args.backend)
+
+    from bench.fakes import FakeAPI
+    from cogs.TicketCog import TicketCog
+    from db.db_interface import db_close
+    from utils.lifecycle import lifecycle
+
+    await start_backend(args.backend)
+    guild = fake_guild(FakeAPI(args.latency_ms, jitter_ms=args.latency_ms / 2, seed=1))
+    staff = [guild.add_member(staff=True) for _ in range(args.staff)]
+    cog = TicketCog(None)
+    failure = None
+    try:
+        for _ in range(args.rounds):
+            failure = await run_round(cog, guild, staff, guild.add_member())
+            if failure:
+                break
+        await lifecycle.shutdown()
+    finally:
+        await db_close()
+    if failure:
+        print(f"FAIL {failure}")
+        sys.exit(1)
+    print(f"ok: {args.rounds} rounds, {args.staff} concurrent claims each, one winner per ticket")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,218 @@
+"""In-memory stand-ins for the discord.py objects the ticket flows touch.
+
+Every call that would be a Discord REST request goes through ``FakeAPI``.
+It sleeps for a simulated latency and answers a configurable share of calls with a 429.
+With ``max_ratelimit_timeout`` below the retry-after, the 429s surface as
+``discord.RateLimited``, which exercises the retries in
+utils/restscheduler.py. Only what the bot's code paths use is implemented.
+"""
+import asyncio
+import itertools
+import random
+from datetime import datetime, timezone
+
+import discord
+
+_ids = itertools.count(1_100_000_000_000_000_000)
+
+
+def next_id():
+    return next(_ids)
+
+
+class FakeAPI:
+    """Simulated REST round trips.
+
+    A rate-limited call behaves like discord.py's HTTPClient. It waits
+    ``retry_after`` and retries, unless that exceeds ``max_ratelimit_timeout``,
+    in which case it raises ``discord.RateLimited``.
+    """
+
+    def __init__(self, latency_ms=50.0, jitter_ms=20.0, rate_limit=0.0, retry_after=0.5,
+                 max_ratelimit_timeout=None, seed=None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.max_ratelimit_timeout = max_ratelimit_timeout
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.rate_limited = 0
+
+    async def call(self, route, limited=True):
+        while True:
+            self.calls[route] = self.calls.get(route, 0) + 1
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+            if not (limited and self.rate_limit and self.random.random() < self.rate_limit):
+                return
+            self.rate_limited += 1
+            if self.max_ratelimit_timeout is not None and self.retry_after > self.max_ratelimit_timeout:
+                raise discord.RateLimited(self.retry_after)
+            await asyncio.sleep(self.retry_after)
+
+    def stats(self):
+        return {"calls": dict(self.calls), "rate_limited": self.rate_limited}
+
+
+class _Snowflake:
+    def __eq__(self, other):
+        return isinstance(other, _Snowflake) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeRole(_Snowflake):
+    def __init__(self, role_id, name="role"):
+        self.id = role_id
+        self.name = name
+        self.mention = f"<@&{role_id}>"
+
+
+class FakeMember(_Snowflake):
+    def __init__(self, guild, roles=(), member_id=None, bot=False):
+        self.id = member_id or next_id()
+        self.guild = guild
+        self.roles = list(roles)
+        self.bot = bot
+        self.name = f"user{self.id % 100000}"
+        self.mention = f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content=None, embed=None):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild if channel is not None else None
+        self.author = author
+        self.content = content
+        self.embeds = [embed] if embed is not None else []
+        self.attachments = []
+        self.created_at = datetime.now(tz=timezone.utc)
+        self.edited_at = None
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.guild.api.call("PATCH /webhooks/messages", limited=False)
+        self.content = content
+
+
+class FakeChannel(_Snowflake):
+    def __init__(self, guild, name, overwrites=None):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.overwrites = dict(overwrites or {})
+        self.messages = []
+        self.mention = f"<#{self.id}>"
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await self.guild.api.call("POST /channels/{channel_id}/messages")
+        message = FakeMessage(self, self.guild.me, content, embed)
+        self.messages.append(message)
+        return message
+
+    async def set_permissions(self, target, overwrite=None):
+        await self.guild.api.call("PUT /channels/{channel_id}/permissions")
+        if overwrite is None:
+            self.overwrites.pop(target, None)
+        else:
+            self.overwrites[target] = overwrite
+
+    async def edit(self, overwrites=None, **kwargs):
+        await self.guild.api.call("PATCH /channels/{channel_id}")
+        if overwrites is not None:
+            self.overwrites = dict(overwrites)
+
+    async def delete(self):
+        await self.guild.api.call("DELETE /channels/{channel_id}")
+        self.guild.channels.pop(self.id, None)
+
+    async def history(self, limit=None, oldest_first=False, **kwargs):
+        messages = self.messages if oldest_first else list(reversed(self.messages))
+        for message in messages[:limit]:
+            yield message
+
+
+class FakeGuild(_Snowflake):
+    def __init__(self, api, guild_id, support_role_id):
+        self.id = guild_id
+        self.api = api
+        self.default_role = FakeRole(guild_id, "@everyone")
+        self.support_role = FakeRole(support_role_id, "support")
+        self.roles = {r.id: r for r in (self.default_role, self.support_role)}
+        self.channels = {}
+        self.members = {}
+        self.me = FakeMember(self, bot=True)
+        self.ticket_channels = {}  # creator id -> latest ticket channel
+
+    @property
+    def text_channels(self):
+        return list(self.channels.values())
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def add_member(self, staff=False):
+        member = FakeMember(self, roles=[self.support_role] if staff else [])
+        self.members[member.id] = member
+        return member
+
+    async def create_text_channel(self, name, overwrites=None, **kwargs):
+        await self.api.call("POST /guilds/{guild_id}/channels")
+        channel = FakeChannel(self, name, overwrites)
+        self.channels[channel.id] = channel
+        for target in channel.overwrites:
+            if isinstance(target, FakeMember) and self.support_role not in target.roles:
+                self.ticket_channels[target.id] = channel
+        return channel
+
+
+class _Response:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        await self._interaction.guild.api.call("POST /interactions/callback", limited=False)
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        await self._interaction.guild.api.call("POST /interactions/callback", limited=False)
+        self._done = True
+        self._interaction.replies.append(content)
+
+
+class _Followup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self._interaction.guild.api.call("POST /webhooks/followup", limited=False)
+        self._interaction.replies.append(content)
+        return FakeMessage(self._interaction.channel, self._interaction.guild.me, content)
+
+
+class FakeInteraction:
+    def __init__(self, guild, user, channel):
+        self.id = next_id()
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.channel = channel
+        self.extras = {}
+        self.replies = []
+        self.response = _Response(self)
+        self.followup = _Followup(self)
+        self.created_at = datetime.now(tz=timezone.utc)
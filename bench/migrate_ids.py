@@ -0,0 +1,161 @@
+"""uuid -> snowflake ticket id migration on SQLite: file size, lookups and run time.
+
+    python -m bench.migrate_ids --tickets 50000
+
+Builds a SQLite file in the schema used before snowflake ids (uuid4 TEXT
+ticket ids, TEXT Discord ids), with participants, events and indexed
+messages for every ticket. It measures the file size and the latency of the
+bot's two hot lookups, by ticket id and by channel id. Then it runs
+db.migrate_ids on the file and measures again. Lookups use plain sqlite3,
+so the numbers are the query cost without the aiosqlite thread hop. The size
+after migration is given without the ticket_id_map table, which the tool
+keeps for old transcripts.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+LEGACY_SCHEMA = """
+CREATE TABLE tickets (
+    id TEXT PRIMARY KEY, guild_id TEXT NOT NULL, channel_id TEXT NULL, creator_id TEXT NOT NULL,
+    status TEXT NOT NULL, created_at TIMESTAMP NOT NULL, closed_at TIMESTAMP, claimed_by TEXT,
+    last_activity_at TIMESTAMP, claimed_at TIMESTAMP
+);
+CREATE TABLE ticket_participants (
+    ticket_id TEXT NOT NULL, user_id TEXT NOT NULL, added_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (ticket_id, user_id)
+);
+CREATE TABLE tickets_archive (
+    id TEXT PRIMARY KEY, guild_id TEXT NOT NULL, channel_id TEXT NULL, creator_id TEXT NOT NULL,
+    status TEXT NOT NULL, created_at TIMESTAMP NOT NULL, closed_at TIMESTAMP, claimed_by TEXT,
+    archived_at TIMESTAMP NOT NULL, claimed_at TIMESTAMP
+);
+CREATE TABLE ticket_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ticket_id TEXT NOT NULL, guild_id TEXT NOT NULL,
+    event TEXT NOT NULL, actor_id TEXT, data TEXT, created_at TIMESTAMP NOT NULL
+);
+CREATE TABLE stats_daily (guild_id TEXT NOT NULL, day TEXT NOT NULL, opened INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (guild_id, day));
+CREATE TABLE stats_staff (guild_id TEXT NOT NULL, staff_id TEXT NOT NULL, claims INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, staff_id));
+CREATE TABLE stats_durations (guild_id TEXT NOT NULL, metric TEXT NOT NULL, bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (guild_id, metric, bucket));
+CREATE VIRTUAL TABLE ticket_messages_fts USING fts5(
+    content, ticket_id UNINDEXED, guild_id UNINDEXED, channel_id UNINDEXED,
+    message_id UNINDEXED, author_id UNINDEXED, created_at UNINDEXED
+);
+CREATE INDEX idx_event_ticket ON ticket_events(ticket_id);
+CREATE INDEX idx_ticket_channel ON tickets(channel_id);
+CREATE INDEX idx_ticket_guild_status ON tickets(guild_id, status);
+CREATE INDEX idx_ticket_status_activity ON tickets(status, last_activity_at);
+CREATE INDEX idx_ticket_creator_status ON tickets(creator_id, status);
+"""
+
+GUILD_ID = 900_000_000_000_000_001
+
+
+def build_legacy(path, tickets, messages_per_ticket, rng):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    started = datetime.now(tz=timezone.utc) - timedelta(days=365)
+    rows, participants, events, messages = [], [], [], []
+    for n in range(tickets):
+        ticket_id = str(uuid.uuid4())
+        created = started + timedelta(seconds=n * 600)
+        channel_id = 1_200_000_000_000_000_000 + n
+        creator_id = 1_100_000_000_000_000_000 + rng.randrange(tickets)
+        closed = rng.random() < 0.8
+        rows.append((ticket_id, str(GUILD_ID), str(channel_id), str(creator_id), "closed" if closed else "open",
+                     created, created + timedelta(hours=2) if closed else None, str(creator_id + 7),
+                     created + timedelta(hours=1), created + timedelta(minutes=10)))
+        participants.append((ticket_id, str(creator_id + 3), created))
+        events += [(ticket_id, str(GUILD_ID), event, str(creator_id), None, created) for event in ("created", "claimed", "closed")]
+        messages += [(f"message {i} about order {n}", ticket_id, str(GUILD_ID), str(channel_id), str(n * 100 + i),
+                      str(creator_id), created) for i in range(messages_per_ticket)]
+    conn.executemany("INSERT INTO tickets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO ticket_participants VALUES (?, ?, ?)", participants)
+    conn.executemany("INSERT INTO ticket_events (ticket_id, guild_id, event, actor_id, data, created_at) VALUES (?, ?, ?, ?, ?, ?)", events)
+    conn.executemany("INSERT INTO ticket_messages_fts VALUES (?, ?, ?, ?, ?, ?, ?)", messages)
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def time_lookups(path, samples, rng):
+    """Median latency in microseconds of lookups by ticket id and by channel id."""
+    conn = sqlite3.connect(path)
+    ids = [row[0] for row in conn.execute("SELECT id FROM tickets")]
+    channels = [int(row[0]) for row in conn.execute("SELECT channel_id FROM tickets")]
+    results = {}
+    for name, sql, keys in (
+        ("by id", "SELECT * FROM tickets WHERE id = ?", ids),
+        ("by channel", "SELECT * FROM tickets WHERE channel_id = ?", channels),
+    ):
+        timings = []
+        for key in rng.choices(keys, k=samples):
+            started = time.perf_counter()
+            conn.execute(sql, (key,)).fetchone()
+            timings.append(time.perf_counter() - started)
+        results[name] = statistics.median(timings) * 1e6
+    conn.close()
+    return results
+
+
+def size_without_map(path):
+    copy = path + ".nomap"
+    shutil.copy(path, copy)
+    conn = sqlite3.connect(copy)
+    conn.execute("DROP TABLE IF EXISTS ticket_id_map")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    size = os.path.getsize(copy)
+    os.remove(copy)
+    return size
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tickets", type=int, default=50_000)
+    parser.add_argument("--messages-per-ticket", type=int, default=2)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    os.environ["DB_TYPE"] = "sqlite"
+
+    from db.migrate_ids import migrate_sqlite
+    from db.sqllite import sqlite_close
+
+    rng = random.Random(args.seed)
+    path = os.path.join(tempfile.mkdtemp(prefix="ticketbench-ids-"), "legacy.db")
+    build_legacy(path, args.tickets, args.messages_per_ticket, rng)
+    before_size = os.path.getsize(path)
+    before = time_lookups(path, args.lookups, rng)
+
+    started = time.perf_counter()
+    try:
+        migrated = await migrate_sqlite(path)
+    finally:
+        await sqlite_close()
+    elapsed = time.perf_counter() - started
+    after_size = size_without_map(path)
+    after = time_lookups(path, args.lookups, rng)
+
+    print(f"migrated {migrated} tickets in {elapsed:.1f}s")
+    print(f"file size: {before_size / 1e6:.1f} MB -> {after_size / 1e6:.1f} MB "
+          f"({(after_size - before_size) / before_size * 100:+.0f}%, without ticket_id_map)")
+    for name in before:
+        print(f"lookup {name}: {before[name]:.1f} us -> {after[name]:.1f} us "
+              f"({(after[name] - before[name]) / before[name] * 100:+.0f}%)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
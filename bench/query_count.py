@@ -0,0 +1,118 @@
+"""Backend calls per ticket command: each must resolve its ticket with one read.
+
+    python -m bench.query_count --backend sqlite
+
+Runs every ticket-channel command once against a real backend with the
+ticket cache off (TICKET_CACHE=0), so every lookup reaches the database.
+Each backend call a command makes is counted. Flushes of the write-behind
+buffers (events, search index, activity) run on their own schedule and are
+not counted. The run prints the calls per command and fails (non-zero exit)
+when they differ from EXPECTED.
+"""
+import argparse
+import asyncio
+import inspect
+import os
+import sys
+
+from bench.run import configure_env, fake_guild, start_backend
+
+# Write-behind flushes, not part of any one command
+BACKGROUND_OPS = {"record_events", "index_messages", "touch_tickets"}
+
+LOOKUP = {"get_ticket_by_channel": 1}
+EXPECTED = {
+    "message": LOOKUP,
+    "info": LOOKUP,
+    "claim": {**LOOKUP, "claim_ticket": 1},
+    "unclaim": {**LOOKUP, "unclaim_ticket": 1},
+    "add": {**LOOKUP, "add_users_to_ticket": 1},
+    "remove": {**LOOKUP, "remove_users_from_ticket": 1},
+    "close": {**LOOKUP, "close_ticket": 1},
+    "delete": {**LOOKUP, "delete_ticket": 1},
+}
+
+
+class CountingBackend:
+    """Wraps a db_interface Backend and counts each awaited operation."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.counts = {}
+
+    def __getattr__(self, op):
+        fn = getattr(self._backend, op)
+        if not inspect.iscoroutinefunction(fn):
+            return fn
+
+        async def counted(*args, **kwargs):
+            if op not in BACKGROUND_OPS:
+                self.counts[op] = self.counts.get(op, 0) + 1
+            return await fn(*args, **kwargs)
+        setattr(self, op, counted)
+        return counted
+
+    def take(self):
+        counts, self.counts = self.counts, {}
+        return counts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql", "mongodb"])
+    args = parser.parse_args()
+    os.environ["TICKET_CACHE"] = "0"
+    configure_env(args.backend)
+
+    import db.db_interface as db_interface
+    from bench.fakes import FakeAPI, FakeInteraction, FakeMessage
+    from cogs.TicketCog import TicketCog
+    from utils.botutils import create_ticket
+    from utils.guildconfig import support_role_id
+    from utils.lifecycle import lifecycle
+
+    await start_backend(args.backend)
+    guild = fake_guild(FakeAPI(latency_ms=1.0, jitter_ms=0.0))
+    staff, creator, helper = guild.add_member(staff=True), guild.add_member(), guild.add_member()
+    cog = TicketCog(None)
+    counter = CountingBackend(db_interface.get_backend())
+    db_interface._backend = counter
+
+    results = {}
+    try:
+        await create_ticket(guild, creator, guild.support_role.id)
+        channel = guild.ticket_channels[creator.id]
+        # The support role is cached per guild after the first lookup
+        await support_role_id(guild.id)
+        counter.take()
+
+        as_staff = lambda: FakeInteraction(guild, staff, channel)
+        commands = (
+            ("message", lambda: cog.on_message(FakeMessage(channel, creator, "hello"))),
+            ("info", lambda: cog.ticket_info.callback(cog, as_staff())),
+            ("claim", lambda: cog.claim_ticket_command.callback(cog, as_staff())),
+            ("unclaim", lambda: cog.unclaim_ticket_command.callback(cog, as_staff())),
+            ("add", lambda: cog.add_to_ticket_command.callback(cog, as_staff(), helper)),
+            ("remove", lambda: cog.remove_from_ticket_command.callback(cog, as_staff(), helper)),
+            ("close", lambda: cog.close_ticket_commands.callback(cog, as_staff())),
+            ("delete", lambda: cog.delete_ticket_command.callback(cog, as_staff())),
+        )
+        for name, run in commands:
+            await run()
+            results[name] = counter.take()
+        await lifecycle.shutdown()
+    finally:
+        await db_interface.db_close()
+
+    failed = False
+    for name, counts in results.items():
+        ok = counts == EXPECTED[name]
+        failed |= not ok
+        calls = ", ".join(f"{op} x{n}" for op, n in sorted(counts.items()))
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<8}{calls}" + ("" if ok else f"   expected {EXPECTED[name]}"))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
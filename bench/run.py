@@ -0,0 +1,289 @@
+"""Offline load test of the ticket flows against a real backend and a fake Discord.
+
+    python -m bench.run --backend sqlite --users 50 --iterations 4
+    python -m bench.run --backend mysql --latency-ms 80 --rate-limit 0.05 --json results.json
+    python -m bench.run --backend sqlite --json new.json --compare old.json
+
+Each simulated user repeatedly:
+1. opens a ticket through TicketSetupView.open_ticket
+2. posts a few messages (TicketCog.on_message)
+3. has it claimed, gets a helper added, and has it closed by staff, through
+   the TicketCog slash command callbacks
+
+All users run concurrently. Discord is replaced by bench/fakes.py, with
+simulated latency and 429s. The backend is real:
+- sqlite: a temp file
+- mysql: MYSQL_* from the environment (e.g. a local container)
+- mongodb: MONGO_URI (e.g. a local mongod)
+The database should be a scratch one, since the run leaves its tickets
+behind. Command checks such as has_role are not evaluated, because the
+callbacks are invoked directly.
+
+The run prints p50/p95/p99 latency and throughput per operation, and the
+event loop lag measured while the flows ran (how late a 10 ms sleep wakes).
+``--json`` writes the same numbers plus the configuration and git commit,
+and ``--compare`` prints the change against an earlier JSON result.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+GUILD_ID = 900_000_000_000_000_001
+SUPPORT_ROLE_ID = 900_000_000_000_000_002
+OPS = ("open", "message", "claim", "add", "close")
+
+
+def configure_env(backend, metrics=False):
+    # Read at import time by the bot's modules, so set before importing them
+    os.environ["DB_TYPE"] = backend
+    os.environ.setdefault("GUILD_ID", str(GUILD_ID))
+    os.environ.setdefault("SUPPORT_ROLE_ID", str(SUPPORT_ROLE_ID))
+    os.environ.setdefault("TRANSCRIPT_ON_CLOSE", "0")
+    os.environ.setdefault("TRANSCRIPT_ON_DELETE", "0")
+    os.environ.setdefault("RECONCILE_ON_STARTUP", "0")
+    if metrics:
+        os.environ.setdefault("METRICS_PORT", "9091")
+
+
+async def start_backend(backend):
+    """Connect and migrate the configured backend; sqlite gets a fresh temp file."""
+    from db.db_interface import get_backend
+    if backend == "sqlite":
+        tmpdir = tempfile.mkdtemp(prefix="ticketbench-")
+        get_backend().module.DB_PATH = os.path.join(tmpdir, "bench.db")
+    await get_backend().init()
+
+
+def fake_guild(api):
+    from bench.fakes import FakeGuild
+    return FakeGuild(api, int(os.environ["GUILD_ID"]), int(os.environ["SUPPORT_ROLE_ID"]))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    results = {}
+    for op in OPS:
+        values = sorted(samples.get(op, ()))
+        if not values:
+            continue
+        results[op] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+            "ops_per_s": round(len(values) / elapsed, 1),
+        }
+    return results
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes a task that sleeps ``interval``.
+
+    Anything that blocks the loop (a synchronous driver call, heavy CPU work)
+    shows up as lag here, and as a late gateway heartbeat in the bot.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self):
+        values = sorted(self.samples)
+        if not values:
+            return None
+        return {
+            "samples": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+
+
+class Runner:
+    def __init__(self, args, guild, staff, cog, view_cls):
+        self.args = args
+        self.guild = guild
+        self.staff = staff
+        self.cog = cog
+        self.view_cls = view_cls
+        self.samples = {op: [] for op in OPS}
+        self.errors = {}
+        self.panel = None
+
+    def _error(self, op, what):
+        key = f"{op}: {what}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    async def _timed(self, op, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self._error(op, f"{type(e).__name__}: {e}")
+            return False
+        self.samples[op].append(time.perf_counter() - started)
+        return True
+
+    async def user_flow(self, user, helper):
+        from bench.fakes import FakeInteraction, FakeMessage
+        cog = self.cog
+        for _ in range(self.args.iterations):
+            view = self.view_cls()
+            interaction = FakeInteraction(self.guild, user, self.panel)
+            if not await self._timed("open", view.open_ticket.callback(interaction)):
+                continue
+            reply = interaction.replies[-1] if interaction.replies else None
+            channel = self.guild.ticket_channels.get(user.id)
+            if channel is None or reply != "Ticket created!":
+                self._error("open", reply)
+                continue
+            for i in range(self.args.messages):
+                await self._timed("message", cog.on_message(FakeMessage(channel, user, f"message {i} about my order")))
+            staff_action = lambda: FakeInteraction(self.guild, self.staff, channel)
+            await self._timed("claim", cog.claim_ticket_command.callback(cog, staff_action()))
+            await self._timed("add", cog.add_to_ticket_command.callback(cog, staff_action(), helper))
+            await self._timed("close", cog.close_ticket_commands.callback(cog, staff_action()))
+
+    async def run(self):
+        from bench.fakes import FakeChannel
+        self.panel = FakeChannel(self.guild, "tickets")
+        users = [(self.guild.add_member(), self.guild.add_member()) for _ in range(self.args.users)]
+        self.loop_lag = LoopLagMonitor()
+        self.loop_lag.start()
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(self.user_flow(user, helper) for user, helper in users))
+        finally:
+            await self.loop_lag.stop()
+        return time.perf_counter() - started
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_report(report, baseline=None):
+    print(f"backend={report['config']['backend']} users={report['config']['users']} "
+          f"iterations={report['config']['iterations']} elapsed={report['elapsed_s']}s commit={report['commit']}")
+    print(f"{'op':<8}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'ops/s':>9}")
+    for op, r in report["results"].items():
+        line = f"{op:<8}{r['count']:>7}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['max_ms']:>10}{r['ops_per_s']:>9}"
+        old = (baseline or {}).get("results", {}).get(op)
+        if old:
+            line += "   vs baseline: " + ", ".join(
+                f"{k[:3]} {(r[k] - old[k]) / old[k] * 100:+.1f}%" for k in ("p50_ms", "p99_ms") if old[k]
+            )
+        print(line)
+    lag = report.get("loop_lag")
+    if lag:
+        line = f"event loop lag: p50 {lag['p50_ms']} ms, p99 {lag['p99_ms']} ms, max {lag['max_ms']} ms"
+        old = (baseline or {}).get("loop_lag")
+        if old and old["p99_ms"]:
+            line += f"   vs baseline: p99 {(lag['p99_ms'] - old['p99_ms']) / old['p99_ms'] * 100:+.1f}%"
+        print(line)
+    print(f"discord api: {report['api']['rate_limited']} rate limited, scheduler retried {report['scheduler']['retried_429']}")
+    for error, count in report["errors"].items():
+        print(f"error x{count}: {error}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--users", type=int, default=20, help="Concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=3, help="Tickets per user")
+    parser.add_argument("--messages", type=int, default=3, help="Messages per ticket")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mean simulated Discord API latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Share of API calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After of simulated 429s, seconds")
+    parser.add_argument("--max-ratelimit-timeout", type=float, default=None,
+                        help="Raise discord.RateLimited for 429s longer than this instead of waiting")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--metrics", action="store_true", help="Also record utils/metrics histograms")
+    parser.add_argument("--json", help="Write machine-readable results here")
+    parser.add_argument("--compare", help="Earlier --json result to compare against")
+    args = parser.parse_args()
+    configure_env(args.backend, args.metrics)
+
+    from bench.fakes import FakeAPI
+    from db.db_interface import db_close
+    from utils.lifecycle import lifecycle
+    from utils.restscheduler import scheduler
+
+    await start_backend(args.backend)
+
+    from cogs.TicketCog import TicketCog
+    from ui.TicketSetupView import TicketSetupView
+
+    api = FakeAPI(args.latency_ms, args.jitter_ms, args.rate_limit, args.retry_after, args.max_ratelimit_timeout, args.seed)
+    guild = fake_guild(api)
+    staff = guild.add_member(staff=True)
+    runner = Runner(args, guild, staff, TicketCog(None), TicketSetupView)
+    try:
+        elapsed = await runner.run()
+        # Flush write-behind buffers so the next run starts clean; not timed
+        await lifecycle.shutdown()
+    finally:
+        await db_close()
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+        "elapsed_s": round(elapsed, 3),
+        "tickets_per_s": round(len(runner.samples["close"]) / elapsed, 2),
+        "results": summarize(runner.samples, elapsed),
+        "loop_lag": runner.loop_lag.summary(),
+        "errors": runner.errors,
+        "api": api.stats(),
+        "scheduler": {"retried_429": scheduler.retried_429, "coalesced": scheduler.coalesced},
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
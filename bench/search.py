@@ -0,0 +1,133 @@
+"""/ticket search latency over a generated index of a million messages.
+
+    python -m bench.search --messages 1000000
+    python -m bench.search --backend mysql --messages 200000 --target-ms 50
+
+Fills the backend's message index through db_index_messages, in batches the
+size the search indexer uses. Words are drawn from a Zipf-like vocabulary,
+so some terms match a large share of the messages and others only a few.
+The messages are spread over ``--guilds`` guilds. Then it times
+db_search_messages for common, rare and two-word queries, and for the
+second page of each (keyset cursor). The run prints p50/p95/p99 per query
+kind and fails (non-zero exit) when any p95 is above ``--target-ms``.
+
+Queries for the 20 most frequent words (each in 7-70% of all messages, like
+"the" or "to") are timed too but not held to the target: ranking them means
+scoring every message that contains them.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+from bench.run import configure_env, percentile, start_backend
+
+INDEX_BATCH = 500
+# Reported, but not held to --target-ms (see the module docstring)
+UNTARGETED = "stop word"
+DOMAIN_WORDS = ("refund", "order", "payment", "account", "password", "shipping", "invoice", "discord",
+                "server", "ban", "appeal", "subscription", "crash", "login", "verify", "delivery")
+
+
+def vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = list(DOMAIN_WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choice(letters) for _ in range(rng.randint(4, 9))))
+    # Zipf-like: the n-th word is drawn with weight 1/n
+    return words, list(itertools.accumulate(1 / (n + 1) for n in range(size)))
+
+
+async def fill(args, words, cum_weights, rng):
+    from db.db_interface import db_index_messages
+    now = datetime.now(tz=timezone.utc)
+    message_id = 1
+    for start in range(0, args.messages, INDEX_BATCH):
+        batch = []
+        for _ in range(min(INDEX_BATCH, args.messages - start)):
+            guild = message_id % args.guilds + 1
+            ticket = message_id // 200
+            batch.append({
+                "message_id": message_id,
+                "ticket_id": ticket,
+                "guild_id": guild,
+                "channel_id": 10_000 + ticket,
+                "author_id": 20_000 + message_id % 500,
+                "created_at": now,
+                "content": " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(5, 25))),
+            })
+            message_id += 1
+        await db_index_messages(batch)
+
+
+async def timed_search(guild_id, query, cursor=None):
+    from db.db_interface import db_search_messages
+    started = time.perf_counter()
+    results, next_cursor = await db_search_messages(guild_id, query, 10, cursor)
+    return time.perf_counter() - started, results, next_cursor
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=100, help="Queries per kind")
+    parser.add_argument("--target-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    configure_env(args.backend)
+
+    from db.db_interface import db_close
+
+    rng = random.Random(args.seed)
+    words, cum_weights = vocabulary(args.vocabulary, rng)
+    # Frequency rank ranges of the query words; the top ranks play the part of stop words
+    content = words[20:2000]
+    kinds = {
+        "stop word": lambda: rng.choice(words[:20]),
+        "common": lambda: rng.choice(words[20:200]),
+        "rare": lambda: rng.choice(words[len(words) // 2:]),
+        "two words": lambda: f"{rng.choice(content)} {rng.choice(content)}",
+    }
+    samples = {kind: [] for kind in kinds}
+    samples.update({f"{kind}, page 2": [] for kind in kinds})
+
+    await start_backend(args.backend)
+    try:
+        started = time.perf_counter()
+        await fill(args, words, cum_weights, rng)
+        fill_s = time.perf_counter() - started
+        print(f"indexed {args.messages:,} messages in {fill_s:.1f}s ({args.messages / fill_s:,.0f}/s)")
+        for kind, make_query in kinds.items():
+            for _ in range(args.queries):
+                guild_id, query = rng.randint(1, args.guilds), make_query()
+                elapsed, results, cursor = await timed_search(guild_id, query)
+                samples[kind].append(elapsed)
+                if cursor:
+                    elapsed, _, _ = await timed_search(guild_id, query, cursor)
+                    samples[f"{kind}, page 2"].append(elapsed)
+    finally:
+        await db_close()
+
+    failed = False
+    print(f"{'query':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, values in samples.items():
+        if not values:
+            continue
+        values.sort()
+        p95 = percentile(values, 95) * 1000
+        over = p95 > args.target_ms and not kind.startswith(UNTARGETED)
+        failed |= over
+        print(f"{kind:<18}{len(values):>7}{percentile(values, 50) * 1000:>10.2f}{p95:>10.2f}"
+              f"{percentile(values, 99) * 1000:>10.2f}" + (f"   FAIL p95 above {args.target_ms} ms" if over else ""))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
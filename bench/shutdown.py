@@ -0,0 +1,128 @@
+"""SIGTERM in the middle of the ticket flows must leave the database consistent.
+
+    python -m bench.shutdown --backend sqlite --users 30 --after 0.5
+
+Runs the bench.run user flows and sends this process a SIGTERM ``--after``
+seconds in. The handler starts the same shutdown sequence as bot.py. Once it
+has finished, the run fails (non-zero exit) if:
+- a write-behind buffer still holds items, or a flush failed
+- the stored messages or events differ from what the buffers flushed
+- a ticket row was only half written: no channel, a closed ticket without
+  closed_at or its "closed" event, a claim without claimed_at or its
+  "claimed" event, or no "created" event
+- a ticket channel exists without its row
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from bench.run import Runner, configure_env, fake_guild, start_backend
+
+
+async def read_table(table):
+    from db.db_interface import get_backend
+    from db.transfer import TABLES
+    columns = dict(TABLES)[table]
+    rows = []
+    async for batch, _ in get_backend().export_rows(table, columns):
+        rows += batch
+    return rows
+
+
+async def check(guild, writers, pending_at_exit):
+    problems = []
+    for writer in writers:
+        if pending_at_exit[writer.name] or writer.failures:
+            problems.append(f"{writer.name}: {pending_at_exit[writer.name]} items left unflushed, {writer.failures} failed flushes")
+
+    events = await read_table("ticket_events")
+    messages = await read_table("ticket_messages")
+    by_name = {w.name: w for w in writers}
+    if len(events) != by_name["ticket_events"].flushed:
+        problems.append(f"{len(events)} events stored, {by_name['ticket_events'].flushed} flushed")
+    if len(messages) != by_name["message_index"].flushed:
+        problems.append(f"{len(messages)} messages indexed, {by_name['message_index'].flushed} flushed")
+
+    seen = {(int(e["ticket_id"]), e["event"]) for e in events}
+    tickets = await read_table("tickets")
+    for t in tickets:
+        tid = int(t["id"])
+        if t["channel_id"] is None:
+            problems.append(f"ticket {tid}: no channel")
+        if (tid, "created") not in seen:
+            problems.append(f"ticket {tid}: no created event")
+        if t["status"] == "closed" and (t["closed_at"] is None or (tid, "closed") not in seen):
+            problems.append(f"ticket {tid}: closed without closed_at or its event")
+        if t["claimed_by"] is not None and (t["claimed_at"] is None or (tid, "claimed") not in seen):
+            problems.append(f"ticket {tid}: claimed without claimed_at or its event")
+    stored_channels = {int(t["channel_id"]) for t in tickets if t["channel_id"] is not None}
+    for channel in guild.text_channels:
+        if channel.name.startswith("ticket-") and channel.id not in stored_channels:
+            problems.append(f"channel {channel.name}: no ticket row")
+    statuses = {}
+    for t in tickets:
+        statuses[t["status"]] = statuses.get(t["status"], 0) + 1
+    return problems, statuses
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--after", type=float, default=0.5, help="Seconds into the run to send SIGTERM")
+    args = parser.parse_args()
+    configure_env(args.backend)
+
+    from bench.fakes import FakeAPI
+    from cogs.TicketCog import TicketCog
+    from db.db_interface import db_close
+    from ui.TicketSetupView import TicketSetupView
+    from utils.autoclose import activity_writer
+    from utils.events import event_log
+    from utils.lifecycle import lifecycle
+    from utils.search import message_indexer
+
+    await start_backend(args.backend)
+    guild = fake_guild(FakeAPI(args.latency_ms, args.latency_ms / 2, seed=1))
+    runner = Runner(args, guild, guild.add_member(staff=True), TicketCog(None), TicketSetupView)
+
+    writers = (event_log, message_indexer, activity_writer)
+    pending_at_exit = {}
+    timing = {}
+
+    def exited(_):
+        timing["shutdown_s"] = time.perf_counter() - timing["signalled"]
+        pending_at_exit.update({w.name: w.pending for w in writers})
+
+    def on_sigterm():
+        # As in bot.py, the signal only starts the shutdown sequence. The bot
+        # exits once it completes, so that is when the buffers must be empty.
+        timing["signalled"] = time.perf_counter()
+        lifecycle.shutdown().add_done_callback(exited)
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+    loop.call_later(args.after, os.kill, os.getpid(), signal.SIGTERM)
+    try:
+        await runner.run()
+        await lifecycle.shutdown()
+        problems, statuses = await check(guild, writers, pending_at_exit)
+    finally:
+        await db_close()
+
+    print(f"tickets stored: {statuses}; shutdown took {timing['shutdown_s']:.2f}s")
+    if problems:
+        for problem in problems:
+            print(f"FAIL {problem}")
+        sys.exit(1)
+    print("ok: no half-written rows, write-behind buffers flushed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""Transcript export of a synthetic 100k-message channel: peak RSS and throughput.
+
+    python -m bench.transcript --messages 100000
+    python -m bench.transcript --format html --compression zstd --page-latency-ms 50
+
+The channel's history is generated page by page (100 messages per page, as
+Discord returns it) while the export reads it, so the only memory that
+grows with the channel is whatever the exporter itself keeps. Every 20th
+message carries an attachment. The run prints messages/s, the output size,
+the growth of the process's peak RSS during the export, and the event loop
+lag. ``--max-rss-mb`` makes it fail (non-zero exit) above that growth.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from bench.run import LoopLagMonitor, configure_env, fake_guild
+from bench.fakes import FakeAPI, FakeChannel, FakeMessage
+
+PAGE_SIZE = 100
+
+
+class _Attachment:
+    def __init__(self, message_id):
+        self.filename = f"screenshot-{message_id}.png"
+        self.url = f"https://cdn.discordapp.com/attachments/1/{message_id}/{self.filename}"
+        self.size = 250_000
+
+
+class SyntheticChannel(FakeChannel):
+    def __init__(self, guild, count, authors):
+        super().__init__(guild, "ticket-bench")
+        self.count = count
+        self.authors = authors
+
+    async def history(self, limit=None, oldest_first=False, **kwargs):
+        for start in range(0, self.count, PAGE_SIZE):
+            await self.guild.api.call("GET /channels/{channel_id}/messages", limited=False)
+            for i in range(start, min(start + PAGE_SIZE, self.count)):
+                message = FakeMessage(
+                    self, self.authors[i % len(self.authors)],
+                    f"message {i}: my order #{i * 7919 % 100000} still has not arrived, "
+                    "could someone look at the refund status? " * (1 + i % 3),
+                )
+                if i % 20 == 0:
+                    message.attachments.append(_Attachment(message.id))
+                yield message
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--format", default="jsonl", choices=["jsonl", "html"])
+    parser.add_argument("--compression", default="gzip", choices=["gzip", "zstd"])
+    parser.add_argument("--page-latency-ms", type=float, default=0.0, help="Simulated latency per history page")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="Fail above this peak RSS growth")
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp(prefix="ticketbench-transcripts-")
+    os.environ["TRANSCRIPT_DIR"] = tmpdir
+    configure_env("sqlite")
+
+    from utils.transcripts import export_transcript
+
+    guild = fake_guild(FakeAPI(args.page_latency_ms, jitter_ms=0.0))
+    authors = [guild.add_member() for _ in range(5)]
+    channel = SyntheticChannel(guild, args.messages, authors)
+    ticket = {"id": 1, "guild_id": guild.id}
+
+    lag = LoopLagMonitor()
+    before = _peak_rss_mb()
+    lag.start()
+    started = time.perf_counter()
+    try:
+        path, count = await export_transcript(channel, ticket, args.format, args.compression)
+    finally:
+        await lag.stop()
+    elapsed = time.perf_counter() - started
+    growth = _peak_rss_mb() - before
+
+    loop_lag = lag.summary()
+    print(f"{count} messages in {elapsed:.2f}s ({count / elapsed:,.0f} msg/s), "
+          f"{os.path.getsize(path) / 1024 / 1024:.1f} MB {os.path.basename(path)}")
+    print(f"peak RSS growth during export: {growth:.1f} MB (peak {_peak_rss_mb():.1f} MB)")
+    print(f"event loop lag: p50 {loop_lag['p50_ms']} ms, p99 {loop_lag['p99_ms']} ms, max {loop_lag['max_ms']} ms")
+    if args.max_rss_mb is not None and growth > args.max_rss_mb:
+        print(f"FAIL peak RSS grew {growth:.1f} MB, limit {args.max_rss_mb} MB")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""db.transfer throughput on a generated database, SQLite to SQLite by default.
+
+    python -m bench.transfer --tickets 100000
+    python -m bench.transfer --target mysql --tickets 20000
+
+Fills a temporary SQLite source with tickets, participants, indexed
+messages and events, then copies it with db.transfer.transfer() and reports
+rows/s overall and per table, followed by the count and checksum
+verification. A SQLite target is a second temporary file. MySQL and MongoDB
+targets use the usual connection settings and must be empty scratch
+databases.
+
+It then replays the messages table from the start of its checkpoint, as a
+run resumed from an older checkpoint would, and verifies again. A target that
+indexed those messages twice fails the verification.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+GUILD_ID = 900_000_000_000_000_001
+
+
+def generate(table, tickets, messages_per_ticket, rng):
+    """Rows for one table, as export_rows would yield them."""
+    started = datetime.now(tz=timezone.utc) - timedelta(days=365)
+    for n in range(tickets):
+        ticket_id = 1 << 40 | n
+        created = started + timedelta(seconds=n * 300)
+        creator_id = 1_100_000_000_000_000_000 + rng.randrange(tickets)
+        if table == "tickets":
+            yield {"id": ticket_id, "guild_id": GUILD_ID, "channel_id": 1_200_000_000_000_000_000 + n,
+                   "creator_id": creator_id, "status": "closed", "created_at": created,
+                   "closed_at": created + timedelta(hours=2), "claimed_by": creator_id + 7,
+                   "last_activity_at": created + timedelta(hours=1), "claimed_at": created + timedelta(minutes=10)}
+        elif table == "ticket_participants":
+            yield {"ticket_id": ticket_id, "user_id": creator_id + 3, "added_at": created}
+        elif table == "ticket_messages":
+            for i in range(messages_per_ticket):
+                yield {"message_id": 1_300_000_000_000_000_000 + n * 100 + i, "ticket_id": ticket_id,
+                       "guild_id": GUILD_ID, "channel_id": 1_200_000_000_000_000_000 + n, "author_id": creator_id,
+                       "created_at": created + timedelta(minutes=i), "content": f"message {i} about order {n}"}
+        elif table == "ticket_events":
+            for event in ("created", "claimed", "closed"):
+                yield {"id": None, "ticket_id": ticket_id, "guild_id": GUILD_ID, "event": event,
+                       "actor_id": creator_id, "data": None, "created_at": created}
+
+
+async def fill(source, tickets, messages_per_ticket, batch_size, rng):
+    from db.transfer import TABLES
+    for table, columns in TABLES:
+        batch = []
+        for row in generate(table, tickets, messages_per_ticket, rng):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                await source.import_rows(table, columns, batch)
+                batch = []
+        if batch:
+            await source.import_rows(table, columns, batch)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="sqlite", choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--messages-per-ticket", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from db.db_interface import load_backend
+    from db.transfer import TIMESTAMP_DIGITS, Checkpoint, transfer, verify
+
+    tmpdir = tempfile.mkdtemp(prefix="ticketbench-transfer-")
+    source = load_backend("sqlite", private=True)
+    source.module.DB_PATH = os.path.join(tmpdir, "source.db")
+    target = load_backend(args.target, private=True)
+    if args.target == "sqlite":
+        target.module.DB_PATH = os.path.join(tmpdir, "target.db")
+    checkpoint = Checkpoint(os.path.join(tmpdir, "checkpoint.json"), "sqlite", args.target)
+
+    try:
+        await source.init()
+        await fill(source, args.tickets, args.messages_per_ticket, args.batch_size, random.Random(args.seed))
+        started = time.perf_counter()
+        await transfer(source, target, checkpoint, args.batch_size, check=False)
+        elapsed = time.perf_counter() - started
+        total = sum(t["rows"] for t in checkpoint.state["tables"].values())
+        ok = await verify(source, target, min(TIMESTAMP_DIGITS["sqlite"], TIMESTAMP_DIGITS[args.target]))
+        print(f"copied {total:,} rows in {elapsed:.2f}s ({total / elapsed:,.0f} rows/s), verification {'ok' if ok else 'FAILED'}")
+
+        checkpoint.state["tables"]["ticket_messages"] = {"after": None, "rows": 0, "done": False}
+        replay_ok = await transfer(source, target, checkpoint, args.batch_size)
+        print(f"replayed ticket_messages from the start: verification {'ok' if replay_ok else 'FAILED'}")
+    finally:
+        await source.close()
+        await target.close()
+    if not (ok and replay_ok):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
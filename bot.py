@@ -1,3 +1,10 @@
+import time
+from datetime import datetime, timezone
+_PROCESS_START = time.perf_counter()
+# Ticket rows created from here on belong to this process; reconciliation leaves them alone
+_STARTED_AT = datetime.now(tz=timezone.utc)
+
+import asyncio
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -7,13 +14,17 @@ import logging
 import signal
 import sys
 from ui.TicketSetupView import TicketSetupView
+from db.db_interface import db_close
+from utils.lifecycle import lifecycle, PHASE_CLOSE, RESTARTING_MESSAGE
+from utils import metrics
+from utils.logsetup import setup_logging, bind as bind_log_context
+from utils.reconcile import reconcile_guild, RECONCILE_ON_STARTUP
+from utils import sharding
+from utils.guildconfig import SupportRoleNotConfigured, forget_guild
 
 LOG_LEVEL = logging.DEBUG if os.getenv("DEBUG") == "1" else logging.INFO
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()]
-)
+# Console and file handlers run on a background thread (see utils/logsetup.py)
+setup_logging(LOG_LEVEL)
 logger = logging.getLogger("keepalivebot")
 
 
@@ -23,24 +34,58 @@ intents.message_content = True
 
 load_dotenv()
 
-required_env = ["BOT_TOKEN", "GUILD_ID", "SUPPORT_ROLE_ID", "DB_TYPE"]
+required_env = ["BOT_TOKEN", "DB_TYPE"]
 missing = [k for k in required_env if not os.getenv(k)]
 if missing:
     logger.error("Missing required environment variables: %s", ", ".join(missing))
     sys.exit(1)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Optional: sync commands to this one guild only (instant updates while developing)
 try:
-    GUILD_ID = int(os.getenv("GUILD_ID"))
-except (TypeError, ValueError):
+    GUILD_ID = int(os.getenv("GUILD_ID") or 0)
+except ValueError:
     logger.error("GUILD_ID must be an integer")
     sys.exit(1)
-GUILD_OBJ = discord.Object(GUILD_ID)
-SUPPORT_ROLE_ID = int(os.getenv("SUPPORT_ROLE_ID"))
+try:
+    shard_options = sharding.bot_options()
+except ValueError as e:
+    logger.error("%s", e)
+    sys.exit(1)
 DB_TYPE = os.getenv("DB_TYPE")
+STARTUP_TIMING = os.getenv("STARTUP_TIMING") == "1"
+
+class TicketTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        if metrics.enabled:
+            metrics.command_started(interaction)
+        # Each interaction runs in its own task, so this only tags its own records
+        bind_log_context(guild_id=interaction.guild_id)
+        if lifecycle.accepting:
+            return True
+        await interaction.response.send_message(RESTARTING_MESSAGE, ephemeral=True)
+        return False
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+    async def on_error(self, interaction: discord.Interaction, error):
+        if metrics.enabled:
+            metrics.command_finished(interaction, interaction.command, "error")
+        if isinstance(error, SupportRoleNotConfigured) and not interaction.response.is_done():
+            await interaction.response.send_message(str(error), ephemeral=True)
+            return
+        await super().on_error(interaction, error)
+
+if sharding.enabled:
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, tree_cls=TicketTree, **shard_options)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, tree_cls=TicketTree)
 bot.synced_once = False
+if metrics.enabled:
+    metrics.instrument_http(bot.http)
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    if metrics.enabled:
+        metrics.command_finished(interaction, command, "ok")
 
 @bot.event
 async def on_ready():
@@ -53,29 +98,70 @@ async def on_ready():
         logger.info("TicketCog loaded")
     if not bot.synced_once:
         try:
-            cmds = await bot.tree.sync(guild=GUILD_OBJ)
-            logger.info("Synced %d commands to guild %s", len(cmds), GUILD_ID)
+            if GUILD_ID:
+                guild = discord.Object(GUILD_ID)
+                bot.tree.copy_global_to(guild=guild)
+                cmds = await bot.tree.sync(guild=guild)
+                logger.info("Synced %d commands to guild %s", len(cmds), GUILD_ID)
+            elif sharding.syncs_commands(bot):
+                cmds = await bot.tree.sync()
+                logger.info("Synced %d global commands", len(cmds))
         except Exception as e:
             logger.warning("Command sync skipped/failed: %s", e)
         bot.synced_once = True
+        if STARTUP_TIMING:
+            await _report_startup_timing()
+        if RECONCILE_ON_STARTUP:
+            await _reconcile()
 
-def _graceful_shutdown(*_):
-    logger.info("Shutting down...")
+async def _reconcile():
+    # Only the guilds on this process's shards
+    for guild in bot.guilds:
+        try:
+            async with lifecycle.operation():
+                await reconcile_guild(guild, started_before=_STARTED_AT)
+        except Exception as e:
+            logger.error("Reconciliation of guild %s failed: %s", guild.id, e)
+
+@bot.event
+async def on_guild_remove(guild):
+    forget_guild(guild.id)
+    logger.info("Removed from guild %s (%s)", guild.name, guild.id)
+
+async def _report_startup_timing():
+    from db.db_interface import db_init
+    ready_ms = (time.perf_counter() - _PROCESS_START) * 1000
+    started = time.perf_counter()
     try:
-        if DB_TYPE == "sqlite":
-            from db.sqllite import sqlite_close
-            sqlite_close()
-        elif DB_TYPE == "mysql":
-            from db.mysql import mysql_close
-            mysql_close()
+        await db_init()
     except Exception as e:
-        logger.debug("Error during DB close: %s", e)
-    finally:
-        sys.exit(0)
+        logger.error("Startup timing: %s backend failed to initialize: %s", DB_TYPE, e)
+        return
+    init_ms = (time.perf_counter() - started) * 1000
+    logger.info("Startup timing: backend=%s process_to_ready=%.1fms backend_init=%.1fms", DB_TYPE, ready_ms, init_ms)
+
+async def _shutdown():
+    logger.info("Shutting down...")
+    # Stops new interactions, waits for in-flight ticket operations, drains the
+    # queues and write buffers, then closes the backend (see utils/lifecycle.py)
+    await lifecycle.shutdown()
+    await bot.close()
 
-signal.signal(signal.SIGINT, _graceful_shutdown)
-signal.signal(signal.SIGTERM, _graceful_shutdown)
+lifecycle.on_shutdown("database", db_close, PHASE_CLOSE)
+lifecycle.on_shutdown("metrics", metrics.stop_server, PHASE_CLOSE)
 
+async def main():
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(_shutdown()))
+        except NotImplementedError:
+            # Windows has no loop signal handlers; hop onto the loop instead
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(lambda: asyncio.ensure_future(_shutdown())))
+    if metrics.enabled:
+        await metrics.start_server()
+    async with bot:
+        await bot.start(BOT_TOKEN)
 
 
-bot.run(token=BOT_TOKEN)
\ No newline at end of file
+asyncio.run(main())
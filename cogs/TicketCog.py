@@ -1,35 +1,115 @@
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 import logging
 import os
 from utils.botutils import (
     add_to_ticket,
-    create_ticket,
+    request_ticket,
+    MAX_OPEN_TICKETS_PER_USER,
     close_ticket,
     delete_ticket,
     remove_from_ticket,
     claim_ticket,
     unclaim_ticket,
 )
-from db.db_interface import db_ticket_channel_exists, db_get_ticket, db_get_ticket_id
+from datetime import datetime, timedelta, timezone
+from db.db_interface import db_get_ticket_by_channel, db_search_messages, db_get_ticket_stats, db_rebuild_stats
+from db.ids import format_ticket_id
+from db.rollups import METRIC_CLAIM, METRIC_CLOSE, histogram_median
 from ui.TicketSetupView import TicketSetupView
+from utils.transcripts import export_transcript
+from utils.search import index_message
+from utils.archive import purge_closed_tickets
+from utils.autoclose import record_activity, close_stale_tickets, AUTO_CLOSE_AFTER_HOURS, AUTO_CLOSE_SWEEP_MINUTES
+from utils.logsetup import bind as bind_log_context
+from utils.guildconfig import is_support, set_support_role, support_role_id
+from utils.lifecycle import RESTARTING_MESSAGE, ShuttingDown
 
 logger = logging.getLogger("keepalivebot.ticketcog")
 
-GUILD_ID = int(os.getenv("GUILD_ID"))
-SUPPORT_ROLE_ID = int(os.getenv("SUPPORT_ROLE_ID"))
+# Discord's attachment limit for bots without boosted uploads
+TRANSCRIPT_UPLOAD_LIMIT = 8 * 1024 * 1024
+SEARCH_PAGE_SIZE = 10
+
+
+async def _ticket_for_channel(interaction: discord.Interaction):
+    """Resolve the ticket for the interaction's channel with one read.
+
+    Replies to the interaction and returns None when the channel is not a ticket.
+    """
+    ticket = await db_get_ticket_by_channel(interaction.channel.id)
+    if ticket is None:
+        await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
+    else:
+        bind_log_context(ticket_id=ticket["id"])
+    return ticket
+
+
+def _purge_summary(stats, done):
+    prefix = "Dry run" if stats["dry_run"] else "Purge"
+    state = "finished" if done else "in progress"
+    if stats["dry_run"]:
+        return f"{prefix} {state}: {stats['selected']} closed tickets would be archived."
+    return (
+        f"{prefix} {state}: {stats['selected']} selected, "
+        f"{stats['channels_deleted']} channels deleted, {stats['archived']} archived."
+    )
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "n/a"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}d"
+
+
+def _stats_summary(stats, days):
+    daily = stats["daily"]
+    lines = [
+        f"**Last {days} days:** {sum(d[1] for d in daily)} opened, {sum(d[2] for d in daily)} closed",
+        f"Median time to claim: {_format_duration(histogram_median(stats['durations'].get(METRIC_CLAIM, {})))}",
+        f"Median time to close: {_format_duration(histogram_median(stats['durations'].get(METRIC_CLOSE, {})))}",
+    ]
+    if daily:
+        lines.append("\n**Per day (opened / closed)**")
+        lines += [f"`{day}` {opened} / {closed}" for day, opened, closed in daily[-14:]]
+    if stats["staff"]:
+        lines.append("\n**Claims per staff member**")
+        lines += [f"<@{staff_id}>: {claims}" for staff_id, claims in stats["staff"]]
+    return "\n".join(lines)[:2000]
 
 
 class TicketCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    ticket = app_commands.Group(name="ticket", description="Ticket management commands", guild_ids=[GUILD_ID])
+    async def cog_load(self):
+        if AUTO_CLOSE_AFTER_HOURS > 0:
+            self.auto_close_sweep.start()
+
+    async def cog_unload(self):
+        self.auto_close_sweep.cancel()
+
+    @tasks.loop(minutes=AUTO_CLOSE_SWEEP_MINUTES)
+    async def auto_close_sweep(self):
+        try:
+            await close_stale_tickets(self.bot)
+        except Exception as e:
+            logger.error(f"Auto-close sweep failed: {e}")
+
+    @auto_close_sweep.before_loop
+    async def before_auto_close_sweep(self):
+        await self.bot.wait_until_ready()
+
+    ticket = app_commands.Group(name="ticket", description="Ticket management commands", guild_only=True)
     
     
     @ticket.command(name="setup", description="Setup ticket panel embed")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def setup_ticket_panel(self, interaction: discord.Interaction):
         embed = discord.Embed(
             title="🎫 Support Tickets",
@@ -47,87 +127,106 @@ class TicketCog(commands.Cog):
 
     @ticket.command(name="create", description="Create a new ticket")
     async def create_ticket_command(self, interaction: discord.Interaction):
-        try:
-            ticket_id = await create_ticket(interaction.guild, interaction.user, SUPPORT_ROLE_ID)
-        except Exception as e:
-            logger.error(f"Failed to create ticket: {e}")
-            await interaction.response.send_message("Failed to create ticket.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        role_id = await support_role_id(interaction.guild_id)
+        if role_id is None:
+            await interaction.followup.send("Tickets are not set up in this server yet.", ephemeral=True)
             return
-        if ticket_id is None:
-            await interaction.response.send_message("Ticket creation failed (support role missing or channel error).", ephemeral=True)
-            return
-        await interaction.response.send_message(f"Ticket created! ID: {ticket_id[:8]} (check the new channel).", ephemeral=True)
+        status, ticket_id = await request_ticket(interaction.guild, interaction.user, role_id)
+        if status == "limit_reached":
+            await interaction.followup.send(f"You already have {MAX_OPEN_TICKETS_PER_USER} open ticket(s). Please use your existing ticket.", ephemeral=True)
+        elif status == "busy":
+            await interaction.followup.send("We're handling a lot of tickets right now, please try again in a moment.", ephemeral=True)
+        elif status == "failed":
+            await interaction.followup.send("Ticket creation failed (support role missing or channel error).", ephemeral=True)
+        else:
+            await interaction.followup.send(f"Ticket created! ID: {format_ticket_id(ticket_id)} (check the new channel).", ephemeral=True)
 
     @ticket.command(name="close", description="Close an existing ticket")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def close_ticket_commands(self, interaction: discord.Interaction):
-        if not db_ticket_channel_exists(interaction.channel.id):
-            await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
             return
+        # The permission edit can queue behind other REST calls past the 3 s ack deadline
+        await interaction.response.defer(ephemeral=True)
         try:
-            await close_ticket(interaction.channel, interaction.guild, SUPPORT_ROLE_ID, interaction.user)
+            role_id = await support_role_id(interaction.guild_id)
+            await close_ticket(interaction.channel, ticket, interaction.guild, role_id, interaction.user, actor=interaction.user)
+        except ShuttingDown:
+            await interaction.followup.send(RESTARTING_MESSAGE, ephemeral=True)
+            return
         except Exception as e:
             logger.error(f"Failed to close ticket: {e}")
-            await interaction.response.send_message("Failed to close ticket.", ephemeral=True)
+            await interaction.followup.send("Failed to close ticket.", ephemeral=True)
             return
 
-        await interaction.response.send_message("Ticket closed!", ephemeral=True)
+        await interaction.followup.send("Ticket closed!", ephemeral=True)
         
     @ticket.command(name="delete", description="Delete a ticket")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def delete_ticket_command(self, interaction: discord.Interaction):
-        if not db_ticket_channel_exists(interaction.channel.id):
-            await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
             return
         # Send the ephemeral response BEFORE deleting the channel, otherwise 10003 Unknown Channel
         await interaction.response.send_message("Ticket deleted!", ephemeral=True)
         try:
-            await delete_ticket(interaction.channel)
+            await delete_ticket(interaction.channel, ticket, actor=interaction.user)
+        except ShuttingDown:
+            await interaction.followup.send(RESTARTING_MESSAGE, ephemeral=True)
         except discord.NotFound:
             logger.warning("Channel already gone while deleting ticket.")
 
     @ticket.command(name="add", description="Add a user to a ticket")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def add_to_ticket_command(self, interaction: discord.Interaction, user: discord.User):
-        if not db_ticket_channel_exists(interaction.channel.id):
-            await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
             return
+        await interaction.response.defer(ephemeral=True)
         try:
-            await add_to_ticket(interaction.channel, user)
+            await add_to_ticket(interaction.channel, ticket, user, actor=interaction.user)
+        except ShuttingDown:
+            await interaction.followup.send(RESTARTING_MESSAGE, ephemeral=True)
+            return
         except Exception as e:
             logger.error(f"Failed to add user to ticket: {e}")
-            await interaction.response.send_message("Failed to add user to ticket.", ephemeral=True)
+            await interaction.followup.send("Failed to add user to ticket.", ephemeral=True)
             return
 
-        await interaction.response.send_message("User added to ticket!", ephemeral=True)
+        await interaction.followup.send("User added to ticket!", ephemeral=True)
         
     @ticket.command(name="remove", description="Remove a user from a ticket")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def remove_from_ticket_command(self, interaction: discord.Interaction, user: discord.User):
-        if not db_ticket_channel_exists(interaction.channel.id):
-            await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
             return
+        await interaction.response.defer(ephemeral=True)
         try:
-            await remove_from_ticket(interaction.channel, user)
+            await remove_from_ticket(interaction.channel, ticket, user, actor=interaction.user)
+        except ShuttingDown:
+            await interaction.followup.send(RESTARTING_MESSAGE, ephemeral=True)
+            return
         except Exception as e:
             logger.error(f"Failed to remove user from ticket: {e}")
-            await interaction.response.send_message("Failed to remove user from ticket.", ephemeral=True)
+            await interaction.followup.send("Failed to remove user from ticket.", ephemeral=True)
             return
 
-        await interaction.response.send_message("User removed from ticket!", ephemeral=True)
+        await interaction.followup.send("User removed from ticket!", ephemeral=True)
 
     @ticket.command(name="claim", description="Claim a ticket")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def claim_ticket_command(self, interaction: discord.Interaction):
-        # Optional: ensure user has support role
-        if SUPPORT_ROLE_ID not in [r.id for r in getattr(interaction.user, 'roles', [])]:
-            await interaction.response.send_message("You don't have permission to claim tickets.", ephemeral=True)
-            return
-        if not db_ticket_channel_exists(interaction.channel.id):
-            await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
             return
         try:
-            result = await claim_ticket(interaction.channel, interaction.user)
+            result, claimer = await claim_ticket(interaction.channel, ticket, interaction.user)
+        except ShuttingDown:
+            await interaction.response.send_message(RESTARTING_MESSAGE, ephemeral=True)
+            return
         except Exception as e:
             logger.error(f"Failed to claim ticket: {e}")
             await interaction.response.send_message("Failed to claim ticket.", ephemeral=True)
@@ -135,22 +234,24 @@ class TicketCog(commands.Cog):
 
         if result == "success":
             await interaction.response.send_message("Ticket claimed!", ephemeral=True)
+        elif result == "already_yours":
+            await interaction.response.send_message("You have already claimed this ticket.", ephemeral=True)
         elif result == "already_claimed":
-            ticket_id = db_get_ticket_id(interaction.channel.id)
-            ticket = db_get_ticket(ticket_id) if ticket_id else None
-            claimer = ticket.get("claimed_by") if ticket and ticket.get("claimed_by") else None
             await interaction.response.send_message(f"Ticket already claimed by <@{claimer}>." if claimer else "Ticket already claimed.", ephemeral=True)
         else:
             await interaction.response.send_message("Unable to claim ticket (not found or unexpected error).", ephemeral=True)
 
     @ticket.command(name="unclaim", description="Unclaim a ticket you have claimed")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def unclaim_ticket_command(self, interaction: discord.Interaction):
-        if not db_ticket_channel_exists(interaction.channel.id):
-            await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
             return
         try:
-            unclaimed = await unclaim_ticket(interaction.channel, interaction.user)
+            unclaimed = await unclaim_ticket(interaction.channel, ticket, interaction.user)
+        except ShuttingDown:
+            await interaction.response.send_message(RESTARTING_MESSAGE, ephemeral=True)
+            return
         except Exception as e:
             logger.error(f"Failed to unclaim ticket: {e}")
             await interaction.response.send_message("Failed to unclaim ticket.", ephemeral=True)
@@ -161,27 +262,123 @@ class TicketCog(commands.Cog):
             await interaction.response.send_message("You haven't claimed this ticket or it's not claimed.", ephemeral=True)
 
     @ticket.command(name="info", description="Show information about this ticket")
-    @app_commands.checks.has_role(SUPPORT_ROLE_ID)
+    @is_support()
     async def ticket_info(self, interaction: discord.Interaction):
-        if not db_ticket_channel_exists(interaction.channel.id):
-            await interaction.response.send_message("This is not a ticket channel.", ephemeral=True)
-            return
-        # Fetch ticket record
-        from db.db_interface import db_get_ticket_id as _get_tid
-        ticket_id = _get_tid(interaction.channel.id)
-        from db.db_interface import db_get_ticket as _get_ticket
-        rec = _get_ticket(ticket_id)
-        if not rec:
-            await interaction.response.send_message("Ticket record not found.", ephemeral=True)
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
             return
         desc = [
-            f"ID: {rec.get('id') or rec.get('_id')}",
-            f"Status: {rec.get('status')}",
-            f"Creator: <@{rec.get('creator_id')}>" if rec.get('creator_id') else "Creator: ?",
-            f"Claimed By: <@{rec.get('claimed_by')}>" if rec.get('claimed_by') else "Claimed By: (unclaimed)",
+            f"ID: {ticket.get('id')}",
+            f"Status: {ticket.get('status')}",
+            f"Creator: <@{ticket.get('creator_id')}>" if ticket.get('creator_id') else "Creator: ?",
+            f"Claimed By: <@{ticket.get('claimed_by')}>" if ticket.get('claimed_by') else "Claimed By: (unclaimed)",
         ]
         await interaction.response.send_message("\n".join(desc), ephemeral=True)
 
+    @ticket.command(name="transcript", description="Export this ticket's message history")
+    @is_support()
+    async def transcript_command(self, interaction: discord.Interaction):
+        ticket = await _ticket_for_channel(interaction)
+        if ticket is None:
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            path, count = await export_transcript(interaction.channel, ticket)
+        except Exception as e:
+            logger.error(f"Failed to export transcript: {e}")
+            await interaction.followup.send("Failed to export transcript.", ephemeral=True)
+            return
+        if os.path.getsize(path) <= TRANSCRIPT_UPLOAD_LIMIT:
+            await interaction.followup.send(f"Transcript of {count} messages.", file=discord.File(path), ephemeral=True)
+        else:
+            await interaction.followup.send(f"Transcript of {count} messages saved to `{path}` (too large to upload).", ephemeral=True)
+
+    @ticket.command(name="search", description="Search messages across all tickets")
+    @app_commands.describe(query="Words to look for", page="Page token from a previous search")
+    @is_support()
+    async def search_command(self, interaction: discord.Interaction, query: str, page: str | None = None):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            results, next_page = await db_search_messages(interaction.guild.id, query, SEARCH_PAGE_SIZE, page)
+        except Exception as e:
+            logger.error(f"Search failed: {e}")
+            await interaction.followup.send("Search failed.", ephemeral=True)
+            return
+        if not results:
+            await interaction.followup.send("No matching messages.", ephemeral=True)
+            return
+        lines = [
+            f"`{format_ticket_id(r['ticket_id'])}` <#{r['channel_id']}> <@{r['author_id']}>: {r['snippet']}"
+            for r in results
+        ]
+        if next_page:
+            lines.append(f"More results: `/ticket search query:{query} page:{next_page}`")
+        await interaction.followup.send("\n".join(lines)[:2000], ephemeral=True)
+
+    @ticket.command(name="purge", description="Archive closed tickets and delete their channels")
+    @app_commands.describe(days="Only tickets closed more than this many days ago", dry_run="Only count what would be purged")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def purge_command(self, interaction: discord.Interaction, days: app_commands.Range[int, 0], dry_run: bool = True):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        status = await interaction.followup.send("Purge starting...", ephemeral=True, wait=True)
+
+        async def report(stats):
+            await status.edit(content=_purge_summary(stats, done=False))
+
+        try:
+            stats = await purge_closed_tickets(interaction.guild, days, dry_run=dry_run, progress=report)
+        except Exception as e:
+            logger.error(f"Purge failed: {e}")
+            await status.edit(content="Purge failed; run it again to resume.")
+            return
+        await status.edit(content=_purge_summary(stats, done=True))
+
+    @ticket.command(name="stats", description="Ticket volume, response times and claims per staff member")
+    @app_commands.describe(days="Days of daily volume to include")
+    @is_support()
+    async def stats_command(self, interaction: discord.Interaction, days: app_commands.Range[int, 1, 365] = 30):
+        since_day = (datetime.now(tz=timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        try:
+            stats = await db_get_ticket_stats(interaction.guild.id, since_day)
+        except Exception as e:
+            logger.error(f"Failed to load stats: {e}")
+            await interaction.response.send_message("Failed to load stats.", ephemeral=True)
+            return
+        await interaction.response.send_message(_stats_summary(stats, days), ephemeral=True)
+
+    @ticket.command(name="support-role", description="Set the role that handles tickets in this server")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def support_role_command(self, interaction: discord.Interaction, role: discord.Role):
+        try:
+            await set_support_role(interaction.guild_id, role.id)
+        except Exception as e:
+            logger.error(f"Failed to set support role: {e}")
+            await interaction.response.send_message("Failed to set the support role.", ephemeral=True)
+            return
+        await interaction.response.send_message(f"Support role set to {role.mention}.", ephemeral=True)
+
+    @ticket.command(name="rebuild-stats", description="Recompute ticket stats from the raw ticket data")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def rebuild_stats_command(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            count = await db_rebuild_stats(interaction.guild.id)
+        except Exception as e:
+            logger.error(f"Stats rebuild failed: {e}")
+            await interaction.followup.send("Stats rebuild failed.", ephemeral=True)
+            return
+        await interaction.followup.send(f"Stats rebuilt from {count} tickets.", ephemeral=True)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.guild is None or message.author.bot:
+            return
+        # Served from the ticket cache (including its negative cache) on hot channels
+        ticket = await db_get_ticket_by_channel(message.channel.id)
+        if ticket is not None:
+            index_message(message, ticket)
+            record_activity(ticket, message.created_at)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(TicketCog(bot))
     
\ No newline at end of file
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+import time
+
+# Returned by lookups when the cache knows nothing about the key
+MISS = object()
+
+
+def _channel_key(channel_id):
+    # SQLite stores snowflakes as TEXT, Discord hands us ints
+    return int(channel_id) if channel_id is not None else None
+
+
+class TicketCache:
+    """Bounded LRU + TTL cache of ticket records.
+
+    Records are indexed by ticket id and by channel id. Channels known not to
+    be tickets are remembered in a separate negative cache so repeated commands
+    in ordinary channels do not hit the database either.
+
+    Readers take a ``generation()`` before querying the backend and pass it to
+    ``put``/``put_missing``. Every eviction stamps its key with a new
+    generation, so a record read before a concurrent write evicted it is
+    dropped instead of being cached stale.
+    """
+
+    def __init__(self, maxsize=5000, ttl=300, negative_ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._tickets = OrderedDict()  # ticket_id -> (expires_at, record)
+        self._channels = {}  # channel_id -> ticket_id
+        self._missing = OrderedDict()  # channel_id -> expires_at
+        self._generation = 0
+        self._evicted = OrderedDict()  # ticket_id or ("channel", channel_id) -> generation of its last eviction
+        self._evicted_floor = 0  # newest generation forgotten from _evicted
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.stale_puts = 0
+
+    def get(self, ticket_id):
+        entry = self._tickets.get(ticket_id)
+        if entry is None:
+            self.misses += 1
+            return MISS
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            self._drop(ticket_id)
+            self.misses += 1
+            return MISS
+        self._tickets.move_to_end(ticket_id)
+        self.hits += 1
+        return dict(record)
+
+    def get_by_channel(self, channel_id):
+        key = _channel_key(channel_id)
+        expires_at = self._missing.get(key)
+        if expires_at is not None:
+            if expires_at >= time.monotonic():
+                self.negative_hits += 1
+                return None
+            del self._missing[key]
+        ticket_id = self._channels.get(key)
+        if ticket_id is None:
+            self.misses += 1
+            return MISS
+        return self.get(ticket_id)
+
+    def generation(self):
+        return self._generation
+
+    def put(self, record, generation=None):
+        ticket_id = record["id"]
+        if generation is not None and (
+            self._evicted_since(ticket_id, generation)
+            or self._evicted_since(("channel", _channel_key(record.get("channel_id"))), generation)
+        ):
+            self.stale_puts += 1
+            return
+        self._drop(ticket_id)
+        self._tickets[ticket_id] = (time.monotonic() + self.ttl, dict(record))
+        channel = _channel_key(record.get("channel_id"))
+        if channel is not None:
+            self._channels[channel] = ticket_id
+            self._missing.pop(channel, None)
+        while len(self._tickets) > self.maxsize:
+            oldest = next(iter(self._tickets))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def put_missing(self, channel_id, generation=None):
+        key = _channel_key(channel_id)
+        if generation is not None and self._evicted_since(("channel", key), generation):
+            self.stale_puts += 1
+            return
+        self._missing[key] = time.monotonic() + self.negative_ttl
+        self._missing.move_to_end(key)
+        while len(self._missing) > self.maxsize:
+            self._missing.popitem(last=False)
+
+    def evict(self, ticket_id):
+        self._mark_evicted(ticket_id)
+        self._drop(ticket_id)
+
+    def evict_channel(self, channel_id):
+        key = _channel_key(channel_id)
+        self._mark_evicted(("channel", key))
+        self._missing.pop(key, None)
+        ticket_id = self._channels.get(key)
+        if ticket_id is not None:
+            self._drop(ticket_id)
+
+    def _mark_evicted(self, key):
+        self._generation += 1
+        self._evicted[key] = self._generation
+        self._evicted.move_to_end(key)
+        while len(self._evicted) > self.maxsize:
+            _, forgotten = self._evicted.popitem(last=False)
+            self._evicted_floor = forgotten
+
+    def _evicted_since(self, key, generation):
+        # Reads older than the forgotten stamps cannot be checked; treat them as stale
+        return generation < self._evicted_floor or self._evicted.get(key, -1) > generation
+
+    def _drop(self, ticket_id):
+        entry = self._tickets.pop(ticket_id, None)
+        if entry is None:
+            return
+        channel = _channel_key(entry[1].get("channel_id"))
+        if channel is not None and self._channels.get(channel) == ticket_id:
+            del self._channels[channel]
+
+    def stats(self):
+        return {
+            "size": len(self._tickets),
+            "negative_size": len(self._missing),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "stale_puts": self.stale_puts,
+        }
@@ -1,133 +1,260 @@
 from dotenv import load_dotenv
+import importlib
+import importlib.util
+import inspect
+import logging
 import os
-from db.mongodb import (
-    mongo_create_ticket,
-    mongo_close_ticket,
-    mongo_get_ticket,
-    mongo_update_ticket_status,
-    mongo_update_ticket_channel,
-    mongo_get_ticket_id,
-    mongo_delete_ticket,
-    mongo_ticket_channel_exists,
-    mongo_claim_ticket,
-    mongo_unclaim_ticket,
-)
-from db.sqllite import (
-    sqlite_create_ticket,
-    sqlite_close_ticket,
-    sqlite_get_ticket,
-    sqlite_update_ticket_status,
-    sqlite_update_ticket_channel,
-    sqlite_get_ticket_id,
-    sqlite_delete_ticket,
-    sqlite_ticket_channel_exists,
-    sqlite_claim_ticket,
-    sqlite_unclaim_ticket,
-)
-from db.mysql import (
-    mysql_create_ticket,
-    mysql_close_ticket,
-    mysql_get_ticket,
-    mysql_update_ticket_status,
-    mysql_update_ticket_channel,
-    mysql_get_ticket_id,
-    mysql_delete_ticket,
-    mysql_ticket_channel_exists,
-    mysql_claim_ticket,
-    mysql_unclaim_ticket
-)
+import time
+from db.cache import MISS, TicketCache
+from db.rollups import StatsAccumulator
+from utils import metrics
 
-load_dotenv()
+logger = logging.getLogger("keepalivebot.db")
 
-mongo = False
-sqlite = False
-mysql = False
+load_dotenv()
 
 db_type = os.getenv("DB_TYPE")
 
-if db_type == "mongodb":
-    mongo = True
-elif db_type == "sqlite":
-    sqlite = True
-elif db_type == "mysql":
-    mysql = True
-
-def db_create_ticket(guild_id, channel_id, creator_id):
-    if mongo:
-        return mongo_create_ticket(guild_id, channel_id, creator_id)
-    elif sqlite:
-        return sqlite_create_ticket(guild_id, channel_id, creator_id)
-    elif mysql:
-        return mysql_create_ticket(guild_id, channel_id, creator_id)
-
-def db_close_ticket(ticket_id):
-    if mongo:
-        return mongo_close_ticket(ticket_id)
-    elif sqlite:
-        return sqlite_close_ticket(ticket_id)
-    elif mysql:
-        return mysql_close_ticket(ticket_id)
-    
-def db_get_ticket(ticket_id):
-    if mongo:
-        return mongo_get_ticket(ticket_id)
-    elif sqlite:
-        return sqlite_get_ticket(ticket_id)
-    elif mysql:
-        return mysql_get_ticket(ticket_id)
-
-def db_update_ticket_status(ticket_id, status):
-    if mongo:
-        return mongo_update_ticket_status(ticket_id, status)
-    elif sqlite:
-        return sqlite_update_ticket_status(ticket_id, status)
-    elif mysql:
-        return mysql_update_ticket_status(ticket_id, status)
-    
-def db_update_ticket_channel(ticket_id, channel_id):
-    if mongo:
-        return mongo_update_ticket_channel(ticket_id, channel_id)
-    elif sqlite:
-        return sqlite_update_ticket_channel(ticket_id, channel_id)
-    elif mysql:
-        return mysql_update_ticket_channel(ticket_id, channel_id)
-
-def db_get_ticket_id(channel_id):
-    if mongo:
-        return mongo_get_ticket_id(channel_id)
-    elif sqlite:
-        return sqlite_get_ticket_id(channel_id)
-    elif mysql:
-        return mysql_get_ticket_id(channel_id)
-    
-def db_delete_ticket(ticket_id):
-    if mongo:
-        return mongo_delete_ticket(ticket_id)
-    elif sqlite:
-        return sqlite_delete_ticket(ticket_id)
-    elif mysql:
-        return mysql_delete_ticket(ticket_id)
-
-def db_ticket_channel_exists(channel_id):
-    if mongo:
-        return mongo_ticket_channel_exists(channel_id)
-    elif sqlite:
-        return sqlite_ticket_channel_exists(channel_id)
-    elif mysql:
-        return mysql_ticket_channel_exists(channel_id)
-
-def db_claim_ticket(ticket_id, staff_user_id):
-    if mongo:
-        return mongo_claim_ticket(ticket_id, staff_user_id)
-    elif sqlite:
-        return sqlite_claim_ticket(ticket_id, staff_user_id)
-    elif mysql:
-        return mysql_claim_ticket(ticket_id, staff_user_id)
-
-def db_unclaim_ticket(ticket_id, staff_user_id):
-    if mongo:
-        return mongo_unclaim_ticket(ticket_id, staff_user_id)
-    elif sqlite:
-        return sqlite_unclaim_ticket(ticket_id, staff_user_id)
-    elif mysql:
-        return mysql_unclaim_ticket(ticket_id, staff_user_id)
+# In-process ticket cache; TICKET_CACHE=0 disables it (e.g. when debugging
+# against a database edited by hand).
+_cache = TicketCache(
+    maxsize=int(os.getenv("TICKET_CACHE_SIZE", 5000)),
+    ttl=float(os.getenv("TICKET_CACHE_TTL", 300)),
+    negative_ttl=float(os.getenv("TICKET_CACHE_NEGATIVE_TTL", 60)),
+) if os.getenv("TICKET_CACHE", "1") != "0" else None
+if _cache is not None:
+    metrics.ticket_cache.register(_cache.stats)
+
+# DB_TYPE -> (module, function prefix). Only the selected module is imported,
+# so unused drivers are never loaded and never open a connection.
+BACKENDS = {
+    "mongodb": ("db.mongodb", "mongo"),
+    "sqlite": ("db.sqllite", "sqlite"),
+    "mysql": ("db.mysql", "mysql"),
+}
+
+
+class Backend:
+    """Resolved backend: ``backend.create_ticket`` maps to ``<prefix>_create_ticket``."""
+
+    def __init__(self, name, module, prefix):
+        self.name = name
+        self.module = module
+        self.prefix = prefix
+
+    def __getattr__(self, op):
+        fn = getattr(self.module, f"{self.prefix}_{op}")
+        if metrics.enabled and inspect.iscoroutinefunction(fn):
+            fn = metrics.instrument_db(self.name, op, fn)
+        setattr(self, op, fn)
+        return fn
+
+
+_backend: Backend | None = None
+
+
+def load_backend(name, private=False):
+    """Import a backend by DB_TYPE name.
+
+    ``private`` loads a separate copy of the module with its own connection
+    state, so one process can talk to two databases of the same kind (e.g.
+    ``python -m db.transfer`` from one SQLite file to another).
+    """
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown DB_TYPE {name!r}; expected one of {', '.join(BACKENDS)}")
+    module_name, prefix = BACKENDS[name]
+    started = time.perf_counter()
+    if private:
+        spec = importlib.util.find_spec(module_name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    logger.debug("Imported %s backend in %.1f ms", name, (time.perf_counter() - started) * 1000)
+    return Backend(name, module, prefix)
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = load_backend(db_type)
+    return _backend
+
+
+async def db_init():
+    """Import the backend and open its connection now instead of on the first query."""
+    return await get_backend().init()
+
+async def db_create_ticket(guild_id, channel_id, creator_id):
+    ticket_id = await get_backend().create_ticket(guild_id, channel_id, creator_id)
+    if _cache is not None and channel_id is not None:
+        _cache.evict_channel(channel_id)
+    return ticket_id
+
+async def db_close_ticket(ticket_id):
+    result = await get_backend().close_ticket(ticket_id)
+    if _cache is not None:
+        _cache.evict(ticket_id)
+    return result
+
+async def db_close_tickets(ticket_ids):
+    """Close many tickets in one batch; returns how many were still open."""
+    result = await get_backend().close_tickets(ticket_ids)
+    if _cache is not None:
+        for ticket_id in ticket_ids:
+            _cache.evict(ticket_id)
+    return result
+
+async def db_get_ticket(ticket_id):
+    if _cache is not None:
+        cached = _cache.get(ticket_id)
+        if cached is not MISS:
+            return cached
+        generation = _cache.generation()
+    ticket = await get_backend().get_ticket(ticket_id)
+    if _cache is not None and ticket is not None:
+        _cache.put(ticket, generation)
+    return ticket
+
+async def db_update_ticket_status(ticket_id, status):
+    result = await get_backend().update_ticket_status(ticket_id, status)
+    if _cache is not None:
+        _cache.evict(ticket_id)
+    return result
+
+async def db_update_ticket_channel(ticket_id, channel_id):
+    result = await get_backend().update_ticket_channel(ticket_id, channel_id)
+    if _cache is not None:
+        _cache.evict(ticket_id)
+        _cache.evict_channel(channel_id)
+    return result
+
+async def db_get_ticket_id(channel_id):
+    if _cache is not None:
+        ticket = await db_get_ticket_by_channel(channel_id)
+        return ticket["id"] if ticket else None
+    return await get_backend().get_ticket_id(channel_id)
+
+async def db_get_ticket_by_channel(channel_id):
+    """Full ticket record for a channel (or None) in a single query."""
+    if _cache is not None:
+        cached = _cache.get_by_channel(channel_id)
+        if cached is not MISS:
+            return cached
+        generation = _cache.generation()
+    ticket = await get_backend().get_ticket_by_channel(channel_id)
+    if _cache is not None:
+        if ticket is None:
+            _cache.put_missing(channel_id, generation)
+        else:
+            _cache.put(ticket, generation)
+    return ticket
+
+async def db_delete_ticket(ticket_id):
+    result = await get_backend().delete_ticket(ticket_id)
+    if _cache is not None:
+        _cache.evict(ticket_id)
+    return result
+
+async def db_delete_tickets(ticket_ids):
+    result = await get_backend().delete_tickets(ticket_ids)
+    if _cache is not None:
+        for ticket_id in ticket_ids:
+            _cache.evict(ticket_id)
+    return result
+
+async def db_get_guild_tickets(guild_id):
+    """Every live ticket of a guild (id, channel_id, status, created_at) in one query."""
+    return await get_backend().get_guild_tickets(guild_id)
+
+async def db_ticket_channel_exists(channel_id):
+    if _cache is not None:
+        return await db_get_ticket_by_channel(channel_id) is not None
+    return await get_backend().ticket_channel_exists(channel_id)
+
+async def db_claim_ticket(ticket_id, staff_user_id):
+    result = await get_backend().claim_ticket(ticket_id, staff_user_id)
+    if _cache is not None:
+        _cache.evict(ticket_id)
+    return result
+
+async def db_unclaim_ticket(ticket_id, staff_user_id):
+    result = await get_backend().unclaim_ticket(ticket_id, staff_user_id)
+    if _cache is not None:
+        _cache.evict(ticket_id)
+    return result
+
+async def db_add_users_to_ticket(ticket_id, user_ids):
+    return await get_backend().add_users_to_ticket(ticket_id, user_ids)
+
+async def db_remove_users_from_ticket(ticket_id, user_ids):
+    return await get_backend().remove_users_from_ticket(ticket_id, user_ids)
+
+async def db_count_open_tickets(guild_id, creator_id):
+    return await get_backend().count_open_tickets(guild_id, creator_id)
+
+async def db_touch_tickets(activity):
+    """Bulk-update last_activity_at from [(ticket_id, at), ...]; never moves it backwards."""
+    # Cached records are not evicted: only the stale-ticket sweep reads this
+    # column, and it always queries the backend.
+    return await get_backend().touch_tickets(activity)
+
+async def db_get_stale_tickets(inactive_since, limit, guild_ids=None):
+    """Open tickets with no activity since ``inactive_since``, least recently active first.
+
+    ``guild_ids`` limits the search to those guilds; None means every guild.
+    """
+    return await get_backend().get_stale_tickets(inactive_since, limit, guild_ids)
+
+async def db_get_closed_tickets(guild_id, closed_before, limit, after_id=None):
+    """Closed tickets of a guild closed before ``closed_before``, ordered by id."""
+    return await get_backend().get_closed_tickets(guild_id, closed_before, limit, after_id)
+
+async def db_archive_tickets(ticket_ids):
+    """Move tickets (and their participants) into the archive table in one batch."""
+    result = await get_backend().archive_tickets(ticket_ids)
+    if _cache is not None:
+        for ticket_id in ticket_ids:
+            _cache.evict(ticket_id)
+    return result
+
+async def db_index_messages(messages):
+    return await get_backend().index_messages(messages)
+
+async def db_search_messages(guild_id, text, limit=10, cursor=None):
+    """Ranked full-text search over ticket messages; returns (results, next_cursor)."""
+    return await get_backend().search_messages(guild_id, text, limit, cursor)
+
+async def db_record_events(events):
+    """Append ticket events (dicts with ticket_id, guild_id, event, actor_id, data, created_at)."""
+    return await get_backend().record_events(events)
+
+async def db_get_ticket_stats(guild_id, since_day, staff_limit=10):
+    """Read the analytics rollups: {"daily": [(day, opened, closed)], "staff": [(staff_id, claims)], "durations": {...}}."""
+    return await get_backend().get_stats(guild_id, since_day, staff_limit)
+
+async def db_rebuild_stats(guild_id):
+    """Recompute a guild's rollups from its live and archived tickets in one streaming pass.
+
+    Claims and closes that land while the rebuild runs may be counted twice or
+    not at all; run it when the guild is quiet. Returns the number of tickets read.
+    """
+    backend = get_backend()
+    acc = StatsAccumulator()
+    async for ticket in backend.iter_tickets(guild_id):
+        acc.add(ticket)
+    await backend.replace_stats(guild_id, acc)
+    return acc.tickets
+
+async def db_get_guild_config(guild_id):
+    """The guild's settings row ({"guild_id", "support_role_id", "updated_at"}) or None."""
+    return await get_backend().get_guild_config(guild_id)
+
+async def db_set_guild_config(guild_id, support_role_id):
+    return await get_backend().set_guild_config(guild_id, support_role_id)
+
+async def db_close():
+    # Nothing to close if no query ever resolved the backend
+    if _backend is None:
+        return
+    return await _backend.close()
@@ -0,0 +1,86 @@
+"""Compact, time-sortable 64-bit ticket ids.
+
+Snowflake layout: 41 bits of milliseconds since TICKET_ID_EPOCH, 10 bits of
+worker id, 12 bits of per-millisecond sequence. Ids fit a signed BIGINT /
+SQLite INTEGER primary key, sort by creation time, and stay unique across
+processes as long as each process sharing a database has its own
+TICKET_ID_WORKER (by default the lowest of the process's SHARD_IDS).
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+TICKET_ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+class SnowflakeGenerator:
+    def __init__(self, worker_id):
+        if not 0 <= worker_id <= MAX_WORKER:
+            raise ValueError(f"worker id must be between 0 and {MAX_WORKER}")
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        # Ticket creation is async, but migrations may generate ids from threads
+        self._lock = threading.Lock()
+
+    def next_id(self, at_ms=None):
+        """Next id for now, or for ``at_ms`` (epoch ms) when backfilling in time order."""
+        with self._lock:
+            ms = int(time.time() * 1000) if at_ms is None else int(at_ms)
+            if ms < self._last_ms:
+                # Clock went backwards (or input is out of order): keep ids increasing
+                ms = self._last_ms
+            if ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 4096 ids in one millisecond; borrow the next one
+                    ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = ms
+            return ((ms - TICKET_ID_EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+def _default_worker():
+    # Processes that split the shards never share a first shard, so this
+    # keeps their ids apart without setting TICKET_ID_WORKER by hand
+    shard_ids = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()]
+    return min(shard_ids) % (MAX_WORKER + 1) if shard_ids else 0
+
+
+_generator = SnowflakeGenerator(int(os.getenv("TICKET_ID_WORKER") or _default_worker()))
+
+
+def new_ticket_id():
+    return _generator.next_id()
+
+
+def ticket_id_for(created_at: datetime, generator: SnowflakeGenerator):
+    """Id for a ticket created at ``created_at``; used when migrating old uuid ids."""
+    return generator.next_id(created_at.timestamp() * 1000)
+
+
+def ticket_id_time(ticket_id):
+    """Creation time (epoch seconds) encoded in a ticket id."""
+    return ((int(ticket_id) >> (WORKER_BITS + SEQUENCE_BITS)) + TICKET_ID_EPOCH_MS) / 1000
+
+
+def format_ticket_id(ticket_id):
+    """Short base36 form for channel names and messages; legacy uuid ids keep their first 8 chars."""
+    if isinstance(ticket_id, str) and not ticket_id.isdigit():
+        return ticket_id[:8]
+    n = int(ticket_id)
+    digits = []
+    while True:
+        n, r = divmod(n, 36)
+        digits.append(_ALPHABET[r])
+        if n == 0:
+            break
+    return "".join(reversed(digits))
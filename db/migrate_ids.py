@@ -0,0 +1,290 @@
+"""Convert a database from uuid ticket ids to 64-bit snowflake ids.
+
+    python -m db.migrate_ids            # backend from DB_TYPE
+    python -m db.migrate_ids --sqlite-path other.db
+
+Every ticket gets an id derived from its created_at (db/ids.py), so the new
+ids sort in creation order. References in participants, messages, events and
+the archive are rewritten to match. On SQLite the tables are also rebuilt with
+INTEGER id columns, and the file is vacuumed. The old -> new mapping is kept in
+``ticket_id_map``, because transcripts exported earlier are named after the
+old ids. Running the tool again reuses the mapping, so an interrupted run can
+be resumed. Stop the bot first.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from db.ids import SnowflakeGenerator, ticket_id_for
+from db.rollups import as_utc
+
+logger = logging.getLogger("keepalivebot.db.migrate_ids")
+
+MAP_BATCH_SIZE = 1000
+
+
+def _is_legacy(ticket_id):
+    return isinstance(ticket_id, str) and not ticket_id.isdigit()
+
+
+def build_mapping(first_seen, existing=None):
+    """Assign new ids to legacy ids in creation order.
+
+    ``first_seen`` maps legacy id -> earliest known timestamp. ``existing``
+    holds mappings from an earlier run and is kept unchanged.
+    """
+    mapping = dict(existing or {})
+    generator = SnowflakeGenerator(int(os.getenv("TICKET_ID_WORKER", 0)))
+    pending = sorted(
+        ((as_utc(ts) or datetime.now(tz=timezone.utc), old) for old, ts in first_seen.items() if old not in mapping),
+    )
+    for created_at, old in pending:
+        mapping[old] = ticket_id_for(created_at, generator)
+    return mapping
+
+
+def _note(first_seen, ticket_id, ts):
+    if not _is_legacy(ticket_id):
+        return
+    ts = as_utc(ts)
+    seen = first_seen.get(ticket_id)
+    if seen is None or (ts is not None and ts < seen):
+        first_seen[ticket_id] = ts
+
+
+# --- SQLite -------------------------------------------------------------------
+
+# Tables rebuilt with INTEGER ids: (table, columns copied, id columns to map)
+_SQLITE_TABLES = (
+    ("tickets", ("id", "guild_id", "channel_id", "creator_id", "status", "created_at", "closed_at",
+                 "claimed_by", "last_activity_at", "claimed_at"), "id"),
+    ("tickets_archive", ("id", "guild_id", "channel_id", "creator_id", "status", "created_at", "closed_at",
+                         "claimed_by", "archived_at", "claimed_at"), "id"),
+    ("ticket_participants", ("ticket_id", "user_id", "added_at"), "ticket_id"),
+    ("ticket_events", ("id", "ticket_id", "guild_id", "event", "actor_id", "data", "created_at"), "ticket_id"),
+    ("stats_daily", ("guild_id", "day", "opened", "closed"), None),
+    ("stats_staff", ("guild_id", "staff_id", "claims"), None),
+    ("stats_durations", ("guild_id", "metric", "bucket", "count"), None),
+)
+# Columns that hold Discord snowflakes and move from TEXT to INTEGER
+_SNOWFLAKE_COLUMNS = {"guild_id", "channel_id", "creator_id", "claimed_by", "user_id", "actor_id", "staff_id"}
+
+
+async def _sqlite_tables(conn):
+    async with conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'") as cursor:
+        return {row[0] for row in await cursor.fetchall()}
+
+
+async def migrate_sqlite(path=None):
+    import db.sqllite as backend
+    if path:
+        backend.DB_PATH = path
+    conn = await backend._get_connection()
+    # tickets is renamed last and copied last, so tickets_legacy marks an unfinished run
+    resuming = "tickets_legacy" in await _sqlite_tables(conn)
+    if not resuming and not await backend._has_legacy_ids(conn):
+        logger.info("%s already uses integer ticket ids", backend.DB_PATH)
+        return 0
+    await conn.execute("CREATE TABLE IF NOT EXISTS ticket_id_map (old_id TEXT PRIMARY KEY, new_id INTEGER NOT NULL UNIQUE)")
+    async with conn.execute("SELECT old_id, new_id FROM ticket_id_map") as cursor:
+        existing = {old: new for old, new in await cursor.fetchall()}
+
+    if not resuming:
+        first_seen = {}
+        for query in (
+            "SELECT id, created_at FROM tickets",
+            "SELECT id, created_at FROM tickets_archive",
+            "SELECT ticket_id, MIN(created_at) FROM ticket_events GROUP BY ticket_id",
+            "SELECT ticket_id, MIN(added_at) FROM ticket_participants GROUP BY ticket_id",
+            "SELECT ticket_id, MIN(created_at) FROM ticket_messages_fts GROUP BY ticket_id",
+        ):
+            async with conn.execute(query) as cursor:
+                async for ticket_id, ts in cursor:
+                    _note(first_seen, ticket_id, ts)
+        mapping = build_mapping(first_seen, existing)
+        await conn.executemany(
+            "INSERT OR IGNORE INTO ticket_id_map (old_id, new_id) VALUES (?, ?)",
+            [(old, new) for old, new in mapping.items() if old not in existing],
+        )
+        await conn.commit()
+
+        # Move the old tables aside; their index names are reused by the new ones
+        async with conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL") as cursor:
+            indexes = [row[0] for row in await cursor.fetchall()]
+        for index in indexes:
+            await conn.execute(f"DROP INDEX {index}")
+        tables = await _sqlite_tables(conn)
+        for table, _, _ in reversed(_SQLITE_TABLES):
+            if table in tables:
+                await conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+
+    # Recreate the current schema from scratch; every migration step is idempotent
+    await conn.execute("DELETE FROM schema_migrations")
+    await backend._migrate(conn)
+    tables = await _sqlite_tables(conn)
+    for table, columns, id_column in reversed(_SQLITE_TABLES):
+        if f"{table}_legacy" not in tables:
+            continue
+        select = []
+        for column in columns:
+            if column == id_column:
+                select.append(f"COALESCE(m.new_id, CAST(t.{column} AS INTEGER))")
+            elif column in _SNOWFLAKE_COLUMNS:
+                select.append(f"CAST(t.{column} AS INTEGER)")
+            else:
+                select.append(f"t.{column}")
+        join = f"LEFT JOIN ticket_id_map m ON m.old_id = t.{id_column}" if id_column else ""
+        # One transaction per table: a rerun starts the table over
+        await conn.execute(f"DELETE FROM {table}")
+        await conn.execute(f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        SELECT {", ".join(select)} FROM {table}_legacy t {join}
+        """)
+        await conn.execute(f"DROP TABLE {table}_legacy")
+        await conn.commit()
+    await conn.execute("""
+    UPDATE ticket_messages_fts
+    SET ticket_id = (SELECT new_id FROM ticket_id_map WHERE old_id = ticket_messages_fts.ticket_id)
+    WHERE ticket_id IN (SELECT old_id FROM ticket_id_map)
+    """)
+    await conn.commit()
+    await conn.execute("VACUUM")
+    async with conn.execute("SELECT COUNT(*) FROM ticket_id_map") as cursor:
+        (migrated,) = await cursor.fetchone()
+    logger.info("Migrated %d ticket ids in %s", migrated, backend.DB_PATH)
+    return migrated
+
+
+# --- MySQL --------------------------------------------------------------------
+
+# (table, column) pairs holding ticket ids
+_MYSQL_REFERENCES = (
+    ("tickets", "id"),
+    ("tickets_archive", "id"),
+    ("ticket_participants", "ticket_id"),
+    ("ticket_messages", "ticket_id"),
+    ("ticket_events", "ticket_id"),
+)
+
+
+async def migrate_mysql():
+    import db.mysql as backend
+    async with backend._cursor() as cursor:
+        await cursor.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'tickets' AND column_name = 'id'
+        """)
+        if (await cursor.fetchone())["data_type"].lower() == "bigint":
+            logger.info("MySQL already uses integer ticket ids")
+            return 0
+        await cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ticket_id_map (
+            old_id VARCHAR(36) PRIMARY KEY,
+            new_id BIGINT NOT NULL UNIQUE
+        ) ENGINE=InnoDB
+        """)
+        await cursor.execute("SELECT old_id, new_id FROM ticket_id_map")
+        existing = {row["old_id"]: row["new_id"] for row in await cursor.fetchall()}
+
+    first_seen = {}
+    for query in (
+        "SELECT id AS ticket_id, created_at AS ts FROM tickets",
+        "SELECT id AS ticket_id, created_at AS ts FROM tickets_archive",
+        "SELECT ticket_id, MIN(created_at) AS ts FROM ticket_events GROUP BY ticket_id",
+        "SELECT ticket_id, MIN(added_at) AS ts FROM ticket_participants GROUP BY ticket_id",
+        "SELECT ticket_id, MIN(created_at) AS ts FROM ticket_messages GROUP BY ticket_id",
+    ):
+        async with backend._cursor(backend.aiomysql.SSDictCursor) as cursor:
+            await cursor.execute(query)
+            while rows := await cursor.fetchmany(MAP_BATCH_SIZE):
+                for row in rows:
+                    _note(first_seen, row["ticket_id"], row["ts"])
+    mapping = build_mapping(first_seen, existing)
+    new_pairs = [(old, new) for old, new in mapping.items() if old not in existing]
+    for i in range(0, len(new_pairs), MAP_BATCH_SIZE):
+        async with backend._cursor() as cursor:
+            await cursor.executemany(
+                "INSERT IGNORE INTO ticket_id_map (old_id, new_id) VALUES (%s, %s)", new_pairs[i:i + MAP_BATCH_SIZE]
+            )
+
+    for table, column in _MYSQL_REFERENCES:
+        async with backend._cursor() as cursor:
+            # The VARCHAR column briefly holds the new id as digits, then becomes BIGINT
+            await cursor.execute(f"""
+            UPDATE {table} t JOIN ticket_id_map m ON t.{column} = m.old_id
+            SET t.{column} = m.new_id
+            """)
+            await cursor.execute(f"ALTER TABLE {table} MODIFY {column} BIGINT NOT NULL")
+    logger.info("Migrated %d ticket ids in MySQL", len(new_pairs))
+    return len(new_pairs)
+
+
+# --- MongoDB ------------------------------------------------------------------
+
+async def migrate_mongo():
+    import db.mongodb as backend
+    from pymongo import UpdateMany
+    from pymongo.errors import DuplicateKeyError
+    tickets = await backend._get_collection()
+    id_map = backend.db.ticket_id_map
+    existing = {doc["_id"]: doc["new_id"] async for doc in id_map.find()}
+
+    first_seen = {}
+    for collection in (tickets, backend.archivecollection):
+        async for doc in collection.find({"_id": {"$type": "string"}}, {"created_at": 1}):
+            _note(first_seen, doc["_id"], doc.get("created_at"))
+    for collection in (backend.eventscollection, backend.messagescollection):
+        async for doc in collection.aggregate([
+            {"$match": {"ticket_id": {"$type": "string"}}},
+            {"$group": {"_id": "$ticket_id", "ts": {"$min": "$created_at"}}},
+        ]):
+            _note(first_seen, doc["_id"], doc["ts"])
+    mapping = build_mapping(first_seen, existing)
+    new_pairs = [{"_id": old, "new_id": new} for old, new in mapping.items() if old not in existing]
+    if new_pairs:
+        await id_map.insert_many(new_pairs, ordered=False)
+
+    # _id is immutable: copy each document under its new id, then drop the old one
+    for collection in (tickets, backend.archivecollection):
+        async for doc in collection.find({"_id": {"$type": "string"}}):
+            old = doc["_id"]
+            doc["_id"] = mapping[old]
+            try:
+                await collection.insert_one(doc)
+            except DuplicateKeyError:
+                pass  # copied by an interrupted run
+            await collection.delete_one({"_id": old})
+    for collection in (backend.eventscollection, backend.messagescollection):
+        requests = [UpdateMany({"ticket_id": old}, {"$set": {"ticket_id": new}}) for old, new in mapping.items()]
+        for i in range(0, len(requests), MAP_BATCH_SIZE):
+            await collection.bulk_write(requests[i:i + MAP_BATCH_SIZE], ordered=False)
+    logger.info("Migrated %d ticket ids in MongoDB", len(new_pairs))
+    return len(new_pairs)
+
+
+async def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default=os.getenv("DB_TYPE"), choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--sqlite-path", help="SQLite file to migrate (default: the bot's database)")
+    args = parser.parse_args()
+    from db.db_interface import load_backend
+    backend = load_backend(args.backend)
+    try:
+        if args.backend == "sqlite":
+            await migrate_sqlite(args.sqlite_path)
+        elif args.backend == "mysql":
+            await migrate_mysql()
+        else:
+            await migrate_mongo()
+    finally:
+        await backend.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+"""Versioned schema migrations.
+
+Each backend lists its schema changes as ``Migration`` steps with increasing
+versions and keeps the applied versions in ``schema_migrations``. The
+backend runs the pending steps when it opens its first connection. To apply
+them before rolling out a new bot version, run them by hand:
+
+    python -m db.migrations            # backend from DB_TYPE
+
+Steps must be idempotent, because databases created before versioning start
+at version 0 but may already have some of the changes. Backfills update
+MIGRATION_BATCH_SIZE rows per statement and commit between batches, so a
+large table is never locked for long and the bot keeps serving meanwhile.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, NamedTuple
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger("keepalivebot.db.migrations")
+
+def migration_batch_size():
+    # Read when a step runs, after the bot or main() has loaded .env
+    return int(os.getenv("MIGRATION_BATCH_SIZE", 1000))
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[..., Awaitable[None]]
+
+
+async def run_migrations(backend_name, migrations, applied, record, *args):
+    """Apply every migration whose version is not in ``applied``, in order.
+
+    ``apply(*args)`` runs the step and ``record(migration)`` stores it as
+    applied. Returns the number of steps run.
+    """
+    pending = sorted((m for m in migrations if m.version not in applied), key=lambda m: m.version)
+    for migration in pending:
+        started = time.perf_counter()
+        logger.info("Applying %s migration %d: %s", backend_name, migration.version, migration.name)
+        await migration.apply(*args)
+        await record(migration)
+        logger.info("%s migration %d done in %.2fs", backend_name, migration.version, time.perf_counter() - started)
+    return len(pending)
+
+
+async def main():
+    load_dotenv()
+    from db.db_interface import get_backend
+    backend = get_backend()
+    try:
+        await backend.init()
+        applied = await backend.schema_version()
+        logger.info("%s schema is at version %d", backend.name, applied)
+    finally:
+        await backend.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    asyncio.run(main())
@@ -1,67 +1,520 @@
-from pymongo import MongoClient
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
-import uuid
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+from db.ids import new_ticket_id
+from db.migrations import Migration, migration_batch_size, run_migrations
+from db.rollups import METRIC_CLAIM, METRIC_CLOSE, bucket_for, day_key
+
 load_dotenv()
 
-# connect to mongodb
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client[os.getenv("MONGO_DB_NAME")]
+client = None
+db = None
+ticketscollection = None
+messagescollection = None
+archivecollection = None
+stats_daily = None
+stats_staff = None
+stats_durations = None
+eventscollection = None
+guildconfig = None
+_migration_task = None
+
+
+async def _get_collection():
+    # The client is created on first use so importing this module never
+    # starts the driver's background monitor threads. Pending migrations run
+    # first, before any query: the unique stats_daily index cannot be built
+    # once concurrent upserts have written duplicate days.
+    global client, db, ticketscollection, messagescollection, archivecollection, _migration_task
+    global stats_daily, stats_staff, stats_durations, eventscollection, guildconfig
+    if ticketscollection is None:
+        client = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+        db = client[os.getenv("MONGO_DB_NAME")]
+        ticketscollection = db.tickets
+        messagescollection = db.ticket_messages
+        archivecollection = db.tickets_archive
+        stats_daily = db.stats_daily
+        stats_staff = db.stats_staff
+        stats_durations = db.stats_durations
+        eventscollection = db.ticket_events
+        # Keyed by guild id (_id); guilds without a document use the environment defaults
+        guildconfig = db.guild_config
+        _migration_task = asyncio.get_running_loop().create_task(_migrate())
+    # Shielded so a cancelled caller does not abort the migration for everyone else
+    await asyncio.shield(_migration_task)
+    return ticketscollection
+
+
+async def _create_indexes():
+    await ticketscollection.create_index([("creator_id", 1), ("status", 1)])
+    await messagescollection.create_index([("guild_id", 1), ("content", "text")])
+    await ticketscollection.create_index([("guild_id", 1), ("status", 1)])
+    await stats_daily.create_index([("guild_id", 1), ("day", 1)], unique=True)
+    await stats_staff.create_index([("guild_id", 1), ("claims", -1)])
+    await eventscollection.create_index([("ticket_id", 1)])
+
+
+async def _add_last_activity():
+    # tickets created before activity tracking start from their creation time;
+    # batched by _id so no single update touches the whole collection
+    missing = {"status": "open", "last_activity_at": {"$exists": False}}
+    batch_size = migration_batch_size()
+    while True:
+        ids = [doc["_id"] async for doc in ticketscollection.find(missing, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            break
+        await ticketscollection.update_many(
+            {"_id": {"$in": ids}, **missing}, [{"$set": {"last_activity_at": "$created_at"}}],
+        )
+    await ticketscollection.create_index([("status", 1), ("last_activity_at", 1)])
+
+
+async def _add_channel_index():
+    # get_ticket_by_channel runs on every message in a ticket channel
+    await ticketscollection.create_index([("channel_id", 1)])
+
+
+MIGRATIONS = (
+    Migration(1, "base indexes", _create_indexes),
+    Migration(2, "tickets.last_activity_at", _add_last_activity),
+    Migration(3, "tickets channel_id index", _add_channel_index),
+)
+
+
+async def _applied_versions():
+    return {doc["_id"] async for doc in db.schema_migrations.find({}, {"_id": 1})}
 
-ticketbotdb = db.ticketbot
-ticketscollection = db.tickets
 
+async def _migrate():
+    async def record(migration):
+        await db.schema_migrations.update_one(
+            {"_id": migration.version},
+            {"$setOnInsert": {"name": migration.name, "applied_at": datetime.now(tz=timezone.utc)}},
+            upsert=True,
+        )
 
+    await run_migrations("mongodb", MIGRATIONS, await _applied_versions(), record)
 
-def mongo_create_ticket(guild_id, channel_id, creator_id):
-    ticket_id = str(uuid.uuid4())
+
+async def mongo_init():
+    await _get_collection()
+    await client.admin.command("ping")
+
+async def mongo_schema_version():
+    await _get_collection()
+    return max(await _applied_versions(), default=0)
+
+async def mongo_create_ticket(guild_id, channel_id, creator_id):
+    ticket_id = new_ticket_id()
+    created_at = datetime.now(tz=timezone.utc)
     ticketdoc = {
         "_id": ticket_id,
         "guild_id": guild_id,
         "channel_id": channel_id,
         "creator_id": creator_id,
         "status": "open", # open, closed
-        "created_at": datetime.now(tz=timezone.utc),
-    "closed_at": None,
-    "claimed_by": None,
+        "created_at": created_at,
+        "closed_at": None,
+        "claimed_by": None,
+        "participants": [],
+        "last_activity_at": created_at,
     }
-    ticketscollection.insert_one(ticketdoc)
+    collection = await _get_collection()
+    await collection.insert_one(ticketdoc)
+    await _bump_daily(guild_id, day_key(created_at), opened=1)
     return ticket_id
 
-def mongo_close_ticket(ticket_id):
-    result = ticketscollection.update_one({"_id": ticket_id}, {"$set": {"status": "closed", "closed_at": datetime.now(tz=timezone.utc )}})
-    return result.modified_count
+async def mongo_close_ticket(ticket_id):
+    closed_at = datetime.now(tz=timezone.utc)
+    # Only the open -> closed transition counts towards the rollups
+    collection = await _get_collection()
+    before = await collection.find_one_and_update(
+        {"_id": ticket_id, "status": {"$ne": "closed"}},
+        {"$set": {"status": "closed", "closed_at": closed_at}},
+        projection={"guild_id": 1, "created_at": 1},
+    )
+    if before is None:
+        return 0
+    await _bump_daily(before["guild_id"], day_key(closed_at), closed=1)
+    await _bump_duration(before["guild_id"], METRIC_CLOSE, bucket_for(before["created_at"], closed_at))
+    return 1
 
-def mongo_get_ticket(ticket_id):
-    return ticketscollection.find_one({"_id": ticket_id})
+async def mongo_close_tickets(ticket_ids):
+    # update_many cannot report which documents it changed, and the rollups
+    # need exactly that, so each ticket gets its own guarded update
+    closed = 0
+    for ticket_id in ticket_ids:
+        closed += await mongo_close_ticket(ticket_id)
+    return closed
 
-def mongo_update_ticket_status(ticket_id, status):
-    result = ticketscollection.update_one({"_id": ticket_id}, {"$set": {"status": status}})
-    return result.modified_count
+def _normalize(ticket):
+    # expose the ticket id as "id" like the SQL backends
+    if ticket is not None:
+        ticket["id"] = ticket["_id"]
+    return ticket
+
+async def mongo_get_ticket(ticket_id):
+    collection = await _get_collection()
+    return _normalize(await collection.find_one({"_id": ticket_id}))
 
-def mongo_update_ticket_channel(ticket_id, channel_id):
-    result = ticketscollection.update_one({"_id": ticket_id}, {"$set": {"channel_id": channel_id}})
+async def mongo_update_ticket_status(ticket_id, status):
+    collection = await _get_collection()
+    result = await collection.update_one({"_id": ticket_id}, {"$set": {"status": status}})
     return result.modified_count
 
-def mongo_claim_ticket(ticket_id, staff_user_id):
-    result = ticketscollection.update_one({"_id": ticket_id, "claimed_by": None}, {"$set": {"claimed_by": staff_user_id}})
+async def mongo_update_ticket_channel(ticket_id, channel_id):
+    collection = await _get_collection()
+    result = await collection.update_one({"_id": ticket_id}, {"$set": {"channel_id": channel_id}})
     return result.modified_count
 
-def mongo_unclaim_ticket(ticket_id, staff_user_id):
+async def mongo_claim_ticket(ticket_id, staff_user_id):
+    """Claim in one round trip; returns (outcome, claimed_by).
+
+    The pipeline update keeps an existing claimer ($ifNull) and the pre-image
+    tells us who held the ticket before this write. claimed_at keeps the
+    first claim, which is what time-to-claim measures.
+    """
+    claimed_at = datetime.now(tz=timezone.utc)
+    collection = await _get_collection()
+    before = await collection.find_one_and_update(
+        {"_id": ticket_id},
+        [{"$set": {
+            # evaluated against the pre-update document, like claimed_by below
+            "claimed_at": {"$cond": [
+                {"$eq": [{"$ifNull": ["$claimed_by", None]}, None]},
+                {"$ifNull": ["$claimed_at", claimed_at]},
+                "$claimed_at",
+            ]},
+            "claimed_by": {"$ifNull": ["$claimed_by", staff_user_id]},
+        }}],
+        projection={"claimed_by": 1, "claimed_at": 1, "guild_id": 1, "created_at": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        return "not_found", None
+    claimed_by = before.get("claimed_by")
+    if claimed_by is None:
+        await _bump_staff(before["guild_id"], staff_user_id)
+        if before.get("claimed_at") is None:
+            await _bump_duration(before["guild_id"], METRIC_CLAIM, bucket_for(before["created_at"], claimed_at))
+        return "success", staff_user_id
+    if claimed_by == staff_user_id:
+        return "already_yours", staff_user_id
+    return "already_claimed", claimed_by
+
+async def mongo_unclaim_ticket(ticket_id, staff_user_id):
     # Only the current claimer (or if we wanted: allow any staff) can unclaim; enforce match
-    result = ticketscollection.update_one({"_id": ticket_id, "claimed_by": staff_user_id}, {"$set": {"claimed_by": None}})
+    collection = await _get_collection()
+    result = await collection.update_one({"_id": ticket_id, "claimed_by": staff_user_id}, {"$set": {"claimed_by": None}})
     return result.modified_count
 
-def mongo_get_ticket_id(channel_id):
-    ticket = ticketscollection.find_one({"channel_id": channel_id})
+async def mongo_get_ticket_id(channel_id):
+    collection = await _get_collection()
+    ticket = await collection.find_one({"channel_id": channel_id}, {"_id": 1})
     return ticket["_id"] if ticket else None
 
-def mongo_delete_ticket(ticket_id):
-    result = ticketscollection.delete_one({"_id": ticket_id})
+async def mongo_delete_ticket(ticket_id):
+    return await mongo_delete_tickets([ticket_id])
+
+async def mongo_delete_tickets(ticket_ids):
+    collection = await _get_collection()
+    # A ticket without a channel was never provisioned: take back its "opened"
+    unprovisioned = [
+        doc async for doc in collection.find(
+            {"_id": {"$in": list(ticket_ids)}, "channel_id": None}, {"guild_id": 1, "created_at": 1}
+        )
+    ]
+    result = await collection.delete_many({"_id": {"$in": list(ticket_ids)}})
+    for doc in unprovisioned:
+        await _bump_daily(doc["guild_id"], day_key(doc["created_at"]), opened=-1)
     return result.deleted_count
 
-def mongo_ticket_channel_exists(channel_id):
-    ticket = ticketscollection.find_one({"channel_id": channel_id})
+async def mongo_ticket_channel_exists(channel_id):
+    collection = await _get_collection()
+    ticket = await collection.find_one({"channel_id": channel_id}, {"_id": 1})
     return ticket is not None
+
+async def mongo_get_ticket_by_channel(channel_id):
+    collection = await _get_collection()
+    return _normalize(await collection.find_one({"channel_id": channel_id}))
+
+async def mongo_get_guild_tickets(guild_id):
+    """id, channel_id, status and created_at of every live ticket in a guild, in one query."""
+    collection = await _get_collection()
+    cursor = collection.find({"guild_id": guild_id}, {"channel_id": 1, "status": 1, "created_at": 1})
+    return [_normalize(doc) async for doc in cursor]
+
+async def mongo_count_open_tickets(guild_id, creator_id):
+    collection = await _get_collection()
+    return await collection.count_documents({"creator_id": creator_id, "status": "open", "guild_id": guild_id})
+
+async def mongo_touch_tickets(activity):
+    """Record the latest activity for many tickets; ``activity`` is [(ticket_id, at), ...]."""
+    # $max never moves the timestamp backwards if batches land out of order
+    collection = await _get_collection()
+    await collection.bulk_write(
+        [UpdateOne({"_id": ticket_id}, {"$max": {"last_activity_at": at}}) for ticket_id, at in activity],
+        ordered=False,
+    )
+
+async def mongo_get_stale_tickets(inactive_since, limit, guild_ids=None):
+    query = {"status": "open", "last_activity_at": {"$lt": inactive_since}}
+    if guild_ids is not None:
+        query["guild_id"] = {"$in": list(guild_ids)}
+    collection = await _get_collection()
+    docs = await collection.find(query).sort("last_activity_at", 1).limit(limit).to_list(length=limit)
+    return [_normalize(doc) for doc in docs]
+
+async def mongo_add_users_to_ticket(ticket_id, user_ids):
+    collection = await _get_collection()
+    await collection.update_one({"_id": ticket_id}, {"$addToSet": {"participants": {"$each": list(user_ids)}}})
+
+async def mongo_remove_users_from_ticket(ticket_id, user_ids):
+    collection = await _get_collection()
+    await collection.update_one({"_id": ticket_id}, {"$pullAll": {"participants": list(user_ids)}})
+
+async def mongo_get_closed_tickets(guild_id, closed_before, limit, after_id=None):
+    query = {"guild_id": guild_id, "status": "closed", "closed_at": {"$lt": closed_before}}
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+    collection = await _get_collection()
+    docs = await collection.find(query).sort("_id", 1).limit(limit).to_list(length=limit)
+    return [_normalize(doc) for doc in docs]
+
+async def mongo_archive_tickets(ticket_ids):
+    """Copy tickets into tickets_archive, then delete them; safe to repeat."""
+    collection = await _get_collection()
+    docs = await collection.find({"_id": {"$in": list(ticket_ids)}}).to_list(length=None)
+    if docs:
+        archived_at = datetime.now(tz=timezone.utc)
+        for doc in docs:
+            doc["archived_at"] = archived_at
+        try:
+            await archivecollection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # already archived by an earlier, interrupted run
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+    result = await ticketscollection.delete_many({"_id": {"$in": list(ticket_ids)}})
+    return result.deleted_count
+
+async def mongo_index_messages(messages):
+    docs = [{"_id": m["message_id"], **{k: v for k, v in m.items() if k != "message_id"}} for m in messages]
+    await _get_collection()
+    try:
+        await messagescollection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # duplicates from a retried batch are fine
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+async def mongo_search_messages(guild_id, text, limit=10, cursor=None):
+    """$text search ranked by textScore; returns (results, next_cursor), keyset-paginated on (score, _id)."""
+    await _get_collection()
+    pipeline = [
+        {"$match": {"guild_id": guild_id, "$text": {"$search": text}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        score, message_id = cursor.split(":")
+        score, message_id = float(score), int(message_id)
+        pipeline.append({"$match": {"$or": [{"score": {"$lt": score}}, {"score": score, "_id": {"$gt": message_id}}]}})
+    pipeline += [{"$sort": {"score": -1, "_id": 1}}, {"$limit": limit}]
+    rows = await messagescollection.aggregate(pipeline).to_list(length=limit)
+    for row in rows:
+        row["message_id"] = row.pop("_id")
+        row["snippet"] = row.pop("content")[:200]
+    next_cursor = f"{rows[-1]['score']!r}:{rows[-1]['message_id']}" if len(rows) == limit else None
+    return rows, next_cursor
+
+async def mongo_record_events(events):
+    await _get_collection()
+    # insert_many adds _id to the dicts it is given; keep the caller's untouched
+    await eventscollection.insert_many([dict(e) for e in events], ordered=False)
+
+# Rollups are bumped right after the ticket write; without a transaction a
+# crash in between can lose one increment, which a rebuild repairs.
+async def _bump_daily(guild_id, day, opened=0, closed=0):
+    await stats_daily.update_one(
+        {"guild_id": guild_id, "day": day}, {"$inc": {"opened": opened, "closed": closed}}, upsert=True
+    )
+
+async def _bump_staff(guild_id, staff_id):
+    await stats_staff.update_one({"guild_id": guild_id, "staff_id": staff_id}, {"$inc": {"claims": 1}}, upsert=True)
+
+async def _bump_duration(guild_id, metric, bucket):
+    await stats_durations.update_one(
+        {"guild_id": guild_id, "metric": metric, "bucket": bucket}, {"$inc": {"count": 1}}, upsert=True
+    )
+
+async def mongo_get_stats(guild_id, since_day, staff_limit=10):
+    await _get_collection()
+    daily = [
+        (doc["day"], doc.get("opened", 0), doc.get("closed", 0))
+        async for doc in stats_daily.find({"guild_id": guild_id, "day": {"$gte": since_day}}).sort("day", 1)
+    ]
+    staff = [
+        (doc["staff_id"], doc["claims"])
+        async for doc in stats_staff.find({"guild_id": guild_id}).sort("claims", -1).limit(staff_limit)
+    ]
+    durations = {METRIC_CLAIM: {}, METRIC_CLOSE: {}}
+    async for doc in stats_durations.find({"guild_id": guild_id}):
+        durations.setdefault(doc["metric"], {})[doc["bucket"]] = doc["count"]
+    return {"daily": daily, "staff": staff, "durations": durations}
+
+async def mongo_iter_tickets(guild_id):
+    """Stream every ticket of a guild, live and archived; the driver fetches in batches."""
+    for collection in (await _get_collection(), archivecollection):
+        async for doc in collection.find({"guild_id": guild_id}):
+            yield _normalize(doc)
+
+async def mongo_replace_stats(guild_id, acc):
+    """Replace a guild's rollups with the ones in ``acc`` (a StatsAccumulator)."""
+    await _get_collection()
+    for collection in (stats_daily, stats_staff, stats_durations):
+        await collection.delete_many({"guild_id": guild_id})
+    if acc.daily:
+        await stats_daily.insert_many([
+            {"guild_id": guild_id, "day": day, "opened": opened, "closed": closed}
+            for day, (opened, closed) in acc.daily.items()
+        ])
+    if acc.staff:
+        await stats_staff.insert_many([
+            {"guild_id": guild_id, "staff_id": staff_id, "claims": claims} for staff_id, claims in acc.staff.items()
+        ])
+    docs = [
+        {"guild_id": guild_id, "metric": metric, "bucket": bucket, "count": count}
+        for metric, buckets in acc.durations.items() for bucket, count in buckets.items()
+    ]
+    if docs:
+        await stats_durations.insert_many(docs)
+
+async def mongo_get_guild_config(guild_id):
+    await _get_collection()
+    doc = await guildconfig.find_one({"_id": guild_id})
+    if doc is None:
+        return None
+    doc["guild_id"] = doc.pop("_id")
+    return doc
+
+async def mongo_set_guild_config(guild_id, support_role_id):
+    await _get_collection()
+    await guildconfig.update_one(
+        {"_id": guild_id},
+        {"$set": {"support_role_id": support_role_id, "updated_at": datetime.now(tz=timezone.utc)}},
+        upsert=True,
+    )
+
+async def _transfer_collection(table):
+    await _get_collection()
+    return {
+        "tickets": ticketscollection,
+        "tickets_archive": archivecollection,
+        "ticket_participants": ticketscollection,
+        "ticket_messages": messagescollection,
+        "ticket_events": eventscollection,
+        "stats_daily": stats_daily,
+        "stats_staff": stats_staff,
+        "stats_durations": stats_durations,
+        "guild_config": guildconfig,
+    }[table]
+
+def _transfer_row(table, doc, columns):
+    row = {c: doc.get(c) for c in columns}
+    if table in ("tickets", "tickets_archive", "ticket_events"):
+        # ticket_events ids are ObjectIds here; they only serve as a resume cursor
+        row["id"] = doc["_id"] if table != "ticket_events" else str(doc["_id"])
+    elif table == "ticket_messages":
+        row["message_id"] = doc["_id"]
+    elif table == "guild_config":
+        row["guild_id"] = doc["_id"]
+    return row
+
+async def mongo_export_rows(table, columns, after=None, batch_size=1000):
+    """Stream ``columns`` of ``table`` in _id order for db.transfer; yields (rows, cursor) batches.
+
+    Participants are stored on the ticket, so ``ticket_participants`` is
+    unwound from ``tickets``, with the ticket's created_at as added_at.
+    """
+    collection = await _transfer_collection(table)
+    query = {}
+    if after:
+        last = after[0]
+        query["_id"] = {"$gt": ObjectId(last) if isinstance(last, str) and ObjectId.is_valid(last) else last}
+    if table == "ticket_participants":
+        query["participants.0"] = {"$exists": True}
+    rows, last_id = [], None
+    async for doc in collection.find(query).sort("_id", 1).batch_size(batch_size):
+        if table == "ticket_participants":
+            rows.extend(
+                {"ticket_id": doc["_id"], "user_id": user_id, "added_at": doc["created_at"]}
+                for user_id in doc["participants"]
+            )
+        else:
+            rows.append(_transfer_row(table, doc, columns))
+        last_id = doc["_id"]
+        if len(rows) >= batch_size:
+            yield rows, [str(last_id) if isinstance(last_id, ObjectId) else last_id]
+            rows = []
+    if rows:
+        yield rows, [str(last_id) if isinstance(last_id, ObjectId) else last_id]
+
+async def _insert_ignoring_duplicates(collection, docs):
+    try:
+        await collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+async def mongo_import_rows(table, columns, rows):
+    """Insert rows exported by another backend; rows that already exist are skipped."""
+    collection = await _transfer_collection(table)
+    if table == "ticket_messages":
+        return await mongo_index_messages(rows)
+    if table == "ticket_participants":
+        by_ticket = {}
+        for row in rows:
+            by_ticket.setdefault(row["ticket_id"], []).append(row["user_id"])
+        await collection.bulk_write([
+            UpdateOne({"_id": ticket_id}, {"$addToSet": {"participants": {"$each": user_ids}}})
+            for ticket_id, user_ids in by_ticket.items()
+        ], ordered=False)
+        return
+    if table.startswith("stats_"):
+        # No unique _id to collide on: upsert on the natural key instead
+        key = {"stats_daily": ("guild_id", "day"), "stats_staff": ("guild_id", "staff_id"),
+               "stats_durations": ("guild_id", "metric", "bucket")}[table]
+        await collection.bulk_write([
+            ReplaceOne({k: row[k] for k in key}, row, upsert=True) for row in rows
+        ], ordered=False)
+        return
+    docs = []
+    for row in rows:
+        if table == "guild_config":
+            docs.append({"_id": row["guild_id"], **{c: row[c] for c in columns if c != "guild_id"}})
+            continue
+        doc = {c: row[c] for c in columns if c != "id"}
+        if row.get("id") is not None:
+            doc["_id"] = row["id"]
+        if table == "tickets":
+            doc["participants"] = []
+        docs.append(doc)
+    await _insert_ignoring_duplicates(collection, docs)
+
+async def mongo_close():
+    global client, db, ticketscollection, messagescollection, archivecollection, _migration_task
+    global stats_daily, stats_staff, stats_durations, eventscollection, guildconfig
+    if _migration_task is not None:
+        _migration_task.cancel()
+        await asyncio.gather(_migration_task, return_exceptions=True)
+        _migration_task = None
+    if client is not None:
+        client.close()
+    client = db = ticketscollection = messagescollection = archivecollection = None
+    stats_daily = stats_staff = stats_durations = eventscollection = guildconfig = None
@@ -1,9 +1,16 @@
-import mysql.connector
-from mysql.connector import Error
+import aiomysql
+import asyncio
+import json
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-import uuid
 import os
 import logging
+import time
+
+from db.ids import new_ticket_id
+from db.migrations import Migration, migration_batch_size, run_migrations
+from db.rollups import METRIC_CLAIM, METRIC_CLOSE, bucket_for, day_key
+from utils import metrics
 
 logger = logging.getLogger("keepalivebot.db.mysql")
 
@@ -13,38 +20,10 @@ MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "password")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "ticket_bot")
 
-def _connect_db(database: str | None = MYSQL_DATABASE):
-    return mysql.connector.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        database=database
-    ) if database else mysql.connector.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD
-    )
-
-try:
-    connection = _connect_db()
-except Error as e:
-    if getattr(e, 'errno', None) == 1049:  # Unknown database
-        logger.info("Database %s missing, creating it", MYSQL_DATABASE)
-        tmp_conn = _connect_db(database=None)
-        tmp_cursor = tmp_conn.cursor()
-        tmp_cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{MYSQL_DATABASE}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-        tmp_cursor.close()
-        tmp_conn.close()
-        connection = _connect_db()
-    else:
-        raise
-
-cursor = connection.cursor(dictionary=True)
-
 create_table_command = (
     """
     CREATE TABLE IF NOT EXISTS tickets (
-        id VARCHAR(36) PRIMARY KEY,
+        id BIGINT PRIMARY KEY,
         guild_id BIGINT NOT NULL,
         channel_id BIGINT,
         creator_id BIGINT NOT NULL,
@@ -52,128 +31,762 @@ create_table_command = (
         created_at DATETIME NOT NULL,
         closed_at DATETIME,
         claimed_by BIGINT,
+        last_activity_at DATETIME,
+        claimed_at DATETIME,
         KEY idx_channel (channel_id),
-        KEY idx_guild_status (guild_id, status)
+        KEY idx_guild_status (guild_id, status),
+        KEY idx_creator_status (creator_id, status),
+        KEY idx_status_activity (status, last_activity_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """
+)
+
+create_participants_command = (
+    """
+    CREATE TABLE IF NOT EXISTS ticket_participants (
+        ticket_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        added_at DATETIME NOT NULL,
+        PRIMARY KEY (ticket_id, user_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """
+)
+
+create_messages_command = (
+    """
+    CREATE TABLE IF NOT EXISTS ticket_messages (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        message_id BIGINT NOT NULL,
+        ticket_id BIGINT NOT NULL,
+        guild_id BIGINT NOT NULL,
+        channel_id BIGINT NOT NULL,
+        author_id BIGINT NOT NULL,
+        created_at DATETIME NOT NULL,
+        content TEXT NOT NULL,
+        UNIQUE KEY uq_message (message_id),
+        KEY idx_guild (guild_id),
+        FULLTEXT KEY ft_content (content)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """
+)
+
+create_archive_command = (
+    """
+    CREATE TABLE IF NOT EXISTS tickets_archive (
+        id BIGINT PRIMARY KEY,
+        guild_id BIGINT NOT NULL,
+        channel_id BIGINT,
+        creator_id BIGINT NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        created_at DATETIME NOT NULL,
+        closed_at DATETIME,
+        claimed_by BIGINT,
+        archived_at DATETIME NOT NULL,
+        claimed_at DATETIME,
+        KEY idx_guild_closed (guild_id, closed_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """
+)
+
+# Append-only audit trail of ticket state transitions
+create_events_command = (
+    """
+    CREATE TABLE IF NOT EXISTS ticket_events (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        ticket_id BIGINT NOT NULL,
+        guild_id BIGINT NOT NULL,
+        event VARCHAR(32) NOT NULL,
+        actor_id BIGINT,
+        data JSON,
+        created_at DATETIME(3) NOT NULL,
+        KEY idx_event_ticket (ticket_id)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
     """
 )
-cursor.execute(create_table_command)
-connection.commit()
 
-def mysql_create_ticket(guild_id, channel_id, creator_id):
-    ticket_id = str(uuid.uuid4())
+# Per-guild settings; guilds without a row use the environment defaults
+create_guild_config_command = """
+CREATE TABLE IF NOT EXISTS guild_config (
+    guild_id BIGINT PRIMARY KEY,
+    support_role_id BIGINT NULL,
+    updated_at DATETIME NOT NULL
+) ENGINE=InnoDB
+"""
+
+# Analytics rollups, maintained in the same transaction as the ticket writes
+create_stats_commands = (
+    """
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        guild_id BIGINT NOT NULL,
+        day CHAR(10) NOT NULL,
+        opened INT NOT NULL DEFAULT 0,
+        closed INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, day)
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_staff (
+        guild_id BIGINT NOT NULL,
+        staff_id BIGINT NOT NULL,
+        claims INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, staff_id)
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_durations (
+        guild_id BIGINT NOT NULL,
+        metric VARCHAR(16) NOT NULL,
+        bucket INT NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, metric, bucket)
+    ) ENGINE=InnoDB
+    """,
+)
+
+MYSQL_POOL_MIN = int(os.getenv("MYSQL_POOL_MIN", 1))
+MYSQL_POOL_MAX = int(os.getenv("MYSQL_POOL_MAX", 10))
+# Recycle connections before the server's wait_timeout drops them
+MYSQL_POOL_RECYCLE = int(os.getenv("MYSQL_POOL_RECYCLE", 3600))
+MYSQL_CONNECT_RETRIES = int(os.getenv("MYSQL_CONNECT_RETRIES", 5))
+
+pool = None
+_pool_lock = asyncio.Lock()
+_stats = {"checkouts": 0, "waiting": 0, "max_waiting": 0, "reconnects": 0, "wait_seconds_total": 0.0}
+
+
+async def _connect_db(database: str | None = MYSQL_DATABASE):
+    kwargs = dict(
+        host=MYSQL_HOST,
+        port=int(MYSQL_PORT),
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+    )
+    if database:
+        kwargs["db"] = database
+    return await aiomysql.connect(**kwargs)
+
+async def _create_pool():
+    return await aiomysql.create_pool(
+        host=MYSQL_HOST,
+        port=int(MYSQL_PORT),
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        db=MYSQL_DATABASE,
+        minsize=MYSQL_POOL_MIN,
+        maxsize=MYSQL_POOL_MAX,
+        pool_recycle=MYSQL_POOL_RECYCLE,
+    )
+
+async def _with_backoff(what, fn):
+    delay = 0.5
+    for attempt in range(1, MYSQL_CONNECT_RETRIES + 1):
+        try:
+            return await fn()
+        except aiomysql.OperationalError as e:
+            if attempt == MYSQL_CONNECT_RETRIES:
+                raise
+            logger.warning("%s failed (attempt %d/%d): %s; retrying in %.1fs", what, attempt, MYSQL_CONNECT_RETRIES, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+
+async def _ensure_column(cur, table, column, decl):
+    await cur.execute("""
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    if await cur.fetchone() is not None:
+        return False
+    await cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+async def _ensure_index(cur, table, index, columns):
+    await cur.execute("""
+    SELECT 1 FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    if await cur.fetchone() is None:
+        # Online DDL: reads and writes continue while InnoDB builds the index
+        await cur.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+
+async def _create_tables(conn):
+    async with conn.cursor() as cur:
+        await cur.execute(create_table_command)
+        await cur.execute(create_participants_command)
+        await cur.execute(create_messages_command)
+        await cur.execute(create_archive_command)
+        for command in create_stats_commands:
+            await cur.execute(command)
+        await cur.execute(create_events_command)
+
+async def _add_last_activity(conn):
+    async with conn.cursor() as cur:
+        await _ensure_column(cur, "tickets", "last_activity_at", "DATETIME")
+    # Batched so row locks are held for one batch at a time
+    batch_size = migration_batch_size()
+    while True:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+            UPDATE tickets SET last_activity_at = created_at
+            WHERE status = 'open' AND last_activity_at IS NULL
+            LIMIT %s
+            """, (batch_size,))
+            updated = cur.rowcount
+        await conn.commit()
+        if updated < batch_size:
+            break
+        await asyncio.sleep(0)
+    async with conn.cursor() as cur:
+        await _ensure_index(cur, "tickets", "idx_status_activity", "status, last_activity_at")
+
+async def _add_claimed_at(conn):
+    async with conn.cursor() as cur:
+        await _ensure_column(cur, "tickets", "claimed_at", "DATETIME")
+        await _ensure_column(cur, "tickets_archive", "claimed_at", "DATETIME")
+
+async def _add_creator_index(conn):
+    async with conn.cursor() as cur:
+        await _ensure_index(cur, "tickets", "idx_creator_status", "creator_id, status")
+
+async def _add_guild_config(conn):
+    async with conn.cursor() as cur:
+        await cur.execute(create_guild_config_command)
+
+MIGRATIONS = (
+    Migration(1, "base tables", _create_tables),
+    Migration(2, "tickets.last_activity_at", _add_last_activity),
+    Migration(3, "claimed_at columns", _add_claimed_at),
+    Migration(4, "tickets (creator_id, status) index", _add_creator_index),
+    Migration(5, "guild_config table", _add_guild_config),
+)
+
+async def _applied_versions(cur):
+    await cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in await cur.fetchall()}
+
+async def _migrate(conn):
+    async with conn.cursor() as cur:
+        await cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(128) NOT NULL,
+            applied_at DATETIME NOT NULL
+        ) ENGINE=InnoDB
+        """)
+        # Several bot processes may start at once; only one migrates
+        await cur.execute("SELECT GET_LOCK('ticketbot_schema_migrations', 600)")
+    try:
+        async with conn.cursor() as cur:
+            applied = await _applied_versions(cur)
+
+        async def record(migration):
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                    (migration.version, migration.name, datetime.now(tz=timezone.utc)),
+                )
+            await conn.commit()
+
+        await run_migrations("mysql", MIGRATIONS, applied, record, conn)
+    finally:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT RELEASE_LOCK('ticketbot_schema_migrations')")
+
+async def _get_pool():
+    global pool
+    if pool is None:
+        async with _pool_lock:
+            if pool is None:
+                try:
+                    new_pool = await _create_pool()
+                except aiomysql.OperationalError as e:
+                    if e.args and e.args[0] == 1049:  # Unknown database
+                        logger.info("Database %s missing, creating it", MYSQL_DATABASE)
+                        tmp_conn = await _connect_db(database=None)
+                        async with tmp_conn.cursor() as tmp_cursor:
+                            await tmp_cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{MYSQL_DATABASE}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+                        tmp_conn.close()
+                    new_pool = await _with_backoff("MySQL pool creation", _create_pool)
+                async with new_pool.acquire() as conn:
+                    await _migrate(conn)
+                    async with conn.cursor() as cur:
+                        await cur.execute("""
+                        SELECT data_type FROM information_schema.columns
+                        WHERE table_schema = DATABASE() AND table_name = 'tickets' AND column_name = 'id'
+                        """)
+                        if (await cur.fetchone())[0].lower() != "bigint":
+                            logger.warning("tickets.id still holds uuids; run `python -m db.migrate_ids` to convert it")
+                    await conn.commit()
+                pool = new_pool
+    return pool
+
+async def mysql_init():
+    await _get_pool()
+
+async def mysql_schema_version():
+    async with _cursor(aiomysql.Cursor) as cur:
+        return max(await _applied_versions(cur), default=0)
+
+@asynccontextmanager
+async def _cursor(cursor_class=aiomysql.DictCursor):
+    """Check a connection out of the pool and yield a dictionary cursor.
+
+    The connection is pinged before use and transparently reconnected if the
+    server dropped it. The block is committed when it finishes; reads are
+    committed too so the connection does not keep a stale REPEATABLE READ
+    snapshot when it goes back to the pool.
+    """
+    db_pool = await _get_pool()
+    _stats["waiting"] += 1
+    _stats["max_waiting"] = max(_stats["max_waiting"], _stats["waiting"])
+    started = time.perf_counter()
+    try:
+        conn = await db_pool.acquire()
+    finally:
+        _stats["waiting"] -= 1
+    _stats["wait_seconds_total"] += time.perf_counter() - started
+    _stats["checkouts"] += 1
+    try:
+        try:
+            await conn.ping(reconnect=False)
+        except Exception:
+            _stats["reconnects"] += 1
+            logger.info("MySQL connection went stale, reconnecting")
+            await _with_backoff("MySQL reconnect", lambda: conn.ping(reconnect=True))
+        async with conn.cursor(cursor_class) as cur:
+            try:
+                yield cur
+            except Exception:
+                await conn.rollback()
+                raise
+            await conn.commit()
+    finally:
+        db_pool.release(conn)
+
+def mysql_pool_stats():
+    """Pool saturation snapshot: in_use == maxsize with waiting > 0 means queries are queuing."""
+    if pool is None:
+        return None
+    return {
+        "size": pool.size,
+        "free": pool.freesize,
+        "in_use": pool.size - pool.freesize,
+        "minsize": pool.minsize,
+        "maxsize": pool.maxsize,
+        **_stats,
+    }
+
+metrics.mysql_pool.register(mysql_pool_stats)
+
+async def mysql_create_ticket(guild_id, channel_id, creator_id):
+    ticket_id = new_ticket_id()
     created_at = datetime.now(tz=timezone.utc)
-    cursor.execute("""
-    INSERT INTO tickets (id, guild_id, channel_id, creator_id, status, created_at, claimed_by)
-    VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """, (ticket_id, guild_id, channel_id, creator_id, "open", created_at, None))
-    connection.commit()
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        INSERT INTO tickets (id, guild_id, channel_id, creator_id, status, created_at, claimed_by, last_activity_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (ticket_id, guild_id, channel_id, creator_id, "open", created_at, None, created_at))
+        await _bump_daily(cursor, guild_id, day_key(created_at), opened=1)
     return ticket_id
 
-def mysql_close_ticket(ticket_id):
+async def mysql_close_ticket(ticket_id):
+    return await mysql_close_tickets([ticket_id])
+
+async def mysql_close_tickets(ticket_ids):
+    """Close several tickets in one transaction; returns how many were still open."""
     closed_at = datetime.now(tz=timezone.utc)
-    cursor.execute("""
-    UPDATE tickets
-    SET status = %s, closed_at = %s
-    WHERE id = %s
-    """, ("closed", closed_at, ticket_id))
-    connection.commit()
-    return cursor.rowcount
-
-def mysql_get_ticket(ticket_id):
-    cursor.execute("""
-    SELECT * FROM tickets
-    WHERE id = %s
-    """, (ticket_id,))
-    row = cursor.fetchone()
-    # With dictionary=True cursor, row is already a dict
+    placeholders = ",".join(["%s"] * len(ticket_ids))
+    async with _cursor() as cursor:
+        # Lock the still-open rows so only the open -> closed transition counts towards the rollups
+        await cursor.execute(f"""
+        SELECT id, guild_id, created_at FROM tickets
+        WHERE id IN ({placeholders}) AND status <> %s
+        FOR UPDATE
+        """, (*ticket_ids, "closed"))
+        rows = await cursor.fetchall()
+        if not rows:
+            return 0
+        await cursor.execute(f"""
+        UPDATE tickets
+        SET status = %s, closed_at = %s
+        WHERE id IN ({",".join(["%s"] * len(rows))})
+        """, ("closed", closed_at, *(row["id"] for row in rows)))
+        for row in rows:
+            await _bump_daily(cursor, row["guild_id"], day_key(closed_at), closed=1)
+            await _bump_duration(cursor, row["guild_id"], METRIC_CLOSE, bucket_for(row["created_at"], closed_at))
+    return len(rows)
+
+async def mysql_get_ticket(ticket_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT * FROM tickets
+        WHERE id = %s
+        """, (ticket_id,))
+        row = await cursor.fetchone()
+    # With DictCursor, row is already a dict
     return row if row else None
 
-def mysql_update_ticket_status(ticket_id, status):
-    cursor.execute("""
-    UPDATE tickets
-    SET status = %s
-    WHERE id = %s
-    """, (status, ticket_id))
-    connection.commit()
-    return cursor.rowcount
-
-def mysql_update_ticket_channel(ticket_id, channel_id):
-    cursor.execute("""
-    UPDATE tickets
-    SET channel_id = %s
-    WHERE id = %s
-    """, (channel_id, ticket_id))
-    connection.commit()
-    return cursor.rowcount
-
-def mysql_claim_ticket(ticket_id, staff_user_id):
-    cursor.execute("""
-    UPDATE tickets
-    SET claimed_by = %s
-    WHERE id = %s AND claimed_by IS NULL
-    """, (staff_user_id, ticket_id))
-    connection.commit()
-    rc = cursor.rowcount
-    if rc == 0:
-        cursor.execute("SELECT claimed_by FROM tickets WHERE id = %s", (ticket_id,))
-        row = cursor.fetchone()
-        logger.debug("mysql_claim_ticket no-op ticket_id=%s existing_claimed_by=%s", ticket_id, row[0] if row else None)
-    return rc
-
-def mysql_unclaim_ticket(ticket_id, staff_user_id):
-    cursor.execute("""
-    UPDATE tickets
-    SET claimed_by = NULL
-    WHERE id = %s AND claimed_by = %s
-    """, (ticket_id, staff_user_id))
-    connection.commit()
-    rc = cursor.rowcount
-    if rc == 0:
-        cursor.execute("SELECT claimed_by FROM tickets WHERE id = %s", (ticket_id,))
-        row = cursor.fetchone()
-        logger.debug("mysql_unclaim_ticket no-op ticket_id=%s existing_claimed_by=%s", ticket_id, row[0] if row else None)
-    return rc
-
-def mysql_get_ticket_id(channel_id):
-    cursor.execute("""
-    SELECT id FROM tickets
-    WHERE channel_id = %s
-    """, (channel_id,))
-    row = cursor.fetchone()
+async def mysql_update_ticket_status(ticket_id, status):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        UPDATE tickets
+        SET status = %s
+        WHERE id = %s
+        """, (status, ticket_id))
+        return cursor.rowcount
+
+async def mysql_update_ticket_channel(ticket_id, channel_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        UPDATE tickets
+        SET channel_id = %s
+        WHERE id = %s
+        """, (channel_id, ticket_id))
+        return cursor.rowcount
+
+async def mysql_claim_ticket(ticket_id, staff_user_id):
+    """Claim in one statement; returns (outcome, claimed_by).
+
+    LAST_INSERT_ID(expr) makes the server send the resulting claimer back in
+    the OK packet (cursor.lastrowid), so MySQL needs no follow-up SELECT.
+    rowcount is 1 only when the ticket was unclaimed before this statement;
+    only then are the rollups read and bumped, in the same transaction.
+    claimed_at keeps the first claim, which is what time-to-claim measures.
+    """
+    # DATETIME has no fractional seconds; truncate so first_claim compares equal
+    claimed_at = datetime.now(tz=timezone.utc).replace(microsecond=0)
+    async with _cursor() as cursor:
+        # MySQL assigns left to right, so claimed_at must see the old claimed_by
+        await cursor.execute("""
+        UPDATE tickets
+        SET claimed_at = IF(claimed_by IS NULL, COALESCE(claimed_at, %s), claimed_at),
+            claimed_by = LAST_INSERT_ID(COALESCE(claimed_by, %s))
+        WHERE id = %s
+        """, (claimed_at, staff_user_id, ticket_id))
+        rc = cursor.rowcount
+        claimed_by = cursor.lastrowid
+        if rc == 1:
+            await cursor.execute("""
+            SELECT guild_id, created_at, claimed_at = %s AS first_claim FROM tickets WHERE id = %s
+            """, (claimed_at, ticket_id))
+            row = await cursor.fetchone()
+            await _bump_staff(cursor, row["guild_id"], staff_user_id)
+            if row["first_claim"]:
+                await _bump_duration(cursor, row["guild_id"], METRIC_CLAIM, bucket_for(row["created_at"], claimed_at))
+    if rc == 1:
+        return "success", staff_user_id
+    if not claimed_by:
+        return "not_found", None
+    if claimed_by == int(staff_user_id):
+        return "already_yours", claimed_by
+    return "already_claimed", claimed_by
+
+async def mysql_unclaim_ticket(ticket_id, staff_user_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        UPDATE tickets
+        SET claimed_by = NULL
+        WHERE id = %s AND claimed_by = %s
+        """, (ticket_id, staff_user_id))
+        return cursor.rowcount
+
+async def mysql_get_ticket_id(channel_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT id FROM tickets
+        WHERE channel_id = %s
+        """, (channel_id,))
+        row = await cursor.fetchone()
     if not row:
         return None
-    # row is dict because dictionary=True
     return row.get("id")
 
-def mysql_delete_ticket(ticket_id):
-    cursor.execute("""
-    DELETE FROM tickets
-    WHERE id = %s
-    """, (ticket_id,))
-    connection.commit()
-    return cursor.rowcount
-
-def mysql_ticket_channel_exists(channel_id):
-    cursor.execute("""
-    SELECT 1 FROM tickets
-    WHERE channel_id = %s
-    """, (channel_id,))
-    return cursor.fetchone() is not None
-
-def mysql_get_ticket_by_channel(channel_id):
-    cursor.execute("""
-    SELECT * FROM tickets
-    WHERE channel_id = %s
-    """, (channel_id,))
-    return cursor.fetchone()
-
-def mysql_close():
-    try:
-        cursor.close()
-    except Exception:
-        pass
+async def mysql_delete_ticket(ticket_id):
+    return await mysql_delete_tickets([ticket_id])
+
+async def mysql_delete_tickets(ticket_ids):
+    placeholders = ",".join(["%s"] * len(ticket_ids))
+    async with _cursor() as cursor:
+        # A row without a channel was never provisioned: take back its "opened"
+        await cursor.execute(f"""
+        SELECT guild_id, created_at FROM tickets
+        WHERE id IN ({placeholders}) AND channel_id IS NULL
+        FOR UPDATE
+        """, ticket_ids)
+        unprovisioned = await cursor.fetchall()
+        await cursor.execute(f"DELETE FROM tickets WHERE id IN ({placeholders})", ticket_ids)
+        deleted = cursor.rowcount
+        for row in unprovisioned:
+            await _bump_daily(cursor, row["guild_id"], day_key(row["created_at"]), opened=-1)
+        await cursor.execute(f"DELETE FROM ticket_participants WHERE ticket_id IN ({placeholders})", ticket_ids)
+        return deleted
+
+async def mysql_ticket_channel_exists(channel_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT 1 FROM tickets
+        WHERE channel_id = %s
+        """, (channel_id,))
+        return await cursor.fetchone() is not None
+
+async def mysql_get_ticket_by_channel(channel_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT * FROM tickets
+        WHERE channel_id = %s
+        """, (channel_id,))
+        return await cursor.fetchone()
+
+async def mysql_get_guild_tickets(guild_id):
+    """id, channel_id, status and created_at of every live ticket in a guild, in one query."""
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT id, channel_id, status, created_at FROM tickets
+        WHERE guild_id = %s
+        """, (guild_id,))
+        return await cursor.fetchall()
+
+async def mysql_count_open_tickets(guild_id, creator_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT COUNT(*) AS open_count FROM tickets
+        WHERE creator_id = %s AND status = 'open' AND guild_id = %s
+        """, (creator_id, guild_id))
+        row = await cursor.fetchone()
+    return row["open_count"]
+
+async def mysql_touch_tickets(activity):
+    """Record the latest activity for many tickets; ``activity`` is [(ticket_id, at), ...]."""
+    async with _cursor() as cursor:
+        await cursor.executemany("""
+        UPDATE tickets
+        SET last_activity_at = %s
+        WHERE id = %s AND (last_activity_at IS NULL OR last_activity_at < %s)
+        """, [(at, ticket_id, at) for ticket_id, at in activity])
+
+async def mysql_get_stale_tickets(inactive_since, limit, guild_ids=None):
+    if guild_ids is not None and not guild_ids:
+        return []
+    in_guilds = f"AND guild_id IN ({', '.join(['%s'] * len(guild_ids))})" if guild_ids else ""
+    async with _cursor() as cursor:
+        await cursor.execute(f"""
+        SELECT * FROM tickets
+        WHERE status = 'open' AND last_activity_at < %s {in_guilds}
+        ORDER BY last_activity_at
+        LIMIT %s
+        """, (inactive_since, *(guild_ids or ()), limit))
+        return await cursor.fetchall()
+
+async def mysql_add_users_to_ticket(ticket_id, user_ids):
+    added_at = datetime.now(tz=timezone.utc)
+    async with _cursor() as cursor:
+        await cursor.executemany("""
+        INSERT IGNORE INTO ticket_participants (ticket_id, user_id, added_at)
+        VALUES (%s, %s, %s)
+        """, [(ticket_id, user_id, added_at) for user_id in user_ids])
+
+async def mysql_remove_users_from_ticket(ticket_id, user_ids):
+    async with _cursor() as cursor:
+        await cursor.executemany("""
+        DELETE FROM ticket_participants
+        WHERE ticket_id = %s AND user_id = %s
+        """, [(ticket_id, user_id) for user_id in user_ids])
+
+async def mysql_get_closed_tickets(guild_id, closed_before, limit, after_id=None):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT * FROM tickets
+        WHERE guild_id = %s AND status = 'closed' AND closed_at < %s AND id > %s
+        ORDER BY id
+        LIMIT %s
+        """, (guild_id, closed_before, after_id or 0, limit))
+        return await cursor.fetchall()
+
+async def mysql_archive_tickets(ticket_ids):
+    """Move tickets into tickets_archive in one transaction; safe to repeat."""
+    archived_at = datetime.now(tz=timezone.utc)
+    placeholders = ",".join(["%s"] * len(ticket_ids))
+    async with _cursor() as cursor:
+        await cursor.execute(f"""
+        INSERT IGNORE INTO tickets_archive (id, guild_id, channel_id, creator_id, status, created_at, closed_at, claimed_by, claimed_at, archived_at)
+        SELECT id, guild_id, channel_id, creator_id, status, created_at, closed_at, claimed_by, claimed_at, %s
+        FROM tickets WHERE id IN ({placeholders})
+        """, (archived_at, *ticket_ids))
+        await cursor.execute(f"DELETE FROM ticket_participants WHERE ticket_id IN ({placeholders})", ticket_ids)
+        await cursor.execute(f"DELETE FROM tickets WHERE id IN ({placeholders})", ticket_ids)
+        return cursor.rowcount
+
+async def mysql_index_messages(messages):
+    async with _cursor() as cursor:
+        await cursor.executemany("""
+        INSERT IGNORE INTO ticket_messages (message_id, ticket_id, guild_id, channel_id, author_id, created_at, content)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, [
+            (m["message_id"], m["ticket_id"], m["guild_id"], m["channel_id"], m["author_id"], m["created_at"], m["content"])
+            for m in messages
+        ])
+
+async def mysql_search_messages(guild_id, text, limit=10, cursor=None):
+    """FULLTEXT relevance search; returns (results, next_cursor), keyset-paginated on (score, id)."""
+    params = [text, guild_id, text]
+    keyset = ""
+    if cursor:
+        score, row_id = cursor.split(":")
+        keyset = "WHERE score < %s OR (score = %s AND id > %s)"
+        params += [float(score), float(score), int(row_id)]
+    params.append(limit)
+    async with _cursor() as cur:
+        await cur.execute(f"""
+        SELECT * FROM (
+            SELECT id, ticket_id, channel_id, message_id, author_id, created_at, content,
+                   MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+            FROM ticket_messages
+            WHERE guild_id = %s AND MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE)
+        ) matches
+        {keyset}
+        ORDER BY score DESC, id
+        LIMIT %s
+        """, params)
+        rows = await cur.fetchall()
+    for row in rows:
+        row["snippet"] = row.pop("content")[:200]
+    next_cursor = f"{rows[-1]['score']!r}:{rows[-1]['id']}" if len(rows) == limit else None
+    return rows, next_cursor
+
+async def mysql_record_events(events):
+    async with _cursor() as cursor:
+        await cursor.executemany("""
+        INSERT INTO ticket_events (ticket_id, guild_id, event, actor_id, data, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        """, [
+            (e["ticket_id"], e["guild_id"], e["event"], e["actor_id"], json.dumps(e["data"]) if e["data"] else None, e["created_at"])
+            for e in events
+        ])
+
+async def _bump_daily(cursor, guild_id, day, opened=0, closed=0):
+    await cursor.execute("""
+    INSERT INTO stats_daily (guild_id, day, opened, closed) VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE opened = opened + VALUES(opened), closed = closed + VALUES(closed)
+    """, (guild_id, day, opened, closed))
+
+async def _bump_staff(cursor, guild_id, staff_id):
+    await cursor.execute("""
+    INSERT INTO stats_staff (guild_id, staff_id, claims) VALUES (%s, %s, 1)
+    ON DUPLICATE KEY UPDATE claims = claims + 1
+    """, (guild_id, staff_id))
+
+async def _bump_duration(cursor, guild_id, metric, bucket):
+    await cursor.execute("""
+    INSERT INTO stats_durations (guild_id, metric, bucket, count) VALUES (%s, %s, %s, 1)
+    ON DUPLICATE KEY UPDATE count = count + 1
+    """, (guild_id, metric, bucket))
+
+async def mysql_get_stats(guild_id, since_day, staff_limit=10):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        SELECT day, opened, closed FROM stats_daily
+        WHERE guild_id = %s AND day >= %s
+        ORDER BY day
+        """, (guild_id, since_day))
+        daily = [(row["day"], row["opened"], row["closed"]) for row in await cursor.fetchall()]
+        await cursor.execute("""
+        SELECT staff_id, claims FROM stats_staff
+        WHERE guild_id = %s
+        ORDER BY claims DESC
+        LIMIT %s
+        """, (guild_id, staff_limit))
+        staff = [(row["staff_id"], row["claims"]) for row in await cursor.fetchall()]
+        await cursor.execute("SELECT metric, bucket, count FROM stats_durations WHERE guild_id = %s", (guild_id,))
+        durations = {METRIC_CLAIM: {}, METRIC_CLOSE: {}}
+        for row in await cursor.fetchall():
+            durations.setdefault(row["metric"], {})[row["bucket"]] = row["count"]
+    return {"daily": daily, "staff": staff, "durations": durations}
+
+async def mysql_iter_tickets(guild_id):
+    """Stream every ticket of a guild, live and archived, through a server-side cursor."""
+    for table in ("tickets", "tickets_archive"):
+        async with _cursor(aiomysql.SSDictCursor) as cursor:
+            await cursor.execute(f"SELECT * FROM {table} WHERE guild_id = %s", (guild_id,))
+            while True:
+                rows = await cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+async def mysql_replace_stats(guild_id, acc):
+    """Swap a guild's rollups for the ones in ``acc`` (a StatsAccumulator) in one transaction."""
+    async with _cursor() as cursor:
+        for table in ("stats_daily", "stats_staff", "stats_durations"):
+            await cursor.execute(f"DELETE FROM {table} WHERE guild_id = %s", (guild_id,))
+        if acc.daily:
+            await cursor.executemany(
+                "INSERT INTO stats_daily (guild_id, day, opened, closed) VALUES (%s, %s, %s, %s)",
+                [(guild_id, day, opened, closed) for day, (opened, closed) in acc.daily.items()],
+            )
+        if acc.staff:
+            await cursor.executemany(
+                "INSERT INTO stats_staff (guild_id, staff_id, claims) VALUES (%s, %s, %s)",
+                [(guild_id, staff_id, claims) for staff_id, claims in acc.staff.items()],
+            )
+        rows = [(guild_id, metric, bucket, count) for metric, buckets in acc.durations.items() for bucket, count in buckets.items()]
+        if rows:
+            await cursor.executemany(
+                "INSERT INTO stats_durations (guild_id, metric, bucket, count) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+
+async def mysql_get_guild_config(guild_id):
+    async with _cursor() as cursor:
+        await cursor.execute("SELECT * FROM guild_config WHERE guild_id = %s", (guild_id,))
+        return await cursor.fetchone()
+
+async def mysql_set_guild_config(guild_id, support_role_id):
+    async with _cursor() as cursor:
+        await cursor.execute("""
+        INSERT INTO guild_config (guild_id, support_role_id, updated_at) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE support_role_id = VALUES(support_role_id), updated_at = VALUES(updated_at)
+        """, (guild_id, support_role_id, datetime.now(tz=timezone.utc)))
+
+# Primary keys db.transfer pages on; ticket_messages and ticket_events use their id
+_TRANSFER_KEYS = {
+    "guild_config": ("guild_id",),
+    "ticket_participants": ("ticket_id", "user_id"),
+    "stats_daily": ("guild_id", "day"),
+    "stats_staff": ("guild_id", "staff_id"),
+    "stats_durations": ("guild_id", "metric", "bucket"),
+}
+
+async def mysql_export_rows(table, columns, after=None, batch_size=1000):
+    """Stream ``columns`` of ``table`` through a server-side cursor; yields (rows, cursor) batches."""
+    key = _TRANSFER_KEYS.get(table, ("id",))
+    where = f"WHERE ({', '.join(key)}) > ({', '.join(['%s'] * len(key))})" if after else ""
+    async with _cursor(aiomysql.SSCursor) as cursor:
+        await cursor.execute(f"""
+        SELECT {', '.join(key)}, {', '.join(columns)} FROM {table} {where} ORDER BY {', '.join(key)}
+        """, after or ())
+        while rows := await cursor.fetchmany(batch_size):
+            yield [dict(zip(columns, row[len(key):])) for row in rows], list(rows[-1][:len(key)])
+
+async def mysql_import_rows(table, columns, rows):
+    """Insert rows exported by another backend; rows that already exist are skipped."""
+    if table == "ticket_messages":
+        return await mysql_index_messages(rows)
+    async with _cursor() as cursor:
+        await cursor.executemany(
+            f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+            [
+                [json.dumps(row[c]) if c == "data" and row[c] is not None else row[c] for c in columns]
+                for row in rows
+            ],
+        )
+
+async def mysql_close():
+    global pool
+    if pool is None:
+        return
     try:
-        connection.close()
+        pool.close()
+        await pool.wait_closed()
     except Exception:
         pass
+    pool = None
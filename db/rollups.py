@@ -0,0 +1,92 @@
+"""Shared helpers for the staff analytics rollups.
+
+Every backend keeps three small aggregates next to ``tickets``, updated in the
+same write as the ticket change that affects them:
+
+- daily opened/closed counts per guild
+- claim counts per guild and staff member
+- duration histograms per guild for time-to-claim and time-to-close
+
+Medians are estimated from the histograms, so reading stats never scans
+``tickets``.
+"""
+import bisect
+from datetime import datetime, timezone
+
+# Upper bounds (seconds) of the duration buckets; the last bucket is open-ended
+DURATION_BUCKETS = (
+    60, 300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 12 * 3600,
+    86400, 2 * 86400, 4 * 86400, 7 * 86400, 14 * 86400, 30 * 86400,
+)
+
+METRIC_CLAIM = "claim"
+METRIC_CLOSE = "close"
+
+
+def as_utc(value):
+    """Normalize a stored timestamp (datetime, naive datetime or ISO string) to aware UTC."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def day_key(value):
+    return as_utc(value).strftime("%Y-%m-%d")
+
+
+def bucket_for(start, end):
+    seconds = (as_utc(end) - as_utc(start)).total_seconds()
+    return bisect.bisect_left(DURATION_BUCKETS, max(seconds, 0))
+
+
+def histogram_median(counts):
+    """Estimate the median in seconds from {bucket: count}, interpolating inside the bucket."""
+    total = sum(counts.values())
+    if not total:
+        return None
+    half = total / 2
+    seen = 0
+    for bucket in sorted(counts):
+        count = counts[bucket]
+        if seen + count >= half:
+            lower = DURATION_BUCKETS[bucket - 1] if bucket > 0 else 0
+            upper = DURATION_BUCKETS[bucket] if bucket < len(DURATION_BUCKETS) else lower * 2
+            return lower + (upper - lower) * (half - seen) / count
+        seen += count
+    return None
+
+
+class StatsAccumulator:
+    """Rollups recomputed from raw tickets, one ticket at a time.
+
+    Memory depends on the number of days, staff members and buckets, never
+    on the number of tickets. Per-staff counts only see each ticket's current
+    claimer, so claims that were later released are not counted.
+    """
+
+    def __init__(self):
+        self.daily = {}  # day -> [opened, closed]
+        self.staff = {}  # staff_id -> claims
+        self.durations = {METRIC_CLAIM: {}, METRIC_CLOSE: {}}  # metric -> {bucket: count}
+        self.tickets = 0
+
+    def _bump_duration(self, metric, start, end):
+        bucket = bucket_for(start, end)
+        self.durations[metric][bucket] = self.durations[metric].get(bucket, 0) + 1
+
+    def add(self, ticket):
+        self.tickets += 1
+        created_at = ticket["created_at"]
+        self.daily.setdefault(day_key(created_at), [0, 0])[0] += 1
+        if ticket.get("claimed_by"):
+            staff_id = int(ticket["claimed_by"])
+            self.staff[staff_id] = self.staff.get(staff_id, 0) + 1
+        if ticket.get("claimed_at"):
+            self._bump_duration(METRIC_CLAIM, created_at, ticket["claimed_at"])
+        if ticket.get("status") == "closed" and ticket.get("closed_at"):
+            self.daily.setdefault(day_key(ticket["closed_at"]), [0, 0])[1] += 1
+            self._bump_duration(METRIC_CLOSE, created_at, ticket["closed_at"])
@@ -1,143 +1,728 @@
-import sqlite3
-import uuid
+import aiosqlite
+import asyncio
+import functools
+import json
 import os
 from datetime import datetime, timezone
 import logging
 
-logger = logging.getLogger("keepalivebot.db.sqlite")
+from db.ids import new_ticket_id
+from db.migrations import Migration, migration_batch_size, run_migrations
+from db.rollups import METRIC_CLAIM, METRIC_CLOSE, bucket_for, day_key
 
-connection = sqlite3.connect('ticketbotdatabase.db')
-connection.execute('PRAGMA journal_mode=WAL;')
-connection.execute('PRAGMA synchronous=NORMAL;')
+logger = logging.getLogger("keepalivebot.db.sqlite")
 
-cursor = connection.cursor()
+DB_PATH = 'ticketbotdatabase.db'
 
+# Ticket ids are 64-bit snowflakes (db/ids.py) and Discord ids are snowflakes
+# too, so every id column is INTEGER; tickets.id is the rowid itself.
 create_table_command = """
 CREATE TABLE IF NOT EXISTS tickets (
-    id TEXT PRIMARY KEY,
-    guild_id TEXT NOT NULL,
-    channel_id TEXT NULL,
-    creator_id TEXT NOT NULL,
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NULL,
+    creator_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    closed_at TIMESTAMP,
+    claimed_by INTEGER,
+    last_activity_at TIMESTAMP,
+    claimed_at TIMESTAMP
+);
+"""
+
+create_participants_command = """
+CREATE TABLE IF NOT EXISTS ticket_participants (
+    ticket_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    added_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (ticket_id, user_id)
+) WITHOUT ROWID;
+"""
+
+create_archive_command = """
+CREATE TABLE IF NOT EXISTS tickets_archive (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NULL,
+    creator_id INTEGER NOT NULL,
     status TEXT NOT NULL,
     created_at TIMESTAMP NOT NULL,
     closed_at TIMESTAMP,
-    claimed_by TEXT
+    claimed_by INTEGER,
+    archived_at TIMESTAMP NOT NULL,
+    claimed_at TIMESTAMP
+);
+"""
+
+# Append-only audit trail of ticket state transitions
+create_events_command = """
+CREATE TABLE IF NOT EXISTS ticket_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    actor_id INTEGER,
+    data TEXT,
+    created_at TIMESTAMP NOT NULL
+);
+"""
+
+# Per-guild settings; guilds without a row use the environment defaults
+create_guild_config_command = """
+CREATE TABLE IF NOT EXISTS guild_config (
+    guild_id INTEGER PRIMARY KEY,
+    support_role_id INTEGER,
+    updated_at TIMESTAMP NOT NULL
+);
+"""
+
+# Analytics rollups, maintained in the same transaction as the ticket writes
+create_stats_commands = (
+    """
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        guild_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        opened INTEGER NOT NULL DEFAULT 0,
+        closed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, day)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_staff (
+        guild_id INTEGER NOT NULL,
+        staff_id INTEGER NOT NULL,
+        claims INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, staff_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_durations (
+        guild_id INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, metric, bucket)
+    );
+    """,
+)
+
+# Full-text index of messages posted in ticket channels. guild_id is indexed
+# so a search intersects the term's matches with the guild's, instead of
+# reading every matching row to filter on it.
+create_messages_fts_command = """
+CREATE VIRTUAL TABLE IF NOT EXISTS ticket_messages_fts USING fts5(
+    content,
+    ticket_id UNINDEXED,
+    guild_id,
+    channel_id UNINDEXED,
+    message_id UNINDEXED,
+    author_id UNINDEXED,
+    created_at UNINDEXED
 );
 """
-cursor.execute(create_table_command)
-cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_channel ON tickets(channel_id)")
-cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_guild_status ON tickets(guild_id, status)")
 
+connection: aiosqlite.Connection | None = None
+_connect_lock = asyncio.Lock()
+_write_lock = asyncio.Lock()
+
+
+async def _ensure_column(conn, table, column, decl):
+    # CREATE TABLE IF NOT EXISTS leaves older databases without new columns
+    async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+        existing = {row[1] for row in await cursor.fetchall()}
+    if column in existing:
+        return False
+    await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+
+async def _create_tables(conn):
+    await conn.execute(create_table_command)
+    await conn.execute(create_participants_command)
+    await conn.execute(create_messages_fts_command)
+    await conn.execute(create_archive_command)
+    for command in create_stats_commands:
+        await conn.execute(command)
+    await conn.execute(create_events_command)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_event_ticket ON ticket_events(ticket_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_channel ON tickets(channel_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_guild_status ON tickets(guild_id, status)")
+
+
+async def _backfill(conn, table, assignment, where):
+    # Batches by rowid so each write transaction stays short
+    batch_size = migration_batch_size()
+    while True:
+        cursor = await conn.execute(f"""
+        UPDATE {table} SET {assignment}
+        WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)
+        """, (batch_size,))
+        await conn.commit()
+        if cursor.rowcount < batch_size:
+            return
+        await asyncio.sleep(0)
+
+
+async def _add_last_activity(conn):
+    await _ensure_column(conn, "tickets", "last_activity_at", "TIMESTAMP")
+    await _backfill(conn, "tickets", "last_activity_at = created_at", "status = 'open' AND last_activity_at IS NULL")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_status_activity ON tickets(status, last_activity_at)")
+
+
+async def _add_claimed_at(conn):
+    await _ensure_column(conn, "tickets", "claimed_at", "TIMESTAMP")
+    await _ensure_column(conn, "tickets_archive", "claimed_at", "TIMESTAMP")
+
+
+async def _add_creator_index(conn):
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_creator_status ON tickets(creator_id, status)")
+
+
+async def _add_guild_config(conn):
+    await conn.execute(create_guild_config_command)
+
+
+async def _index_fts_guild(conn):
+    # FTS5 columns cannot be altered: copy into a table with the new schema.
+    # A run that stops partway resumes from the last copied rowid.
+    async with conn.execute("SELECT sql FROM sqlite_master WHERE name = 'ticket_messages_fts'") as cursor:
+        row = await cursor.fetchone()
+    if row is None or "guild_id UNINDEXED" in row[0]:
+        if row is not None:
+            await conn.execute("ALTER TABLE ticket_messages_fts RENAME TO ticket_messages_fts_old")
+        await conn.execute(create_messages_fts_command)
+        await conn.commit()
+    async with conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ticket_messages_fts_old'") as cursor:
+        if await cursor.fetchone() is None:
+            return
+    columns = "rowid, content, ticket_id, guild_id, channel_id, message_id, author_id, created_at"
+    batch_size = migration_batch_size()
+    while True:
+        cursor = await conn.execute(f"""
+        INSERT INTO ticket_messages_fts ({columns})
+        SELECT {columns} FROM ticket_messages_fts_old
+        WHERE rowid > COALESCE((SELECT rowid FROM ticket_messages_fts ORDER BY rowid DESC LIMIT 1), 0)
+        ORDER BY rowid LIMIT ?
+        """, (batch_size,))
+        await conn.commit()
+        if cursor.rowcount < batch_size:
+            break
+        await asyncio.sleep(0)
+    await conn.execute("DROP TABLE ticket_messages_fts_old")
+
+
+MIGRATIONS = (
+    Migration(1, "base tables", _create_tables),
+    Migration(2, "tickets.last_activity_at", _add_last_activity),
+    Migration(3, "claimed_at columns", _add_claimed_at),
+    Migration(4, "tickets (creator_id, status) index", _add_creator_index),
+    Migration(5, "guild_config table", _add_guild_config),
+    Migration(6, "index ticket_messages_fts.guild_id", _index_fts_guild),
+)
+
+
+async def _applied_versions(conn):
+    async with conn.execute("SELECT version FROM schema_migrations") as cursor:
+        return {row[0] for row in await cursor.fetchall()}
+
+
+async def _migrate(conn):
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL
+    )
+    """)
+
+    async def record(migration):
+        await conn.execute(
+            "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+            (migration.version, migration.name, datetime.now(tz=timezone.utc)),
+        )
+        await conn.commit()
+
+    await run_migrations("sqlite", MIGRATIONS, await _applied_versions(conn), record, conn)
+
+
+async def _has_legacy_ids(conn):
+    async with conn.execute("PRAGMA table_info(tickets)") as cursor:
+        types = {row[1]: row[2] for row in await cursor.fetchall()}
+    return types.get("id", "").upper() == "TEXT"
+
+
+async def _get_connection():
+    # aiosqlite runs the sqlite3 connection on its own worker thread, so queries
+    # never block the event loop. The connection is opened on first use because
+    # it needs a running loop.
+    global connection
+    if connection is None:
+        async with _connect_lock:
+            if connection is None:
+                conn = await aiosqlite.connect(DB_PATH)
+                conn.row_factory = aiosqlite.Row
+                await conn.execute('PRAGMA journal_mode=WAL;')
+                await conn.execute('PRAGMA synchronous=NORMAL;')
+                await _migrate(conn)
+                if await _has_legacy_ids(conn):
+                    logger.warning("%s still uses uuid ticket ids and TEXT id columns; run `python -m db.migrate_ids` to convert it", DB_PATH)
+                await conn.commit()
+                connection = conn
+    return connection
 
-existing_cols = [row[1] for row in cursor.execute("PRAGMA table_info(tickets);").fetchall()]
+def _serialized(fn):
+    # Every coroutine shares one connection. Without this, one writer's commit
+    # can land while another's UPDATE ... RETURNING is still being stepped
+    # ("SQL statements in progress"), or commit half of its transaction.
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        async with _write_lock:
+            return await fn(*args, **kwargs)
+    return wrapper
 
-def sqlite_create_ticket(guild_id, channel_id, creator_id):
-    ticket_id = str(uuid.uuid4())
+async def sqlite_init():
+    await _get_connection()
+
+async def sqlite_schema_version():
+    return max(await _applied_versions(await _get_connection()), default=0)
+
+@_serialized
+async def sqlite_create_ticket(guild_id, channel_id, creator_id):
+    db = await _get_connection()
+    ticket_id = new_ticket_id()
     created_at = datetime.now(tz=timezone.utc)
-    cols = ["id", "guild_id", "channel_id", "creator_id", "status", "created_at", "claimed_by"]
-    values = [ticket_id, guild_id, channel_id, creator_id, "open", created_at, None]
+    cols = ["id", "guild_id", "channel_id", "creator_id", "status", "created_at", "claimed_by", "last_activity_at"]
+    values = [ticket_id, guild_id, channel_id, creator_id, "open", created_at, None, created_at]
     placeholder = ",".join(["?"] * len(cols))
-    cursor.execute(f"INSERT INTO tickets ({','.join(cols)}) VALUES ({placeholder})", values)
-    connection.commit()
+    await db.execute(f"INSERT INTO tickets ({','.join(cols)}) VALUES ({placeholder})", values)
+    await _bump_daily(db, guild_id, day_key(created_at), opened=1)
+    await db.commit()
     return ticket_id
 
-def sqlite_close_ticket(ticket_id):
+async def sqlite_close_ticket(ticket_id):
+    return await sqlite_close_tickets([ticket_id])
+
+@_serialized
+async def sqlite_close_tickets(ticket_ids):
+    """Close several tickets in one statement; returns how many were still open."""
+    db = await _get_connection()
     closed_at = datetime.now(tz=timezone.utc)
-    cursor.execute("""
+    placeholders = ",".join(["?"] * len(ticket_ids))
+    # Only the open -> closed transition counts towards the rollups
+    async with db.execute(f"""
     UPDATE tickets
     SET status = ?, closed_at = ?
-    WHERE id = ?
-    """, ("closed", closed_at, ticket_id))
-    connection.commit()
-    return cursor.rowcount
+    WHERE id IN ({placeholders}) AND status != ?
+    RETURNING guild_id, created_at
+    """, ("closed", closed_at, *ticket_ids, "closed")) as cursor:
+        rows = await cursor.fetchall()
+    for row in rows:
+        await _bump_daily(db, row["guild_id"], day_key(closed_at), closed=1)
+        await _bump_duration(db, row["guild_id"], METRIC_CLOSE, bucket_for(row["created_at"], closed_at))
+    await db.commit()
+    return len(rows)
 
-def sqlite_get_ticket(ticket_id):
-    cursor.execute("""
+async def sqlite_get_ticket(ticket_id):
+    db = await _get_connection()
+    async with db.execute("""
     SELECT * FROM tickets
     WHERE id = ?
-    """, (ticket_id,))
-    row = cursor.fetchone()
-    if row is None:
-        return None
-    columns = [desc[0] for desc in cursor.description]
-    return dict(zip(columns, row))
+    """, (ticket_id,)) as cursor:
+        row = await cursor.fetchone()
+    return dict(row) if row else None
 
-def sqlite_update_ticket_status(ticket_id, status):
-    cursor.execute("""
+@_serialized
+async def sqlite_update_ticket_status(ticket_id, status):
+    db = await _get_connection()
+    cursor = await db.execute("""
     UPDATE tickets
     SET status = ?
     WHERE id = ?
     """, (status, ticket_id))
-    connection.commit()
+    await db.commit()
     return cursor.rowcount
 
-def sqlite_update_ticket_channel(ticket_id, channel_id):
-    cursor.execute("""
+@_serialized
+async def sqlite_update_ticket_channel(ticket_id, channel_id):
+    db = await _get_connection()
+    cursor = await db.execute("""
     UPDATE tickets
     SET channel_id = ?
     WHERE id = ?
     """, (channel_id, ticket_id))
-    connection.commit()
+    await db.commit()
     return cursor.rowcount
 
-def sqlite_claim_ticket(ticket_id, staff_user_id):
-    cursor.execute("""
+@_serialized
+async def sqlite_claim_ticket(ticket_id, staff_user_id):
+    """Claim in one statement; returns (outcome, claimed_by).
+
+    COALESCE keeps an existing claimer, and RETURNING hands back whoever holds
+    the ticket after the write, so a contested claim needs no follow-up read.
+    The WHERE clause skips a ticket the caller already holds, so a returned
+    claimer equal to ``staff_user_id`` means this call took the claim; the
+    rollups are then bumped in the same transaction. claimed_at keeps the
+    first claim, which is what time-to-claim measures. Only when no row comes
+    back is a read needed, to tell "already held by the caller" from "no such
+    ticket"; the former is reported as "already_yours".
+    """
+    db = await _get_connection()
+    claimed_at = datetime.now(tz=timezone.utc)
+    staff_user_id = int(staff_user_id)
+    # SET expressions see the row as it was, so claimed_at tests the old claimed_by
+    async with db.execute("""
     UPDATE tickets
-    SET claimed_by = ?
-    WHERE id = ? AND claimed_by IS NULL
-    """, (staff_user_id, ticket_id))
-    connection.commit()
-    rc = cursor.rowcount
-    if rc == 0:
-        # diagnose current claimed_by
-        cursor.execute("SELECT claimed_by FROM tickets WHERE id = ?", (ticket_id,))
-        row = cursor.fetchone()
-        logger.debug("sqlite_claim_ticket no-op ticket_id=%s existing_claimed_by=%s", ticket_id, row[0] if row else None)
-    return rc
-
-def sqlite_unclaim_ticket(ticket_id, staff_user_id):
-    cursor.execute("""
+    SET claimed_at = CASE WHEN claimed_by IS NULL THEN COALESCE(claimed_at, ?) ELSE claimed_at END,
+        claimed_by = COALESCE(claimed_by, ?)
+    WHERE id = ? AND claimed_by IS NOT ?
+    RETURNING claimed_by, guild_id, created_at, claimed_at = ? AS first_claim
+    """, (claimed_at, staff_user_id, ticket_id, staff_user_id, claimed_at)) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        await db.commit()
+        async with db.execute("SELECT 1 FROM tickets WHERE id = ?", (ticket_id,)) as cursor:
+            exists = await cursor.fetchone() is not None
+        return ("already_yours", staff_user_id) if exists else ("not_found", None)
+    claimed_by = int(row["claimed_by"])
+    if claimed_by == staff_user_id:
+        await _bump_staff(db, row["guild_id"], staff_user_id)
+        if row["first_claim"]:
+            await _bump_duration(db, row["guild_id"], METRIC_CLAIM, bucket_for(row["created_at"], claimed_at))
+    await db.commit()
+    if claimed_by == staff_user_id:
+        return "success", claimed_by
+    return "already_claimed", claimed_by
+
+@_serialized
+async def sqlite_unclaim_ticket(ticket_id, staff_user_id):
+    db = await _get_connection()
+    cursor = await db.execute("""
     UPDATE tickets
     SET claimed_by = NULL
     WHERE id = ? AND claimed_by = ?
     """, (ticket_id, staff_user_id))
-    connection.commit()
-    rc = cursor.rowcount
-    if rc == 0:
-        cursor.execute("SELECT claimed_by FROM tickets WHERE id = ?", (ticket_id,))
-        row = cursor.fetchone()
-        logger.debug("sqlite_unclaim_ticket no-op ticket_id=%s existing_claimed_by=%s", ticket_id, row[0] if row else None)
-    return rc
-
-def sqlite_get_ticket_id(channel_id):
-    cursor.execute("""
+    await db.commit()
+    return cursor.rowcount
+
+async def sqlite_get_ticket_id(channel_id):
+    db = await _get_connection()
+    async with db.execute("""
     SELECT id FROM tickets
     WHERE channel_id = ?
-    """, (channel_id,))
-    row = cursor.fetchone()
+    """, (channel_id,)) as cursor:
+        row = await cursor.fetchone()
     return row[0] if row else None
 
-def sqlite_delete_ticket(ticket_id):
-    cursor.execute("""
-    DELETE FROM tickets
-    WHERE id = ?
-    """, (ticket_id,))
-    connection.commit()
-    return cursor.rowcount
+async def sqlite_delete_ticket(ticket_id):
+    return await sqlite_delete_tickets([ticket_id])
+
+@_serialized
+async def sqlite_delete_tickets(ticket_ids):
+    db = await _get_connection()
+    placeholders = ",".join(["?"] * len(ticket_ids))
+    async with db.execute(f"""
+    DELETE FROM tickets WHERE id IN ({placeholders})
+    RETURNING guild_id, channel_id, created_at
+    """, ticket_ids) as cursor:
+        rows = await cursor.fetchall()
+    # A row without a channel was never provisioned: take back its "opened"
+    for row in rows:
+        if row["channel_id"] is None:
+            await _bump_daily(db, row["guild_id"], day_key(row["created_at"]), opened=-1)
+    await db.execute(f"DELETE FROM ticket_participants WHERE ticket_id IN ({placeholders})", ticket_ids)
+    await db.commit()
+    return len(rows)
 
-def sqlite_ticket_channel_exists(channel_id):
-    cursor.execute("""
+async def sqlite_ticket_channel_exists(channel_id):
+    db = await _get_connection()
+    async with db.execute("""
     SELECT 1 FROM tickets
     WHERE channel_id = ?
-    """, (channel_id,))
-    return cursor.fetchone() is not None
+    """, (channel_id,)) as cursor:
+        return await cursor.fetchone() is not None
+
+async def sqlite_get_ticket_by_channel(channel_id):
+    db = await _get_connection()
+    async with db.execute("""
+    SELECT * FROM tickets
+    WHERE channel_id = ?
+    """, (channel_id,)) as cursor:
+        row = await cursor.fetchone()
+    return dict(row) if row else None
+
+async def sqlite_get_guild_tickets(guild_id):
+    """id, channel_id, status and created_at of every live ticket in a guild, in one query."""
+    db = await _get_connection()
+    async with db.execute("""
+    SELECT id, channel_id, status, created_at FROM tickets
+    WHERE guild_id = ?
+    """, (guild_id,)) as cursor:
+        return [dict(row) for row in await cursor.fetchall()]
+
+async def sqlite_count_open_tickets(guild_id, creator_id):
+    db = await _get_connection()
+    async with db.execute("""
+    SELECT COUNT(*) FROM tickets
+    WHERE creator_id = ? AND status = 'open' AND guild_id = ?
+    """, (creator_id, guild_id)) as cursor:
+        row = await cursor.fetchone()
+    return row[0]
+
+@_serialized
+async def sqlite_touch_tickets(activity):
+    """Record the latest activity for many tickets; ``activity`` is [(ticket_id, at), ...]."""
+    db = await _get_connection()
+    await db.executemany("""
+    UPDATE tickets
+    SET last_activity_at = ?
+    WHERE id = ? AND (last_activity_at IS NULL OR last_activity_at < ?)
+    """, [(at, ticket_id, at) for ticket_id, at in activity])
+    await db.commit()
+
+async def sqlite_get_stale_tickets(inactive_since, limit, guild_ids=None):
+    if guild_ids is not None and not guild_ids:
+        return []
+    db = await _get_connection()
+    in_guilds = f"AND guild_id IN ({', '.join('?' * len(guild_ids))})" if guild_ids else ""
+    async with db.execute(f"""
+    SELECT * FROM tickets
+    WHERE status = 'open' AND last_activity_at < ? {in_guilds}
+    ORDER BY last_activity_at
+    LIMIT ?
+    """, (inactive_since, *(guild_ids or ()), limit)) as cursor:
+        return [dict(row) for row in await cursor.fetchall()]
+
+@_serialized
+async def sqlite_add_users_to_ticket(ticket_id, user_ids):
+    db = await _get_connection()
+    added_at = datetime.now(tz=timezone.utc)
+    await db.executemany("""
+    INSERT OR IGNORE INTO ticket_participants (ticket_id, user_id, added_at)
+    VALUES (?, ?, ?)
+    """, [(ticket_id, user_id, added_at) for user_id in user_ids])
+    await db.commit()
 
-def sqlite_close():
+@_serialized
+async def sqlite_remove_users_from_ticket(ticket_id, user_ids):
+    db = await _get_connection()
+    await db.executemany("""
+    DELETE FROM ticket_participants
+    WHERE ticket_id = ? AND user_id = ?
+    """, [(ticket_id, user_id) for user_id in user_ids])
+    await db.commit()
+
+async def sqlite_get_closed_tickets(guild_id, closed_before, limit, after_id=None):
+    db = await _get_connection()
+    async with db.execute("""
+    SELECT * FROM tickets
+    WHERE guild_id = ? AND status = 'closed' AND closed_at < ? AND id > ?
+    ORDER BY id
+    LIMIT ?
+    """, (guild_id, closed_before, after_id or 0, limit)) as cursor:
+        return [dict(row) for row in await cursor.fetchall()]
+
+@_serialized
+async def sqlite_archive_tickets(ticket_ids):
+    """Move tickets into tickets_archive in one transaction; safe to repeat."""
+    db = await _get_connection()
+    archived_at = datetime.now(tz=timezone.utc)
+    placeholders = ",".join(["?"] * len(ticket_ids))
     try:
-        cursor.close()
+        await db.execute(f"""
+        INSERT OR IGNORE INTO tickets_archive (id, guild_id, channel_id, creator_id, status, created_at, closed_at, claimed_by, claimed_at, archived_at)
+        SELECT id, guild_id, channel_id, creator_id, status, created_at, closed_at, claimed_by, claimed_at, ?
+        FROM tickets WHERE id IN ({placeholders})
+        """, (archived_at, *ticket_ids))
+        await db.execute(f"DELETE FROM ticket_participants WHERE ticket_id IN ({placeholders})", ticket_ids)
+        cursor = await db.execute(f"DELETE FROM tickets WHERE id IN ({placeholders})", ticket_ids)
+        await db.commit()
     except Exception:
-        pass
+        await db.rollback()
+        raise
+    return cursor.rowcount
+
+@_serialized
+async def sqlite_index_messages(messages):
+    db = await _get_connection()
+    # The message id is the rowid, so a retried batch or a resumed
+    # db.transfer replaces its rows instead of indexing them twice
+    await db.executemany("""
+    INSERT OR REPLACE INTO ticket_messages_fts (rowid, content, ticket_id, guild_id, channel_id, message_id, author_id, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (m["message_id"], m["content"], m["ticket_id"], m["guild_id"], m["channel_id"], m["message_id"], m["author_id"], m["created_at"])
+        for m in messages
+    ])
+    await db.commit()
+
+def _fts_query(text, guild_id):
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    terms = " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+    return f'content : ({terms}) AND guild_id : "{int(guild_id)}"'
+
+async def sqlite_search_messages(guild_id, text, limit=10, cursor=None):
+    """Ranked (bm25) search; returns (results, next_cursor).
+
+    Pages are keyset-paginated on (score, rowid); ``cursor`` is the opaque
+    string returned with the previous page.
+    """
+    db = await _get_connection()
+    params = [_fts_query(text, guild_id)]
+    keyset = ""
+    if cursor:
+        score, rowid = cursor.split(":")
+        keyset = "WHERE score > ? OR (score = ? AND rid > ?)"
+        params += [float(score), float(score), int(rowid)]
+    params.append(limit)
+    async with db.execute(f"""
+    SELECT * FROM (
+        SELECT rowid AS rid, ticket_id, channel_id, message_id, author_id, created_at,
+               snippet(ticket_messages_fts, 0, '**', '**', '…', 16) AS snippet,
+               bm25(ticket_messages_fts, 1.0, 0.0, 0.0) AS score
+        FROM ticket_messages_fts
+        WHERE ticket_messages_fts MATCH ?
+    )
+    {keyset}
+    ORDER BY score, rid
+    LIMIT ?
+    """, params) as cur:
+        rows = [dict(row) for row in await cur.fetchall()]
+    next_cursor = f"{rows[-1]['score']!r}:{rows[-1]['rid']}" if len(rows) == limit else None
+    return rows, next_cursor
+
+@_serialized
+async def sqlite_record_events(events):
+    db = await _get_connection()
+    await db.executemany("""
+    INSERT INTO ticket_events (ticket_id, guild_id, event, actor_id, data, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (e["ticket_id"], e["guild_id"], e["event"], e["actor_id"], json.dumps(e["data"]) if e["data"] else None, e["created_at"])
+        for e in events
+    ])
+    await db.commit()
+
+async def _bump_daily(db, guild_id, day, opened=0, closed=0):
+    await db.execute("""
+    INSERT INTO stats_daily (guild_id, day, opened, closed) VALUES (?, ?, ?, ?)
+    ON CONFLICT (guild_id, day) DO UPDATE SET opened = opened + excluded.opened, closed = closed + excluded.closed
+    """, (guild_id, day, opened, closed))
+
+async def _bump_staff(db, guild_id, staff_id):
+    await db.execute("""
+    INSERT INTO stats_staff (guild_id, staff_id, claims) VALUES (?, ?, 1)
+    ON CONFLICT (guild_id, staff_id) DO UPDATE SET claims = claims + 1
+    """, (guild_id, staff_id))
+
+async def _bump_duration(db, guild_id, metric, bucket):
+    await db.execute("""
+    INSERT INTO stats_durations (guild_id, metric, bucket, count) VALUES (?, ?, ?, 1)
+    ON CONFLICT (guild_id, metric, bucket) DO UPDATE SET count = count + 1
+    """, (guild_id, metric, bucket))
+
+async def sqlite_get_stats(guild_id, since_day, staff_limit=10):
+    db = await _get_connection()
+    async with db.execute("""
+    SELECT day, opened, closed FROM stats_daily
+    WHERE guild_id = ? AND day >= ?
+    ORDER BY day
+    """, (guild_id, since_day)) as cursor:
+        daily = [tuple(row) for row in await cursor.fetchall()]
+    async with db.execute("""
+    SELECT staff_id, claims FROM stats_staff
+    WHERE guild_id = ?
+    ORDER BY claims DESC
+    LIMIT ?
+    """, (guild_id, staff_limit)) as cursor:
+        staff = [(int(row[0]), row[1]) for row in await cursor.fetchall()]
+    durations = {METRIC_CLAIM: {}, METRIC_CLOSE: {}}
+    async with db.execute("SELECT metric, bucket, count FROM stats_durations WHERE guild_id = ?", (guild_id,)) as cursor:
+        for metric, bucket, count in await cursor.fetchall():
+            durations.setdefault(metric, {})[bucket] = count
+    return {"daily": daily, "staff": staff, "durations": durations}
+
+async def sqlite_iter_tickets(guild_id):
+    """Stream every ticket of a guild, live and archived, without loading them all."""
+    db = await _get_connection()
+    for table in ("tickets", "tickets_archive"):
+        async with db.execute(f"SELECT * FROM {table} WHERE guild_id = ?", (guild_id,)) as cursor:
+            async for row in cursor:
+                yield dict(row)
+
+@_serialized
+async def sqlite_replace_stats(guild_id, acc):
+    """Swap a guild's rollups for the ones in ``acc`` (a StatsAccumulator) in one transaction."""
+    db = await _get_connection()
+    try:
+        for table in ("stats_daily", "stats_staff", "stats_durations"):
+            await db.execute(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,))
+        await db.executemany(
+            "INSERT INTO stats_daily (guild_id, day, opened, closed) VALUES (?, ?, ?, ?)",
+            [(guild_id, day, opened, closed) for day, (opened, closed) in acc.daily.items()],
+        )
+        await db.executemany(
+            "INSERT INTO stats_staff (guild_id, staff_id, claims) VALUES (?, ?, ?)",
+            [(guild_id, staff_id, claims) for staff_id, claims in acc.staff.items()],
+        )
+        await db.executemany(
+            "INSERT INTO stats_durations (guild_id, metric, bucket, count) VALUES (?, ?, ?, ?)",
+            [(guild_id, metric, bucket, count) for metric, buckets in acc.durations.items() for bucket, count in buckets.items()],
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+async def sqlite_get_guild_config(guild_id):
+    db = await _get_connection()
+    async with db.execute("SELECT * FROM guild_config WHERE guild_id = ?", (guild_id,)) as cursor:
+        row = await cursor.fetchone()
+    return dict(row) if row is not None else None
+
+@_serialized
+async def sqlite_set_guild_config(guild_id, support_role_id):
+    db = await _get_connection()
+    await db.execute("""
+    INSERT INTO guild_config (guild_id, support_role_id, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT (guild_id) DO UPDATE SET support_role_id = excluded.support_role_id, updated_at = excluded.updated_at
+    """, (guild_id, support_role_id, datetime.now(tz=timezone.utc)))
+    await db.commit()
+
+async def sqlite_export_rows(table, columns, after=None, batch_size=1000):
+    """Stream ``columns`` of ``table`` in key order for db.transfer; yields (rows, cursor) batches."""
+    db = await _get_connection()
+    source = "ticket_messages_fts" if table == "ticket_messages" else table
+    # ticket_participants is WITHOUT ROWID, so it pages on its primary key
+    key = ("ticket_id", "user_id") if table == "ticket_participants" else ("rowid",)
+    where = f"WHERE ({', '.join(key)}) > ({', '.join('?' * len(key))})" if after else ""
+    async with db.execute(f"""
+    SELECT {', '.join(key)}, {', '.join(columns)} FROM {source} {where} ORDER BY {', '.join(key)}
+    """, after or ()) as cursor:
+        while rows := await cursor.fetchmany(batch_size):
+            yield [dict(zip(columns, tuple(row)[len(key):])) for row in rows], list(tuple(rows[-1])[:len(key)])
+
+async def sqlite_import_rows(table, columns, rows):
+    """Insert rows exported by another backend; rows that already exist are skipped."""
+    if table == "ticket_messages":
+        return await sqlite_index_messages(rows)
+    db = await _get_connection()
+    async with _write_lock:
+        await db.executemany(
+            f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [
+                [json.dumps(row[c]) if c == "data" and row[c] is not None else row[c] for c in columns]
+                for row in rows
+            ],
+        )
+        await db.commit()
+
+async def sqlite_close():
+    global connection
+    if connection is None:
+        return
     try:
-        connection.close()
+        await connection.close()
     except Exception:
         pass
+    connection = None
@@ -0,0 +1,216 @@
+"""Copy every ticket table from one backend to another.
+
+    python -m db.transfer --source sqlite --target mysql
+    python -m db.transfer --source sqlite --source-path old.db --target sqlite --target-path new.db
+
+Rows are streamed from the source in key order and written in batches of
+``--batch-size``. The write of one batch overlaps the read of the next.
+After each batch, the position reached is saved to a checkpoint file. A run
+that stops for any reason can then be started again with the same command,
+and it continues where it left off. Writes skip rows that already exist, so
+the batch in flight when the run stopped is never duplicated.
+
+When the copy is done, both sides are read again and compared per table: the
+row count plus an order-independent checksum of the rows. Timestamps are
+compared at the precision the less precise backend stores (MySQL keeps whole
+seconds, MongoDB milliseconds).
+
+The target must be empty unless the run resumes a checkpoint, or --force is
+given. Its schema is created by the target backend's own migrations. MySQL
+and MongoDB connection settings come from the usual environment variables.
+Convert legacy uuid ticket ids with `python -m db.migrate_ids` first.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+from db.rollups import as_utc
+
+logger = logging.getLogger("keepalivebot.db.transfer")
+
+# Rows per batch unless --batch-size / TRANSFER_BATCH_SIZE say otherwise
+DEFAULT_BATCH_SIZE = 1000
+
+# (table, columns) in copy order: tickets before the rows that point at them
+TABLES = (
+    ("tickets", ("id", "guild_id", "channel_id", "creator_id", "status", "created_at", "closed_at",
+                 "claimed_by", "last_activity_at", "claimed_at")),
+    ("tickets_archive", ("id", "guild_id", "channel_id", "creator_id", "status", "created_at", "closed_at",
+                         "claimed_by", "archived_at", "claimed_at")),
+    ("ticket_participants", ("ticket_id", "user_id", "added_at")),
+    ("ticket_messages", ("message_id", "ticket_id", "guild_id", "channel_id", "author_id", "created_at", "content")),
+    ("ticket_events", ("id", "ticket_id", "guild_id", "event", "actor_id", "data", "created_at")),
+    ("stats_daily", ("guild_id", "day", "opened", "closed")),
+    ("stats_staff", ("guild_id", "staff_id", "claims")),
+    ("stats_durations", ("guild_id", "metric", "bucket", "count")),
+    ("guild_config", ("guild_id", "support_role_id", "updated_at")),
+)
+TIMESTAMP_COLUMNS = {"created_at", "closed_at", "last_activity_at", "claimed_at", "archived_at", "added_at", "updated_at"}
+# Fractional-second digits each backend keeps
+TIMESTAMP_DIGITS = {"sqlite": 6, "mongodb": 3, "mysql": 0}
+
+
+def _normalize(table, rows, digits):
+    """Bring rows from any backend to one shape: aware UTC datetimes at ``digits`` precision, dict event data."""
+    step = 10 ** (6 - digits)
+    timestamps = TIMESTAMP_COLUMNS.intersection(rows[0]) if rows else ()
+    for row in rows:
+        for column in timestamps:
+            value = as_utc(row[column])
+            if value is not None and step > 1:
+                value = value.replace(microsecond=value.microsecond - value.microsecond % step)
+            row[column] = value
+        if table == "ticket_events":
+            if isinstance(row["data"], str):
+                row["data"] = json.loads(row["data"])
+            if not isinstance(row["id"], int):
+                # MongoDB ObjectIds cannot become SQL ids; the target assigns new ones
+                row["id"] = None
+    return rows
+
+
+def _digest(table, columns, row):
+    # Event ids may be reassigned by the target, so they are not compared
+    values = [row[c] for c in columns if not (table == "ticket_events" and c == "id")]
+    canonical = json.dumps(values, default=str, sort_keys=True).encode()
+    return int.from_bytes(hashlib.blake2b(canonical, digest_size=8).digest(), "big")
+
+
+async def table_summary(backend, table, columns, digits, batch_size=DEFAULT_BATCH_SIZE):
+    """(row count, checksum) of a table; the checksum is a sum of row hashes, so row order does not matter."""
+    count = checksum = 0
+    async for rows, _ in backend.export_rows(table, columns, batch_size=batch_size):
+        for row in _normalize(table, rows, digits):
+            checksum = (checksum + _digest(table, columns, row)) & 0xFFFFFFFFFFFFFFFF
+        count += len(rows)
+    return count, checksum
+
+
+class Checkpoint:
+    """Per-table progress in a JSON file, replaced atomically after every batch."""
+
+    def __init__(self, path, source, target):
+        self.path = path
+        self.state = {"source": source, "target": target, "tables": {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if (saved["source"], saved["target"]) != (source, target):
+                raise SystemExit(f"{path} belongs to a {saved['source']} -> {saved['target']} transfer")
+            self.state = saved
+
+    @property
+    def resuming(self):
+        return bool(self.state["tables"])
+
+    def table(self, name):
+        return self.state["tables"].setdefault(name, {"after": None, "rows": 0, "done": False})
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+async def copy_table(source, target, table, columns, checkpoint, digits, batch_size=DEFAULT_BATCH_SIZE):
+    progress = checkpoint.table(table)
+    if progress["done"]:
+        logger.info("%s: already copied (%d rows)", table, progress["rows"])
+        return
+    started = time.perf_counter()
+    copied = 0
+    pending = None
+
+    async def write(rows, after):
+        await target.import_rows(table, columns, rows)
+        progress["after"] = after
+        progress["rows"] += len(rows)
+        checkpoint.save()
+
+    async for rows, after in source.export_rows(table, columns, after=progress["after"], batch_size=batch_size):
+        rows = _normalize(table, rows, digits)
+        if pending is not None:
+            await pending
+        pending = asyncio.ensure_future(write(rows, after))
+        copied += len(rows)
+    if pending is not None:
+        await pending
+    progress["done"] = True
+    checkpoint.save()
+    elapsed = time.perf_counter() - started
+    logger.info("%s: copied %d rows in %.2fs (%.0f rows/s)", table, copied, elapsed, copied / elapsed if elapsed else 0)
+
+
+async def verify(source, target, digits):
+    ok = True
+    for table, columns in TABLES:
+        expected, actual = await asyncio.gather(
+            table_summary(source, table, columns, digits), table_summary(target, table, columns, digits),
+        )
+        if expected == actual:
+            logger.info("%s: %d rows, checksums match", table, expected[0])
+        else:
+            ok = False
+            logger.error("%s: source has %d rows (%016x), target %d rows (%016x)", table, *expected, *actual)
+    return ok
+
+
+async def transfer(source, target, checkpoint, batch_size=DEFAULT_BATCH_SIZE, force=False, check=True):
+    """Copy all tables from ``source`` to ``target`` (both ``Backend``s); returns False if verification fails."""
+    await source.init()
+    await target.init()
+    if not checkpoint.resuming and not force:
+        async for _ in target.export_rows("tickets", ("id",), batch_size=1):
+            raise SystemExit("The target already holds tickets; pass --force to copy into it anyway")
+    digits = min(TIMESTAMP_DIGITS[source.name], TIMESTAMP_DIGITS[target.name])
+    started = time.perf_counter()
+    for table, columns in TABLES:
+        await copy_table(source, target, table, columns, checkpoint, digits, batch_size)
+    total = sum(t["rows"] for t in checkpoint.state["tables"].values())
+    logger.info("Copied %d rows in %.2fs", total, time.perf_counter() - started)
+    return await verify(source, target, digits) if check else True
+
+
+async def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", required=True, choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--target", required=True, choices=["sqlite", "mysql", "mongodb"])
+    parser.add_argument("--source-path", help="SQLite file to read (default: the bot's database)")
+    parser.add_argument("--target-path", help="SQLite file to write (default: the bot's database)")
+    # Read here, after load_dotenv, so a TRANSFER_BATCH_SIZE in .env applies
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("TRANSFER_BATCH_SIZE", DEFAULT_BATCH_SIZE)))
+    parser.add_argument("--checkpoint", help="Progress file (default: transfer-<source>-<target>.json)")
+    parser.add_argument("--force", action="store_true", help="Copy even if the target already holds tickets")
+    parser.add_argument("--no-verify", action="store_true", help="Skip the count and checksum comparison")
+    args = parser.parse_args()
+
+    from db.db_interface import load_backend
+    source = load_backend(args.source, private=True)
+    target = load_backend(args.target, private=True)
+    if args.source_path:
+        source.module.DB_PATH = args.source_path
+    if args.target_path:
+        target.module.DB_PATH = args.target_path
+    if args.source == args.target == "sqlite" and source.module.DB_PATH == target.module.DB_PATH:
+        raise SystemExit("Source and target are the same SQLite file")
+    checkpoint = Checkpoint(args.checkpoint or f"transfer-{args.source}-{args.target}.json", args.source, args.target)
+    try:
+        ok = await transfer(source, target, checkpoint, args.batch_size, args.force, not args.no_verify)
+    finally:
+        await source.close()
+        await target.close()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    asyncio.run(main())
@@ -1,15 +1,32 @@
 import discord
-from utils.botutils import create_ticket
-import os
-
-support_role_id = int(os.getenv("SUPPORT_ROLE_ID"))
+from utils.botutils import request_ticket, MAX_OPEN_TICKETS_PER_USER
+from utils.lifecycle import lifecycle
+from utils.guildconfig import support_role_id
 
 class TicketSetupView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)  # no timeout so it stays persistent
 
+    async def interaction_check(self, interaction: discord.Interaction):
+        if lifecycle.accepting:
+            return True
+        await interaction.response.send_message("The bot is restarting, please try again in a moment.", ephemeral=True)
+        return False
+
     @discord.ui.button(label="🎫 Open Ticket", style=discord.ButtonStyle.primary, custom_id="open_ticket_btn")
     async def open_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await create_ticket(interaction.guild, interaction.user, support_role_id)
-        await interaction.response.send_message(f"Ticket created!", ephemeral=True)
-
+        # Acknowledge first; provisioning can outlast the 3 second deadline
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        role_id = await support_role_id(interaction.guild_id)
+        if role_id is None:
+            await interaction.followup.send("Tickets are not set up in this server yet.", ephemeral=True)
+            return
+        status, ticket_id = await request_ticket(interaction.guild, interaction.user, role_id)
+        if status == "limit_reached":
+            await interaction.followup.send(f"You already have {MAX_OPEN_TICKETS_PER_USER} open ticket(s). Please use your existing ticket.", ephemeral=True)
+        elif status == "busy":
+            await interaction.followup.send("We're handling a lot of tickets right now, please try again in a moment.", ephemeral=True)
+        elif status == "failed":
+            await interaction.followup.send("Ticket creation failed (support role missing or channel error).", ephemeral=True)
+        else:
+            await interaction.followup.send(f"Ticket created!", ephemeral=True)
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+from db.db_interface import db_get_closed_tickets, db_archive_tickets
+from utils import events
+from utils.events import record_event
+from utils.restscheduler import scheduler, PRIORITY_BACKGROUND
+from utils.transcripts import export_transcript
+
+logger = logging.getLogger("keepalivebot.utils.archive")
+
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 25))
+ARCHIVE_EXPORT_TRANSCRIPTS = os.getenv("ARCHIVE_EXPORT_TRANSCRIPTS", "1") == "1"
+
+
+async def _retire_channel(guild: discord.Guild, ticket):
+    channel_id = ticket.get("channel_id")
+    channel = guild.get_channel(int(channel_id)) if channel_id else None
+    if channel is None:
+        # Already deleted, possibly by an earlier interrupted run
+        return False
+    if ARCHIVE_EXPORT_TRANSCRIPTS:
+        try:
+            await export_transcript(channel, ticket)
+        except Exception as e:
+            logger.error("Transcript export for ticket %s failed: %s", ticket["id"], e)
+    try:
+        await scheduler.delete_channel(channel, PRIORITY_BACKGROUND)
+    except discord.NotFound:
+        return False
+    return True
+
+
+async def purge_closed_tickets(guild: discord.Guild, older_than_days, dry_run=False, progress=None):
+    """Archive closed tickets older than ``older_than_days`` and delete their channels.
+
+    Tickets are processed in batches of ARCHIVE_BATCH_SIZE: export the transcript,
+    delete the channel through the rate-limited scheduler, then move the rows into
+    the archive table in a single transaction. A batch's rows leave ``tickets``
+    only after its channels are gone, and the deletes and inserts are idempotent,
+    so rerunning after a crash picks up exactly where the last run stopped.
+
+    ``progress`` is an optional coroutine function that receives the running
+    stats after every batch. Returns the final stats.
+    """
+    cutoff = datetime.now(tz=timezone.utc) - timedelta(days=older_than_days)
+    stats = {"selected": 0, "channels_deleted": 0, "archived": 0, "dry_run": dry_run}
+    after_id = None
+    while True:
+        batch = await db_get_closed_tickets(guild.id, cutoff, ARCHIVE_BATCH_SIZE, after_id)
+        if not batch:
+            break
+        after_id = batch[-1]["id"]
+        stats["selected"] += len(batch)
+        if not dry_run:
+            results = await asyncio.gather(*(_retire_channel(guild, t) for t in batch), return_exceptions=True)
+            done = []
+            for ticket, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    # Row stays in tickets so the next run retries it
+                    logger.error("Could not delete channel for ticket %s: %s", ticket["id"], result)
+                    continue
+                stats["channels_deleted"] += result
+                done.append(ticket)
+            if done:
+                stats["archived"] += await db_archive_tickets([t["id"] for t in done])
+                for ticket in done:
+                    record_event(ticket, events.ARCHIVED)
+        if progress is not None:
+            await progress(stats)
+    logger.info("Purge in guild %s finished: %s", guild.id, stats)
+    return stats
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+from db.db_interface import db_touch_tickets, db_get_stale_tickets, db_close_ticket
+from utils.batching import BatchWriter
+from utils.lifecycle import lifecycle
+from utils.botutils import close_ticket
+from utils import events
+from utils.events import record_event
+from utils.restscheduler import PRIORITY_BACKGROUND
+from utils.guildconfig import support_role_id
+from utils.sharding import owned_guild_ids
+
+logger = logging.getLogger("keepalivebot.utils.autoclose")
+
+# 0 disables auto-close
+AUTO_CLOSE_AFTER_HOURS = float(os.getenv("AUTO_CLOSE_AFTER_HOURS", 0))
+AUTO_CLOSE_SWEEP_MINUTES = float(os.getenv("AUTO_CLOSE_SWEEP_MINUTES", 10))
+AUTO_CLOSE_BATCH_SIZE = int(os.getenv("AUTO_CLOSE_BATCH_SIZE", 50))
+
+# One pending timestamp per ticket: a busy channel costs one write per
+# flush interval instead of one per message.
+activity_writer = BatchWriter(
+    "ticket_activity",
+    db_touch_tickets,
+    interval=float(os.getenv("TICKET_ACTIVITY_FLUSH_INTERVAL", 30)),
+    key=lambda item: item[0],
+)
+lifecycle.on_shutdown("ticket activity", activity_writer.close)
+
+
+def record_activity(ticket, at: datetime):
+    if ticket.get("status") == "open":
+        activity_writer.add((ticket["id"], at))
+
+
+async def _resolve_creator(guild: discord.Guild, creator_id):
+    member = guild.get_member(int(creator_id))
+    if member is not None:
+        return member
+    try:
+        return await guild.fetch_member(int(creator_id))
+    except discord.NotFound:
+        # Left the server; an Object still works as an overwrite target
+        return discord.Object(id=int(creator_id), type=discord.Member)
+
+
+async def _auto_close(bot, ticket):
+    guild = bot.get_guild(int(ticket["guild_id"]))
+    channel = guild.get_channel(int(ticket["channel_id"])) if guild and ticket.get("channel_id") else None
+    if channel is None:
+        # Nothing left on Discord's side; just close the record
+        if await db_close_ticket(ticket["id"]):
+            record_event(ticket, events.CLOSED, reason="inactivity")
+        return
+    creator = await _resolve_creator(guild, ticket["creator_id"])
+    role_id = await support_role_id(guild.id)
+    await close_ticket(channel, ticket, guild, role_id, creator, PRIORITY_BACKGROUND, reason="inactivity")
+
+
+async def close_stale_tickets(bot):
+    """Close up to AUTO_CLOSE_BATCH_SIZE open tickets idle for AUTO_CLOSE_AFTER_HOURS.
+
+    Pending activity is flushed first so a ticket is never judged stale on
+    a timestamp that is still sitting in memory. Stale tickets come from the
+    (status, last_activity_at) index, least recently active first; failures
+    stay open and are retried on the next sweep. A process that runs only
+    some of the shards only looks at its own guilds. Returns the number closed.
+    """
+    await activity_writer.flush()
+    cutoff = datetime.now(tz=timezone.utc) - timedelta(hours=AUTO_CLOSE_AFTER_HOURS)
+    stale = await db_get_stale_tickets(cutoff, AUTO_CLOSE_BATCH_SIZE, owned_guild_ids(bot))
+    if not stale:
+        return 0
+    results = await asyncio.gather(*(_auto_close(bot, t) for t in stale), return_exceptions=True)
+    closed = 0
+    for ticket, result in zip(stale, results):
+        if isinstance(result, Exception):
+            logger.error("Auto-close of ticket %s failed: %s", ticket["id"], result)
+        else:
+            closed += 1
+    logger.info("Auto-closed %d of %d inactive tickets", closed, len(stale))
+    return closed
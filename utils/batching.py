@@ -0,0 +1,119 @@
+import asyncio
+import itertools
+import logging
+
+logger = logging.getLogger("keepalivebot.utils.batching")
+
+
+class BatchWriter:
+    """Buffers items in memory and hands them to ``flush`` in batches.
+
+    ``add`` never awaits, so hot paths such as ``on_message`` pay only for a
+    list append. A background task flushes every ``interval`` seconds, or as
+    soon as ``max_batch`` items are waiting. If a flush fails, its items go
+    back into the buffer for the next attempt, up to ``max_buffer`` items in
+    total. Beyond that, items are dropped and counted.
+
+    With ``key``, the buffer keeps only the latest item per key, which
+    debounces high-frequency updates such as "ticket X was active at T".
+    """
+
+    def __init__(self, name, flush, max_batch=500, interval=2.0, max_buffer=50000, key=None):
+        self.name = name
+        self._flush_fn = flush
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self._key = key
+        self._buffer = {} if key is not None else []
+        self._wakeup = None
+        self._task = None
+        self._closed = False
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def add(self, item):
+        if self._closed:
+            self.dropped += 1
+            return
+        if self._key is not None:
+            k = self._key(item)
+            if k not in self._buffer and len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer[k] = item
+        elif len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        else:
+            self._buffer.append(item)
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-flusher")
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._buffer:
+            batch = self._take_batch()
+            try:
+                await self._flush_fn(batch)
+            except Exception as e:
+                self.failures += 1
+                logger.error("%s flush of %d items failed: %s", self.name, len(batch), e)
+                self._requeue(batch)
+                return
+            self.flushed += len(batch)
+
+    def _take_batch(self):
+        if self._key is None:
+            batch = self._buffer[:self.max_batch]
+            del self._buffer[:self.max_batch]
+            return batch
+        keys = list(itertools.islice(self._buffer, self.max_batch))
+        return [self._buffer.pop(k) for k in keys]
+
+    def _requeue(self, batch):
+        room = max(self.max_buffer - len(self._buffer), 0)
+        if room < len(batch):
+            self.dropped += len(batch) - room
+        batch = batch[:room]
+        if self._key is None:
+            self._buffer[:0] = batch
+        else:
+            for item in batch:
+                # a newer item for the same key wins over the failed one
+                self._buffer.setdefault(self._key(item), item)
+
+    async def close(self):
+        """Stop the background task and flush whatever is still buffered."""
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            try:
+                await self._task
+            except Exception:
+                pass
+        await self.flush()
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failures": self.failures,
+        }
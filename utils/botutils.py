@@ -1,32 +1,55 @@
 from db.db_interface import (
     db_create_ticket,
     db_close_ticket,
-    db_get_ticket,
-    db_update_ticket_status,
     db_update_ticket_channel,
-    db_get_ticket_id,
     db_delete_ticket,
-    db_ticket_channel_exists,
+    db_count_open_tickets,
+    db_add_users_to_ticket,
+    db_remove_users_from_ticket,
     db_claim_ticket,
     db_unclaim_ticket,
 )
+from db.ids import format_ticket_id
+from utils import events
+from utils.events import record_event
 from utils.embeds import create_ticket_embed, close_ticket_embed, claim_ticket_embed
+from utils.restscheduler import scheduler, PRIORITY_INTERACTIVE
+from utils.transcripts import export_transcript, export_in_background, wait_for_export, TRANSCRIPT_ON_CLOSE, TRANSCRIPT_ON_DELETE
+from utils.workqueue import WorkQueue
+from utils.lifecycle import lifecycle, ShuttingDown, PHASE_DRAIN
+import asyncio
 import discord
 import logging
+import os
 
 logger = logging.getLogger("keepalivebot.utils.botutils")
 
+# Ticket creation runs here instead of inside the interaction handler, so a
+# slow channel creation never makes the interaction miss its ack deadline.
+provisioning_queue = WorkQueue(
+    "provisioning",
+    concurrency=int(os.getenv("TICKET_PROVISION_CONCURRENCY", 4)),
+    maxsize=int(os.getenv("TICKET_PROVISION_QUEUE_SIZE", 100)),
+)
+lifecycle.on_shutdown("provisioning queue", provisioning_queue.drain, PHASE_DRAIN)
+
+# 0 disables the limit
+MAX_OPEN_TICKETS_PER_USER = int(os.getenv("MAX_OPEN_TICKETS_PER_USER", 0))
+
+# (guild_id, user_id) -> in-flight request_ticket task
+_inflight = {}
+
 
 async def create_ticket(guild: discord.Guild, creator_user, support_role_id):
     """Create a ticket channel and DB record.
 
     Returns the ticket_id on success, or None on failure.
     """
-    ticket_id = db_create_ticket(guild.id, None, creator_user.id)
     support_role = guild.get_role(support_role_id)
     if support_role is None:
         logger.error("Support role with id %s not found; aborting ticket creation", support_role_id)
         return None
+    ticket_id = await db_create_ticket(guild.id, None, creator_user.id)
 
     overwrites = {
         guild.default_role: discord.PermissionOverwrite(read_messages=False),
@@ -35,102 +58,157 @@ async def create_ticket(guild: discord.Guild, creator_user, support_role_id):
     }
 
     try:
-        channel = await guild.create_text_channel(
-            f"ticket-{ticket_id[:8]}", overwrites=overwrites
+        channel = await scheduler.create_text_channel(
+            guild, f"ticket-{format_ticket_id(ticket_id)}", overwrites
         )
     except discord.Forbidden:
         logger.error("Failed to create ticket channel due to permissions error.")
+        await db_delete_ticket(ticket_id)
         return None
     except Exception as e:
         logger.error("Failed to create ticket channel: %s", e)
+        await db_delete_ticket(ticket_id)
         return None
 
-    db_update_ticket_channel(ticket_id, channel.id)
-    logger.info("Created ticket %s in channel %s", ticket_id, channel.id)
+    await db_update_ticket_channel(ticket_id, channel.id)
+    record_event({"id": ticket_id, "guild_id": guild.id}, events.CREATED, creator_user, channel_id=channel.id)
+    logger.info("Created ticket %s in channel %s", ticket_id, channel.id, extra={"ticket_id": ticket_id, "guild_id": guild.id})
 
     embed = create_ticket_embed(ticket_id, creator_user, channel)
     await channel.send(embed=embed)
     return ticket_id
     
-async def delete_ticket(channel):
-    if db_ticket_channel_exists(channel.id):
-        ticket_id = db_get_ticket_id(channel.id)
-        await channel.delete()
-        db_delete_ticket(ticket_id)
-        logger.info(f"Deleted ticket {ticket_id}")
-
-async def close_ticket(channel:discord.TextChannel, guild:discord.Guild, support_role_id, creator_user):
-    if db_ticket_channel_exists(channel.id):
-        ticket_id = db_get_ticket_id(channel.id)
-        db_close_ticket(ticket_id)
-        
-        support_role = guild.get_role(support_role_id)
-        
-        overwrites = {
-            guild.default_role: discord.PermissionOverwrite(read_messages=False),
-            support_role: discord.PermissionOverwrite(read_messages=True, send_messages=True),
-            creator_user: discord.PermissionOverwrite(read_messages=True, send_messages=False)
-        }
-
-        await channel.edit(overwrites=overwrites)
-
-        embed = close_ticket_embed(ticket_id, creator_user)
+async def provision_ticket(guild: discord.Guild, creator_user, support_role_id):
+    """Run create_ticket through the provisioning queue and wait for its ticket_id.
 
-        await channel.send(embed=embed)
-        logger.info(f"Closed ticket {ticket_id}")
-
-async def add_to_ticket(channel: discord.TextChannel, user: discord.User):
-    if db_ticket_channel_exists(channel.id):
-        ticket_id = db_get_ticket_id(channel.id)
-        # db_add_user_to_ticket(ticket_id, user.id)
-        
-        overwrites = channel.overwrites
-        
-        overwrites[user] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
-        await channel.edit(overwrites=overwrites)
-        
-        
-        logger.info(f"Added user {user.id} to ticket {ticket_id}")
-
-async def remove_from_ticket(channel: discord.TextChannel, user: discord.User):
-    if db_ticket_channel_exists(channel.id):
-        ticket_id = db_get_ticket_id(channel.id)
-        # db_remove_user_from_ticket(ticket_id, user.id)
-
-        overwrites = channel.overwrites
-
-        if user in overwrites:
-            del overwrites[user]
-            await channel.edit(overwrites=overwrites)
-
-        logger.info(f"Removed user {user.id} from ticket {ticket_id}")
-
-async def claim_ticket(channel: discord.TextChannel, staff_member: discord.Member):
-    if not db_ticket_channel_exists(channel.id):
-        return "error"
-    ticket_id = db_get_ticket_id(channel.id)
-    modified = db_claim_ticket(ticket_id, staff_member.id)
-    logger.debug("Claim attempt ticket_id=%s staff=%s rowcount=%s", ticket_id, staff_member.id, modified)
-    if modified:
+    Raises asyncio.QueueFull when the backlog is full.
+    """
+    return await provisioning_queue.submit(create_ticket, guild, creator_user, support_role_id)
+
+async def request_ticket(guild: discord.Guild, creator_user, support_role_id):
+    """Admission-controlled entry point used by the panel button and /ticket create.
+
+    Returns (status, ticket_id) where status is "created", "limit_reached",
+    "busy" (queue full or shutting down) or "failed". Repeated clicks by the same user while a request is in
+    flight share that request's result instead of provisioning again.
+    """
+    key = (guild.id, creator_user.id)
+    inflight = _inflight.get(key)
+    if inflight is None:
+        inflight = asyncio.ensure_future(_admit_and_provision(guild, creator_user, support_role_id))
+        _inflight[key] = inflight
+        inflight.add_done_callback(lambda _: _inflight.pop(key, None))
+    try:
+        return await asyncio.shield(inflight)
+    except ShuttingDown:
+        return "busy", None
+
+@lifecycle.tracked
+async def _admit_and_provision(guild: discord.Guild, creator_user, support_role_id):
+    # Reject before touching the Discord API or the provisioning queue
+    if MAX_OPEN_TICKETS_PER_USER > 0:
+        open_count = await db_count_open_tickets(guild.id, creator_user.id)
+        if open_count >= MAX_OPEN_TICKETS_PER_USER:
+            logger.info("User %s at open ticket limit (%s) in guild %s", creator_user.id, open_count, guild.id)
+            return "limit_reached", None
+    try:
+        ticket_id = await provision_ticket(guild, creator_user, support_role_id)
+    except asyncio.QueueFull:
+        logger.warning("Provisioning queue full; rejecting ticket for user %s", creator_user.id)
+        return "busy", None
+    except ShuttingDown:
+        return "busy", None
+    except Exception as e:
+        logger.error("Failed to create ticket: %s", e)
+        return "failed", None
+    if ticket_id is None:
+        return "failed", None
+    return "created", ticket_id
+
+@lifecycle.tracked
+async def delete_ticket(channel, ticket, priority=PRIORITY_INTERACTIVE, actor=None):
+    ticket_id = ticket["id"]
+    # A close-time export still reading the history would fail once the channel is gone
+    await wait_for_export(ticket_id)
+    if TRANSCRIPT_ON_DELETE:
+        # The history is gone once the channel is deleted
+        try:
+            await export_transcript(channel, ticket)
+        except Exception as e:
+            logger.error("Transcript export for ticket %s failed: %s", ticket_id, e)
+    await scheduler.delete_channel(channel, priority)
+    await db_delete_ticket(ticket_id)
+    # The row is gone; the event log keeps the ticket's history
+    record_event(ticket, events.DELETED, actor, creator_id=ticket.get("creator_id"), status=ticket.get("status"))
+    logger.info(f"Deleted ticket {ticket_id}")
+
+@lifecycle.tracked
+async def close_ticket(channel:discord.TextChannel, ticket, guild:discord.Guild, support_role_id, creator_user, priority=PRIORITY_INTERACTIVE, actor=None, reason=None):
+    ticket_id = ticket["id"]
+    if await db_close_ticket(ticket_id):
+        record_event(ticket, events.CLOSED, actor, **({"reason": reason} if reason else {}))
+
+    support_role = guild.get_role(support_role_id) if support_role_id else None
+
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+        creator_user: discord.PermissionOverwrite(read_messages=True, send_messages=False)
+    }
+    if support_role is not None:
+        overwrites[support_role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+
+    await scheduler.edit_overwrites(channel, overwrites, priority, replace=True)
+
+    embed = close_ticket_embed(ticket_id, creator_user)
+
+    await channel.send(embed=embed)
+    logger.info(f"Closed ticket {ticket_id}")
+    if TRANSCRIPT_ON_CLOSE:
+        export_in_background(channel, ticket)
+
+@lifecycle.tracked
+async def add_to_ticket(channel: discord.TextChannel, ticket, *users: discord.User, actor=None):
+    """Grant one or more users access; all of them cost a single overwrite request."""
+    ticket_id = ticket["id"]
+    overwrite = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+    await scheduler.edit_overwrites(channel, {user: overwrite for user in users})
+    await db_add_users_to_ticket(ticket_id, [user.id for user in users])
+    record_event(ticket, events.USERS_ADDED, actor, user_ids=[user.id for user in users])
+
+    logger.info("Added users %s to ticket %s", [user.id for user in users], ticket_id)
+
+@lifecycle.tracked
+async def remove_from_ticket(channel: discord.TextChannel, ticket, *users: discord.User, actor=None):
+    ticket_id = ticket["id"]
+    present = [user for user in users if user in channel.overwrites]
+    if present:
+        await scheduler.edit_overwrites(channel, {user: None for user in present})
+    await db_remove_users_from_ticket(ticket_id, [user.id for user in users])
+    record_event(ticket, events.USERS_REMOVED, actor, user_ids=[user.id for user in users])
+
+    logger.info("Removed users %s from ticket %s", [user.id for user in users], ticket_id)
+
+@lifecycle.tracked
+async def claim_ticket(channel: discord.TextChannel, ticket, staff_member: discord.Member):
+    """Returns (outcome, claimed_by); outcome is "success", "already_yours", "already_claimed" or "not_found".
+
+    Only "success" (this call took the claim) announces it and records the event.
+    """
+    ticket_id = ticket["id"]
+    outcome, claimed_by = await db_claim_ticket(ticket_id, staff_member.id)
+    logger.debug("Claim attempt ticket_id=%s staff=%s outcome=%s claimed_by=%s", ticket_id, staff_member.id, outcome, claimed_by)
+    if outcome == "success":
+        record_event(ticket, events.CLAIMED, staff_member)
         embed = claim_ticket_embed(ticket_id, staff_member)
         await channel.send(embed=embed)
-        return "success"
-    # No row modified: either already claimed or missing. Fetch for clarity.
-    ticket_record = db_get_ticket(ticket_id)
-    logger.debug("Post-claim fetch ticket_id=%s record=%s", ticket_id, ticket_record)
-    if ticket_record and ticket_record.get("claimed_by") and ticket_record.get("claimed_by") != staff_member.id:
-        return "already_claimed"
-    if not ticket_record:
-        return "error"
-    # If claimed_by is None still, then maybe race or backend issue.
-    return "error"
+    return outcome, claimed_by
 
-async def unclaim_ticket(channel: discord.TextChannel, staff_member: discord.Member):
-    if not db_ticket_channel_exists(channel.id):
-        return "error"
-    ticket_id = db_get_ticket_id(channel.id)
-    modified = db_unclaim_ticket(ticket_id, staff_member.id)
+@lifecycle.tracked
+async def unclaim_ticket(channel: discord.TextChannel, ticket, staff_member: discord.Member):
+    ticket_id = ticket["id"]
+    modified = await db_unclaim_ticket(ticket_id, staff_member.id)
     if modified:
+        record_event(ticket, events.UNCLAIMED, staff_member)
         await channel.send(f"Ticket unclaimed by {staff_member.mention}")
         return "success"
     return "error"
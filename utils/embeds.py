@@ -12,10 +12,11 @@ def create_ticket_embed(ticket_id, creator_user, channel):
     return embed
 
 def close_ticket_embed(ticket_id, creator_user):
+    # creator_user may be a discord.Object when the creator left the server
     embed = discord.Embed(
         title="Ticket Closed",
         description=f"Ticket ID: {ticket_id}\n"
-                    f"Creator: {creator_user.mention}\n"
+                    f"Creator: <@{creator_user.id}>\n"
                     f"**Thank you for using our support system!**",
         color=discord.Color.red()
     )
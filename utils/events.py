@@ -0,0 +1,38 @@
+import os
+from datetime import datetime, timezone
+
+from db.db_interface import db_record_events
+from utils.batching import BatchWriter
+from utils.lifecycle import lifecycle
+
+# Event names recorded in ticket_events
+CREATED = "created"
+CLOSED = "closed"
+DELETED = "deleted"
+ARCHIVED = "archived"
+CLAIMED = "claimed"
+UNCLAIMED = "unclaimed"
+USERS_ADDED = "users_added"
+USERS_REMOVED = "users_removed"
+
+# Write-behind buffer: recording an event never waits on the database.
+# It is drained on shutdown, after all in-flight ticket operations.
+event_log = BatchWriter(
+    "ticket_events",
+    db_record_events,
+    max_batch=int(os.getenv("TICKET_EVENTS_BATCH", 200)),
+    interval=float(os.getenv("TICKET_EVENTS_INTERVAL", 1.0)),
+)
+lifecycle.on_shutdown("ticket events", event_log.close)
+
+
+def record_event(ticket, event, actor=None, **data):
+    """Queue an audit event for ``ticket``; ``actor`` is the user who caused it (None for the bot)."""
+    event_log.add({
+        "ticket_id": ticket["id"],
+        "guild_id": ticket["guild_id"],
+        "event": event,
+        "actor_id": actor.id if actor is not None else None,
+        "data": data or None,
+        "created_at": datetime.now(tz=timezone.utc),
+    })
@@ -0,0 +1,69 @@
+"""Per-guild settings, stored in the database and cached in memory.
+
+A guild without a stored support role falls back to SUPPORT_ROLE_ID from the
+environment, so a single-guild deployment needs no setup. Every interaction
+of a guild reaches the one process that runs its shard, and that process
+evicts its own cache entry when it changes the setting. GUILD_CONFIG_TTL
+only bounds how long an edit made elsewhere (by hand, or from another
+deployment) takes to show up.
+"""
+import logging
+import os
+import time
+
+from discord import app_commands
+
+from db.db_interface import db_get_guild_config, db_set_guild_config
+
+logger = logging.getLogger("keepalivebot.utils.guildconfig")
+
+GUILD_CONFIG_TTL = float(os.getenv("GUILD_CONFIG_TTL", 300))
+DEFAULT_SUPPORT_ROLE_ID = int(os.getenv("SUPPORT_ROLE_ID") or 0) or None
+
+_cache = {}  # guild_id -> (expires_at, config row or None)
+
+
+class SupportRoleNotConfigured(app_commands.CheckFailure):
+    """The guild has no support role, neither stored nor from the environment."""
+
+
+async def get_guild_config(guild_id):
+    entry = _cache.get(guild_id)
+    now = time.monotonic()
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    config = await db_get_guild_config(guild_id)
+    _cache[guild_id] = (now + GUILD_CONFIG_TTL, config)
+    return config
+
+
+async def support_role_id(guild_id):
+    """The guild's support role id, or None when it has none."""
+    config = await get_guild_config(guild_id)
+    if config is not None and config.get("support_role_id"):
+        return int(config["support_role_id"])
+    return DEFAULT_SUPPORT_ROLE_ID
+
+
+async def set_support_role(guild_id, role_id):
+    await db_set_guild_config(guild_id, role_id)
+    _cache.pop(guild_id, None)
+    logger.info("Support role of guild %s set to %s", guild_id, role_id)
+
+
+def forget_guild(guild_id):
+    _cache.pop(guild_id, None)
+
+
+def is_support():
+    """Like ``app_commands.checks.has_role``, with the role looked up per guild at call time."""
+    async def predicate(interaction):
+        if interaction.guild is None:
+            raise app_commands.NoPrivateMessage()
+        role_id = await support_role_id(interaction.guild_id)
+        if role_id is None:
+            raise SupportRoleNotConfigured("No support role is set for this server yet. Ask an admin to run /ticket support-role.")
+        if not any(role.id == role_id for role in getattr(interaction.user, "roles", ())):
+            raise app_commands.MissingRole(role_id)
+        return True
+    return app_commands.check(predicate)
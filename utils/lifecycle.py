@@ -0,0 +1,107 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+
+logger = logging.getLogger("keepalivebot.utils.lifecycle")
+
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 30))
+
+# Shutdown phases, run in this order
+PHASE_DRAIN = 0  # queued ticket work: provisioning queue, transcript exports
+PHASE_REST = 1  # Discord requests queued by that work
+PHASE_FLUSH = 2  # write-behind buffers
+PHASE_CLOSE = 3  # database connections
+
+
+# Shown to users whose command arrives after shutdown began
+RESTARTING_MESSAGE = "The bot is restarting, please try again in a moment."
+
+
+class ShuttingDown(Exception):
+    """Raised by tracked operations started after shutdown began."""
+
+
+class Lifecycle:
+    """Tracks in-flight ticket operations and runs the shutdown sequence.
+
+    Operations wrapped with ``tracked`` (or run inside ``operation()``) are
+    counted. ``shutdown`` stops admitting new ones, waits for the running ones,
+    then runs the registered drain callbacks phase by phase, all within one
+    deadline.
+    """
+
+    def __init__(self):
+        self.accepting = True
+        self.in_flight = 0
+        self._idle = None
+        self._callbacks = []  # (phase, order, name, coroutine function)
+        self._shutdown_task = None
+
+    def _idle_event(self):
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            if self.in_flight == 0:
+                self._idle.set()
+        return self._idle
+
+    def operation(self):
+        return _Operation(self)
+
+    def tracked(self, fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            async with self.operation():
+                return await fn(*args, **kwargs)
+        return wrapper
+
+    def on_shutdown(self, name, fn, phase=PHASE_FLUSH):
+        self._callbacks.append((phase, len(self._callbacks), name, fn))
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """Start the shutdown sequence once; later calls return the same task."""
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.ensure_future(self._shutdown(timeout))
+        return self._shutdown_task
+
+    async def _shutdown(self, timeout):
+        started = time.perf_counter()
+        deadline = started + timeout
+        self.accepting = False
+        logger.info("Shutdown: no longer accepting work; %d operation(s) in flight", self.in_flight)
+        try:
+            await asyncio.wait_for(self._idle_event().wait(), timeout=max(deadline - time.perf_counter(), 0))
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown: %d operation(s) still running after %.0fs", self.in_flight, timeout)
+        for _, _, name, fn in sorted(self._callbacks, key=lambda c: c[:2]):
+            remaining = deadline - time.perf_counter()
+            try:
+                # Closing connections is never skipped, even past the deadline
+                await asyncio.wait_for(fn(), timeout=max(remaining, 1.0))
+            except asyncio.TimeoutError:
+                logger.warning("Shutdown: %s did not finish in time", name)
+            except Exception as e:
+                logger.error("Shutdown: %s failed: %s", name, e)
+        logger.info("Shutdown: drained in %.2fs", time.perf_counter() - started)
+
+
+class _Operation:
+    def __init__(self, lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __aenter__(self):
+        lc = self.lifecycle
+        if not lc.accepting:
+            raise ShuttingDown()
+        lc.in_flight += 1
+        lc._idle_event().clear()
+
+    async def __aexit__(self, *exc):
+        lc = self.lifecycle
+        lc.in_flight -= 1
+        if lc.in_flight == 0:
+            lc._idle_event().set()
+
+
+lifecycle = Lifecycle()
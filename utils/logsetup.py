@@ -0,0 +1,152 @@
+"""Logging that keeps file and console I/O off the event loop.
+
+``setup_logging`` gives the root logger one ``QueueHandler``. The real
+handlers (console, and a rotating log file) run on a ``QueueListener``
+thread. A log call on the loop then only formats the message and puts it on
+a queue.
+
+Configuration:
+- LOG_FILE: the log file; empty disables it
+- LOG_MAX_BYTES / LOG_BACKUP_COUNT: rotate by size
+- LOG_ROTATE_WHEN: rotate by time instead (``midnight``, ``h``, ... as in
+  ``TimedRotatingFileHandler``)
+- LOG_COMPRESS: gzip rotated files
+- LOG_FORMAT=json: one JSON object per line
+
+Records carry ``guild_id`` and ``ticket_id`` when they are known, either
+passed via ``extra=`` or bound for the current task with ``bind``. The JSON
+format emits them as fields.
+"""
+import atexit
+import contextvars
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+from datetime import datetime, timezone
+
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1") == "1"
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+CONTEXT_FIELDS = ("guild_id", "ticket_id")
+
+_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+
+
+def bind(**fields):
+    """Attach fields to every record logged from the current task (and tasks it starts)."""
+    _context.set({**_context.get(), **fields})
+
+
+class _ContextFilter(logging.Filter):
+    # Runs on the loop thread, where the task's context is visible
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Render the message and traceback now, since args and exc_info may not
+        # survive the trip to the other thread. The traceback is kept apart in
+        # exc_text so JSON output can keep it as its own field.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def _gzip_namer(name):
+    return f"{name}.gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(path):
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", utc=True,
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8",
+        )
+    if LOG_COMPRESS:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(level=logging.INFO):
+    """Route the root logger through a queue to console and file handlers on a background thread."""
+    global _listener
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        handlers.append(_file_handler(LOG_FILE))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # After asyncio.run returns, so records from the shutdown sequence are written too
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out everything still queued and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
@@ -0,0 +1,243 @@
+"""Latency histograms, a Prometheus ``/metrics`` endpoint and a sampling profiler.
+
+Metrics are off unless METRICS_PORT is set. When they are off, nothing is
+wrapped or recorded, so the hot paths pay nothing. When they are on:
+
+- every backend coroutine behind ``db_*`` is timed per backend and operation
+  (see ``Backend.__getattr__``)
+- every Discord REST call is timed per method and route template
+- every slash command is timed from dispatch to completion
+- ``stats()`` snapshots registered with a ``StatsGauges`` (the MySQL pool,
+  the work queues, the REST scheduler, the ticket cache) are read as gauges on each scrape
+
+The endpoint binds to METRICS_HOST (127.0.0.1 by default). It also serves
+``/profile/start`` and ``/profile/stop``, which toggle a sampling profiler
+at runtime. The profiler samples the event loop thread's stack every
+PROFILE_INTERVAL_MS. ``stop`` returns the samples as collapsed stacks, which
+flamegraph.pl and speedscope can read.
+"""
+import asyncio
+import bisect
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger("keepalivebot.utils.metrics")
+
+# Imported by db.db_interface before it loads .env, so load it here first
+load_dotenv()
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+
+enabled = METRICS_PORT > 0
+
+# Seconds; from sub-millisecond SQLite reads up to rate-limited Discord calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values, rendered in Prometheus text format."""
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum]
+
+    def observe(self, value, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total) in sorted(self._series.items()):
+            labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labelvalues))
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines)
+
+
+class StatsGauges:
+    """Gauges read at scrape time from ``stats()``-style callbacks, one metric per numeric key."""
+
+    def __init__(self, prefix, help, labelnames=()):
+        self.prefix = prefix
+        self.help = help
+        self.labelnames = labelnames
+        self._sources = {}  # label values -> callable returning a dict (or None when there is nothing to report)
+
+    def register(self, collect, *labelvalues):
+        self._sources[labelvalues] = collect
+
+    def render(self):
+        samples = collections.defaultdict(list)
+        for labelvalues in sorted(self._sources):
+            stats = self._sources[labelvalues]() or {}
+            labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labelvalues))
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    samples[key].append(f"{self.prefix}_{key}{{{labels}}} {value}")
+        lines = []
+        for key, series in samples.items():
+            lines += [f"# HELP {self.prefix}_{key} {self.help}: {key}", f"# TYPE {self.prefix}_{key} gauge", *series]
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+db_seconds = Histogram("ticketbot_db_seconds", "Backend call latency", ("backend", "op"))
+discord_seconds = Histogram("ticketbot_discord_api_seconds", "Discord REST call latency", ("method", "route", "status"))
+command_seconds = Histogram("ticketbot_command_seconds", "Slash command latency, dispatch to completion", ("command", "outcome"))
+HISTOGRAMS = (db_seconds, discord_seconds, command_seconds)
+
+mysql_pool = StatsGauges("ticketbot_mysql_pool", "MySQL connection pool")
+work_queues = StatsGauges("ticketbot_workqueue", "Work queue", ("queue",))
+rest_scheduler = StatsGauges("ticketbot_rest_scheduler", "Discord REST scheduler")
+rest_wait_seconds = StatsGauges("ticketbot_rest_wait_seconds", "Discord REST scheduler queue wait", ("priority",))
+ticket_cache = StatsGauges("ticketbot_ticket_cache", "Ticket record cache")
+GAUGES = (mysql_pool, work_queues, rest_scheduler, rest_wait_seconds, ticket_cache)
+
+
+def render():
+    return "\n".join(filter(None, (m.render() for m in (*HISTOGRAMS, *GAUGES)))) + "\n"
+
+
+def instrument_db(backend, op, fn):
+    """Wrap a backend coroutine function so each call lands in ``db_seconds``."""
+    @functools.wraps(fn)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            db_seconds.observe(time.perf_counter() - started, backend, op)
+    return timed
+
+
+def instrument_http(http):
+    """Time every request made through a discord.py ``HTTPClient``, including its 429 retries."""
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await request(route, **kwargs)
+        except Exception as e:
+            status = str(getattr(e, "status", "error"))
+            raise
+        finally:
+            discord_seconds.observe(time.perf_counter() - started, route.method, route.path, status)
+
+    http.request = timed_request
+
+
+def command_started(interaction):
+    interaction.extras["started"] = time.perf_counter()
+
+
+def command_finished(interaction, command, outcome):
+    started = interaction.extras.get("started")
+    if started is not None and command is not None:
+        command_seconds.observe(time.perf_counter() - started, command.qualified_name, outcome)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack from a background thread and counts identical stacks."""
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, thread_id=None):
+        if self.running:
+            return False
+        self._target = thread_id or threading.get_ident()
+        self.samples.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stop sampling and return the stacks in collapsed ("a;b;c count") form."""
+        if not self.running:
+            return ""
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
+_runner = None
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    global _runner
+    from aiohttp import web  # ships with discord.py
+
+    async def metrics(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    async def profile_start(request):
+        started = profiler.start()
+        return web.Response(text="started\n" if started else "already running\n")
+
+    async def profile_stop(request):
+        # Joining the sampler thread takes at most one interval
+        return web.Response(text=await asyncio.to_thread(profiler.stop))
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/profile/start", profile_start)
+    app.router.add_post("/profile/stop", profile_stop)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logger.info("Metrics on http://%s:%d/metrics", host, port)
+
+
+async def stop_server():
+    global _runner
+    profiler.stop()
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,91 @@
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import discord
+
+from db.db_interface import db_get_guild_tickets, db_delete_tickets, db_close_tickets
+from db.rollups import as_utc
+from utils import events
+from utils.events import record_event
+
+logger = logging.getLogger("keepalivebot.utils.reconcile")
+
+RECONCILE_ON_STARTUP = os.getenv("RECONCILE_ON_STARTUP", "1") == "1"
+# Rows per batched delete/close
+RECONCILE_BATCH_SIZE = 500
+
+CHANNEL_PREFIX = "ticket-"
+
+
+def _batches(items, size=RECONCILE_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def reconcile_guild(guild: discord.Guild, started_before=None):
+    """Bring ticket rows back in line with the guild's channels.
+
+    Loads every live ticket of the guild in one query and compares its
+    channel ids with ``guild.text_channels`` using sets:
+
+    - rows without a channel created before ``started_before`` are leftovers
+      of an interrupted create and are deleted
+    - open rows created before ``started_before`` whose channel no longer
+      exists are closed
+    - ``ticket-*`` channels that no row points at are only logged, since
+      they may hold history someone still wants
+
+    Rows created by this process (at or after ``started_before``) are never
+    touched, so provisioning can run while this does. Returns the stats.
+    """
+    started = time.perf_counter()
+    started_before = started_before or datetime.now(tz=timezone.utc)
+    rows = await db_get_guild_tickets(guild.id)
+    loaded = time.perf_counter()
+
+    channel_ids = {channel.id for channel in guild.text_channels}
+    by_channel = {int(row["channel_id"]): row for row in rows if row.get("channel_id") is not None}
+
+    orphan_rows = [
+        row for row in rows
+        if row.get("channel_id") is None and as_utc(row["created_at"]) < started_before
+    ]
+    missing = by_channel.keys() - channel_ids
+    # The channel of a ticket created after startup may not be in the cache yet
+    dangling = [
+        by_channel[cid] for cid in missing
+        if by_channel[cid]["status"] != "closed" and as_utc(by_channel[cid]["created_at"]) < started_before
+    ]
+    unknown_channels = [
+        channel for channel in guild.text_channels
+        if channel.name.startswith(CHANNEL_PREFIX) and channel.id not in by_channel
+    ]
+
+    deleted = closed = 0
+    for batch in _batches(orphan_rows):
+        deleted += await db_delete_tickets([row["id"] for row in batch])
+        for row in batch:
+            record_event({"id": row["id"], "guild_id": guild.id}, events.DELETED, reason="reconcile_no_channel")
+    for batch in _batches(dangling):
+        closed += await db_close_tickets([row["id"] for row in batch])
+        for row in batch:
+            record_event({"id": row["id"], "guild_id": guild.id}, events.CLOSED, reason="reconcile_channel_missing")
+    if unknown_channels:
+        logger.warning(
+            "Guild %s has %d ticket channel(s) without a ticket row: %s",
+            guild.id, len(unknown_channels), ", ".join(f"#{c.name} ({c.id})" for c in unknown_channels[:20]),
+        )
+
+    stats = {
+        "tickets": len(rows),
+        "channels": len(channel_ids),
+        "orphan_rows_deleted": deleted,
+        "dangling_rows_closed": closed,
+        "unknown_channels": len(unknown_channels),
+        "load_ms": round((loaded - started) * 1000, 1),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info("Reconciled guild %s: %s", guild.id, stats)
+    return stats
@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+import discord
+
+from utils import metrics
+from utils.lifecycle import lifecycle, PHASE_REST
+
+logger = logging.getLogger("keepalivebot.utils.restscheduler")
+
+# Lower runs first
+PRIORITY_CREATE = 0  # user waiting on a new ticket channel
+PRIORITY_INTERACTIVE = 1  # staff commands (close, add, remove, delete)
+PRIORITY_BACKGROUND = 2  # sweeps: auto-close, purge, reconciliation
+PRIORITY_NAMES = {PRIORITY_CREATE: "create", PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+MAX_429_RETRIES = 3
+# How long an overwrite edit waits for other changes to the same channel
+OVERWRITE_BATCH_WINDOW = float(os.getenv("OVERWRITE_BATCH_WINDOW", 0.25))
+
+
+class _Job:
+    __slots__ = ("fn", "future", "enqueued_at", "priority", "queued", "started", "channel", "changes", "replace")
+
+    def __init__(self, fn, priority):
+        self.fn = fn
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.perf_counter()
+        self.priority = priority
+        self.queued = False
+        self.started = False
+        self.channel = None
+        self.changes = None
+        self.replace = False
+
+
+class _Bucket:
+    def __init__(self):
+        self.heap = []
+        self.worker = None
+
+
+class RestScheduler:
+    """Orders channel create/edit/delete calls per Discord route bucket.
+
+    Channel creation shares the per-guild ``POST /guilds/{id}/channels`` bucket.
+    Edits and deletes share the per-channel ``/channels/{id}`` bucket. Each
+    bucket is drained by one worker in priority order, so a sweep that closes
+    hundreds of tickets cannot starve a user waiting for a new channel.
+    Overwrite changes for one channel that arrive close together are merged
+    into a single request (see ``edit_overwrites``).
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._pending_overwrites = {}  # channel_id -> queued overwrite _Job
+        self._seq = itertools.count()
+        self.wait_stats = {p: {"count": 0, "total": 0.0, "max": 0.0} for p in PRIORITY_NAMES}
+        self.coalesced = 0
+        self.retried_429 = 0
+        metrics.rest_scheduler.register(self.stats)
+        for priority, name in PRIORITY_NAMES.items():
+            metrics.rest_wait_seconds.register(self.wait_stats[priority].copy, name)
+
+    def _push(self, key, job):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        job.queued = True
+        heapq.heappush(bucket.heap, (job.priority, next(self._seq), job))
+        if bucket.worker is None or bucket.worker.done():
+            bucket.worker = asyncio.create_task(self._drain(key, bucket))
+
+    async def _drain(self, key, bucket):
+        while bucket.heap:
+            _, _, job = heapq.heappop(bucket.heap)
+            if job.started:
+                # duplicate entry left behind by a priority upgrade
+                continue
+            job.started = True
+            if job.channel is not None:
+                self._pending_overwrites.pop(job.channel.id, None)
+            waited = time.perf_counter() - job.enqueued_at
+            stats = self.wait_stats[job.priority]
+            stats["count"] += 1
+            stats["total"] += waited
+            stats["max"] = max(stats["max"], waited)
+            try:
+                result = await self._call(job.fn)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+        self._buckets.pop(key, None)
+
+    async def _call(self, fn):
+        for attempt in range(MAX_429_RETRIES + 1):
+            try:
+                return await fn()
+            except discord.RateLimited as e:
+                if attempt == MAX_429_RETRIES:
+                    raise
+                retry_after = e.retry_after
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == MAX_429_RETRIES:
+                    raise
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+            self.retried_429 += 1
+            logger.warning("Rate limited, retrying in %.2fs", retry_after)
+            await asyncio.sleep(retry_after)
+
+    def submit(self, key, fn, priority=PRIORITY_INTERACTIVE):
+        job = _Job(fn, priority)
+        self._push(key, job)
+        return job.future
+
+    async def create_text_channel(self, guild: discord.Guild, name, overwrites, priority=PRIORITY_CREATE, **kwargs):
+        return await self.submit(
+            ("guild_channels", guild.id),
+            lambda: guild.create_text_channel(name, overwrites=overwrites, **kwargs),
+            priority,
+        )
+
+    async def delete_channel(self, channel, priority=PRIORITY_INTERACTIVE):
+        return await self.submit(("channel", channel.id), channel.delete, priority)
+
+    async def edit_overwrites(self, channel, changes, priority=PRIORITY_INTERACTIVE, replace=False):
+        """Apply permission overwrite changes to a channel.
+
+        ``changes`` maps target -> PermissionOverwrite, or None to remove the
+        target. The edit waits ``OVERWRITE_BATCH_WINDOW`` seconds, and every
+        change for the channel made meanwhile (or while it is queued) is merged
+        into it. A single target is sent as a targeted permission PUT/DELETE,
+        which cannot clobber other targets. Several targets are applied in one
+        PATCH on top of the channel's current overwrites. ``replace=True``
+        replaces the whole map instead.
+        """
+        job = self._pending_overwrites.get(channel.id)
+        if job is not None and not job.started:
+            if replace:
+                job.changes = dict(changes)
+                job.replace = True
+            else:
+                job.changes.update(changes)
+            self.coalesced += 1
+            if priority < job.priority:
+                job.priority = priority
+                if job.queued:
+                    self._push(("channel", channel.id), job)
+            return await asyncio.shield(job.future)
+
+        job = _Job(None, priority)
+        job.channel = channel
+        job.changes = dict(changes)
+        job.replace = replace
+
+        async def apply():
+            if len(job.changes) == 1 and not job.replace:
+                (target, overwrite), = job.changes.items()
+                return await channel.set_permissions(target, overwrite=overwrite)
+            overwrites = {} if job.replace else dict(channel.overwrites)
+            for target, overwrite in job.changes.items():
+                if overwrite is None:
+                    overwrites.pop(target, None)
+                else:
+                    overwrites[target] = overwrite
+            return await channel.edit(overwrites=overwrites)
+
+        job.fn = apply
+        self._pending_overwrites[channel.id] = job
+        if OVERWRITE_BATCH_WINDOW > 0:
+            asyncio.get_running_loop().call_later(OVERWRITE_BATCH_WINDOW, self._push, ("channel", channel.id), job)
+        else:
+            self._push(("channel", channel.id), job)
+        return await asyncio.shield(job.future)
+
+    async def drain(self):
+        """Wait until every queued request, including batching overwrite edits, has run."""
+        while True:
+            waits = [b.worker for b in self._buckets.values() if b.worker is not None]
+            waits += [job.future for job in self._pending_overwrites.values()]
+            if not waits:
+                return
+            await asyncio.wait(waits)
+
+    def stats(self):
+        return {
+            "buckets": len(self._buckets),
+            "queued": sum(len(b.heap) for b in self._buckets.values()),
+            "coalesced": self.coalesced,
+            "retried_429": self.retried_429,
+            "wait_seconds": {
+                p: {**s, "avg": s["total"] / s["count"] if s["count"] else 0.0}
+                for p, s in self.wait_stats.items()
+            },
+        }
+
+
+scheduler = RestScheduler()
+lifecycle.on_shutdown("REST scheduler", scheduler.drain, PHASE_REST)
@@ -0,0 +1,30 @@
+import os
+
+import discord
+
+from db.db_interface import db_index_messages
+from utils.batching import BatchWriter
+from utils.lifecycle import lifecycle
+
+# Messages are indexed in batches off the on_message hot path
+message_indexer = BatchWriter(
+    "message_index",
+    db_index_messages,
+    max_batch=int(os.getenv("SEARCH_INDEX_BATCH", 500)),
+    interval=float(os.getenv("SEARCH_INDEX_INTERVAL", 2.0)),
+)
+lifecycle.on_shutdown("search index", message_indexer.close)
+
+
+def index_message(message: discord.Message, ticket):
+    if not message.content:
+        return
+    message_indexer.add({
+        "message_id": message.id,
+        "ticket_id": ticket["id"],
+        "guild_id": message.guild.id,
+        "channel_id": message.channel.id,
+        "author_id": message.author.id,
+        "created_at": message.created_at,
+        "content": message.content,
+    })
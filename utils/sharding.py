@@ -0,0 +1,49 @@
+"""Shard settings for running the bot across several processes.
+
+SHARD_COUNT turns on ``AutoShardedBot``. It takes a number, or ``auto`` to
+use the count Discord recommends. SHARD_IDS (comma separated, needs a
+numeric SHARD_COUNT) selects which of those shards this process runs.
+Processes that split the shards between them share one database, and each
+guild's interactions, cache entries and background sweeps belong to the
+process that runs its shard.
+"""
+import os
+
+SHARD_COUNT = os.getenv("SHARD_COUNT", "")
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()]
+
+enabled = bool(SHARD_COUNT or SHARD_IDS)
+
+
+def bot_options():
+    """Keyword arguments for ``AutoShardedBot``."""
+    if SHARD_IDS and not SHARD_COUNT.isdigit():
+        raise ValueError("SHARD_IDS needs a numeric SHARD_COUNT")
+    options = {}
+    if SHARD_COUNT.isdigit():
+        options["shard_count"] = int(SHARD_COUNT)
+    if SHARD_IDS:
+        options["shard_ids"] = SHARD_IDS
+    return options
+
+
+def runs_all_shards(bot):
+    shard_ids = getattr(bot, "shard_ids", None)
+    return not bot.shard_count or shard_ids is None or len(set(shard_ids)) >= bot.shard_count
+
+
+def owned_guild_ids(bot):
+    """Ids of the guilds this process serves, or None when it serves every shard.
+
+    Sweeps over all tickets use this so that two processes never act on the
+    same guild.
+    """
+    if runs_all_shards(bot):
+        return None
+    return [guild.id for guild in bot.guilds]
+
+
+def syncs_commands(bot):
+    # Global commands are shared by every shard; one process registers them
+    shard_ids = getattr(bot, "shard_ids", None)
+    return not shard_ids or 0 in shard_ids
@@ -0,0 +1,167 @@
+import asyncio
+import gzip
+import html
+import io
+import json
+import logging
+import os
+import tempfile
+
+import discord
+
+from utils.lifecycle import lifecycle, PHASE_DRAIN
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is always available
+    zstandard = None
+
+logger = logging.getLogger("keepalivebot.utils.transcripts")
+
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "transcripts")
+TRANSCRIPT_FORMAT = os.getenv("TRANSCRIPT_FORMAT", "jsonl")  # jsonl or html
+TRANSCRIPT_COMPRESSION = os.getenv("TRANSCRIPT_COMPRESSION", "gzip")  # gzip or zstd
+TRANSCRIPT_ON_CLOSE = os.getenv("TRANSCRIPT_ON_CLOSE", "1") == "1"
+TRANSCRIPT_ON_DELETE = os.getenv("TRANSCRIPT_ON_DELETE", "1") == "1"
+# Messages serialized per write; bounds memory regardless of channel size
+TRANSCRIPT_CHUNK_SIZE = 500
+
+_HTML_HEAD = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<style>body{{font-family:sans-serif}}.msg{{margin:4px 0}}.meta{{color:#777;font-size:.85em}}</style>
+</head><body><h1>{title}</h1>
+"""
+_HTML_TAIL = "</body></html>\n"
+
+# Keep references so background exports are not garbage collected mid-run
+_background = set()
+_running = {}  # ticket id -> its latest background export
+
+
+async def iter_messages(channel: discord.TextChannel):
+    """Yield the channel's history oldest first, one API page at a time."""
+    async for message in channel.history(limit=None, oldest_first=True):
+        yield message
+
+
+def serialize_message(message: discord.Message):
+    return {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "created_at": message.created_at.isoformat(),
+        "edited_at": message.edited_at.isoformat() if message.edited_at else None,
+        "content": message.content,
+        # referenced by URL, never downloaded
+        "attachments": [{"filename": a.filename, "url": a.url, "size": a.size} for a in message.attachments],
+        "embeds": len(message.embeds),
+    }
+
+
+def _render_jsonl(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _render_html(record):
+    links = "".join(
+        f' <a href="{html.escape(a["url"])}">{html.escape(a["filename"])}</a>' for a in record["attachments"]
+    )
+    return (
+        f'<div class="msg"><span class="meta">{html.escape(record["created_at"])} '
+        f'{html.escape(record["author"])}</span><br>{html.escape(record["content"])}{links}</div>\n'
+    )
+
+
+def _open_compressed(path, compression):
+    if compression == "zstd":
+        raw = open(path, "wb")
+        writer = zstandard.ZstdCompressor().stream_writer(raw)
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    return gzip.open(path, "wt", encoding="utf-8")
+
+
+def transcript_path(ticket_id, fmt=None, compression=None):
+    fmt = fmt or TRANSCRIPT_FORMAT
+    compression = compression or TRANSCRIPT_COMPRESSION
+    suffix = ".zst" if compression == "zstd" else ".gz"
+    return os.path.join(TRANSCRIPT_DIR, f"ticket-{ticket_id}.{fmt}{suffix}")
+
+
+async def export_transcript(channel: discord.TextChannel, ticket, fmt=None, compression=None):
+    """Stream the channel history into a compressed transcript file.
+
+    Messages are serialized in chunks of TRANSCRIPT_CHUNK_SIZE, and each chunk is
+    written from a worker thread, so memory stays flat and the event loop never
+    waits on disk or compression. Returns (path, message_count).
+    """
+    fmt = fmt or TRANSCRIPT_FORMAT
+    compression = compression or TRANSCRIPT_COMPRESSION
+    if compression == "zstd" and zstandard is None:
+        logger.warning("zstandard not installed; writing gzip transcript instead")
+        compression = "gzip"
+    render = _render_html if fmt == "html" else _render_jsonl
+    path = transcript_path(ticket["id"], fmt, compression)
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    # Unique per export, so two exports of one ticket never share a temp file
+    fd, tmp_path = tempfile.mkstemp(dir=TRANSCRIPT_DIR, prefix=os.path.basename(path) + ".", suffix=".part")
+    os.close(fd)
+
+    fh = await asyncio.to_thread(_open_compressed, tmp_path, compression)
+    count = 0
+    try:
+        if fmt == "html":
+            await asyncio.to_thread(fh.write, _HTML_HEAD.format(title=html.escape(f"Ticket {ticket['id']}")))
+        chunk = []
+        async for message in iter_messages(channel):
+            chunk.append(render(serialize_message(message)))
+            count += 1
+            if len(chunk) >= TRANSCRIPT_CHUNK_SIZE:
+                await asyncio.to_thread(fh.write, "".join(chunk))
+                chunk = []
+        if chunk:
+            await asyncio.to_thread(fh.write, "".join(chunk))
+        if fmt == "html":
+            await asyncio.to_thread(fh.write, _HTML_TAIL)
+    except BaseException:
+        await asyncio.to_thread(fh.close)
+        os.remove(tmp_path)
+        raise
+    await asyncio.to_thread(fh.close)
+    os.replace(tmp_path, path)
+    logger.info("Exported %d messages from ticket %s to %s", count, ticket["id"], path)
+    return path, count
+
+
+def export_in_background(channel: discord.TextChannel, ticket):
+    async def run():
+        try:
+            await export_transcript(channel, ticket)
+        except Exception as e:
+            logger.error("Transcript export for ticket %s failed: %s", ticket["id"], e)
+
+    ticket_id = ticket["id"]
+    task = asyncio.create_task(run())
+    _background.add(task)
+    _running[ticket_id] = task
+
+    def done(t):
+        _background.discard(t)
+        if _running.get(ticket_id) is t:
+            del _running[ticket_id]
+
+    task.add_done_callback(done)
+    return task
+
+
+async def wait_for_export(ticket_id):
+    """Wait for the ticket's background export, if one is running (e.g. before its channel is deleted)."""
+    task = _running.get(ticket_id)
+    if task is not None:
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def wait_background_exports():
+    await asyncio.gather(*_background, return_exceptions=True)
+
+
+lifecycle.on_shutdown("transcript exports", wait_background_exports, PHASE_DRAIN)
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+
+from utils import metrics
+from utils.lifecycle import ShuttingDown
+
+logger = logging.getLogger("keepalivebot.utils.workqueue")
+
+
+class WorkQueue:
+    """Bounded queue of coroutine jobs drained by a fixed number of workers.
+
+    ``submit`` returns a future for the job's result, so callers that already
+    acknowledged their interaction can await it and send a followup. Bursts
+    beyond ``maxsize`` raise ``asyncio.QueueFull`` instead of piling up, and
+    jobs submitted once ``drain`` has started raise ``ShuttingDown``.
+    """
+
+    def __init__(self, name, concurrency=4, maxsize=100):
+        self.name = name
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self._queue = None
+        self._workers = []
+        self._closed = False
+        self.in_progress = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        metrics.work_queues.register(self.stats, name)
+
+    def _ensure_started(self):
+        # Created lazily: the queue and workers need the running loop
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._workers = [
+                asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}")
+                for i in range(self.concurrency)
+            ]
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, fn, *args, **kwargs):
+        if self._closed:
+            raise ShuttingDown(f"{self.name} queue is drained")
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, kwargs, future))
+        self.max_depth = max(self.max_depth, self.depth)
+        return future
+
+    async def _worker(self):
+        while True:
+            fn, args, kwargs, future = await self._queue.get()
+            self.in_progress += 1
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self.failed += 1
+                logger.error("%s job %s failed: %s", self.name, getattr(fn, "__name__", fn), e)
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.processed += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    async def drain(self):
+        """Stop accepting jobs, wait for the queued ones to finish, then stop the workers."""
+        self._closed = True
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queue = None
+        self._workers = []
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "in_progress": self.in_progress,
+            "processed": self.processed,
+            "failed": self.failed,
+            "concurrency": self.concurrency,
+        }